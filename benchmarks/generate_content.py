@@ -0,0 +1,221 @@
+"""Builds a fake Assetto Corsa install with generated cars and tracks.
+
+The tree follows the layout of real content folders and mixes in the flaws
+found in real mods: files with a BOM, utf-16 and cp1252 encodings, raw
+control characters, trailing commas, malformed json, missing ui files and
+tracks with several layouts. The same seed always gives the same tree.
+
+    python benchmarks/generate_content.py <folder> --cars 2000 --skins 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+
+BRANDS = ['Abarth', 'Alfa Romeo', 'Audi', 'BMW', 'Chevrolet', 'Citroën', 'Ferrari', 'Ford', 'Lamborghini',
+          'Lotus', 'Maserati', 'Mazda', 'McLaren', 'Mercedes-Benz', 'Nissan', 'Porsche', 'Škoda', 'Toyota']
+CLASSES = ['GT3', 'GT2', 'GTE', 'street', 'race', 'drift', 'vintage', 'Formula', 'Touring Car']
+COUNTRIES = ['Italy', 'Germany', 'Japan', 'Great Britain', 'France', 'USA', 'Czech Republic', 'Österreich']
+CITIES = ['Monza', 'Spa', 'Nürburg', 'Imola', 'Suzuka', 'Silverstone', 'Brands Hatch', 'Mugello', 'Zandvoort']
+LENGTH_FORMATS = ['{km:.1f} km', '{km:.3f}km', '{m}m', '{m} m', '{km_comma} km', '{m:,}m', '{m_spaced} m',
+                  '{m_spaced}m', '{m_dotted},0 m', '']
+
+# Share of json files written with each flaw, the rest are plain utf-8
+FLAWS = {
+    'bom': 0.10,
+    'utf-16': 0.02,
+    'cp1252': 0.04,
+    'control-characters': 0.03,
+    'trailing-commas': 0.02,
+    'malformed': 0.01,
+}
+
+# Files found next to the ui folder of a real car and track, left empty
+CAR_FILES = ['data.acd', 'body_shadow.png', 'tyre_0_shadow.png', 'logo.png', 'collider.kn5']
+TRACK_FILES = ['map.png', 'models.ini', 'surfaces.ini']
+
+
+def pick_flaw(rng: random.Random, flaw_rate: float) -> str:
+    value = rng.random()
+    for flaw, share in FLAWS.items():
+        value -= share * flaw_rate
+        if value < 0:
+            return flaw
+    return 'utf-8'
+
+
+def write_json(path: str, data: dict, flaw: str):
+    """Writes data as a ui json file, in the way a mod with `flaw` would.
+    """
+    text = json.dumps(data, indent=2, ensure_ascii=False)
+    encoding = 'utf-8'
+    if flaw == 'bom':
+        encoding = 'utf-8-sig'
+    elif flaw == 'utf-16':
+        encoding = 'utf-16'
+    elif flaw == 'cp1252':
+        encoding = 'cp1252'
+    elif flaw == 'control-characters':
+        # Raw line breaks and tabs inside strings, mostly in descriptions
+        text = text.replace('\\n', '\n').replace('\\t', '\t')
+    elif flaw == 'trailing-commas':
+        text = text.replace('\n  }', ',\n  }').replace('\n}', ',\n}')
+    elif flaw == 'malformed':
+        text = text[:len(text) // 2]
+    with open(path, 'wb') as f:
+        f.write(text.encode(encoding, errors='replace'))
+
+
+def touch(path: str, data: bytes = b''):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def description(rng: random.Random) -> str:
+    words = ['power', 'grip', 'balance', 'downforce', 'chassis', 'engine', 'lap', 'corner', 'turbo', 'weight']
+    lines = [' '.join(rng.choice(words) for _ in range(rng.randint(8, 20))) for _ in range(rng.randint(2, 8))]
+    return '<br>\n\t'.join(lines)
+
+
+def curve(rng: random.Random, peak: int) -> list:
+    return [[str(rpm), str(int(peak * min(1.0, rpm / 6000) * rng.uniform(0.9, 1.0)))]
+            for rpm in range(1000, 9000, 250)]
+
+
+def make_car(rng: random.Random, root: str, i: int, max_skins: int, flaw_rate: float):
+    folder = os.path.join(root, f'{rng.choice(["ks", "rss", "vrc", "acfl", "mod"])}_car_{i:05d}')
+    ui = os.path.join(folder, 'ui')
+    os.makedirs(ui, exist_ok=True)
+    for name in CAR_FILES:
+        touch(os.path.join(folder, name))
+
+    # A few mods ship without a ui file or with it somewhere else
+    if rng.random() < 0.01 * flaw_rate:
+        touch(os.path.join(ui, 'badge.png'))
+    else:
+        bhp = rng.randint(60, 900)
+        weight = rng.randint(550, 2200)
+        data = {
+            'name': f'{rng.choice(BRANDS)} Model {i}',
+            'brand': rng.choice(BRANDS),
+            'description': description(rng),
+            'tags': ['#' + rng.choice(CLASSES), rng.choice(['rwd', 'fwd', 'awd']), 'manual'],
+            'class': rng.choice(CLASSES),
+            'specs': {
+                'bhp': rng.choice([f'{bhp}bhp', f'{bhp} bhp', f'{bhp}hp', f'{bhp} BHP*', '--']),
+                'torque': f'{rng.randint(100, 900)}Nm',
+                'weight': rng.choice([f'{weight}kg', f'{weight:,}kg', f'{weight} kg', f'{weight}kg*',
+                                        f'{weight:,} kg'.replace(',', ' ')]),
+                'topspeed': f'{rng.randint(150, 380)}km/h',
+                'acceleration': f'{rng.uniform(2.5, 12):.1f}s 0-100',
+                'pwratio': f'{weight / bhp:.2f}kg/hp',
+            },
+            'torqueCurve': curve(rng, rng.randint(100, 900)),
+            'powerCurve': curve(rng, bhp),
+            'country': rng.choice(COUNTRIES),
+            'year': rng.randint(1950, 2024),
+            'author': 'Generated',
+        }
+        write_json(os.path.join(ui, 'ui_car.json'), data, pick_flaw(rng, flaw_rate))
+        touch(os.path.join(ui, 'badge.png'))
+        touch(os.path.join(ui, 'upgrade.png'))
+
+    # Most cars have a handful of skins, a few have a lot
+    skins = min(max_skins, max(1, int(rng.paretovariate(1.2) * 3)))
+    for s in range(skins):
+        skin = os.path.join(folder, 'skins', f'{s:02d}_{rng.choice(["red", "blue", "racing", "stock"])}')
+        os.makedirs(skin, exist_ok=True)
+        data = {
+            'skinname': f'Livery {s}',
+            'drivername': rng.choice(['', 'A. Driver', 'B. Racer']),
+            'country': rng.choice(COUNTRIES),
+            'team': rng.choice(['', 'Works', 'Privateer']),
+            'number': str(rng.randint(1, 99)),
+            'priority': rng.choice([0, 0, 1, 2, '']),
+        }
+        write_json(os.path.join(skin, 'ui_skin.json'), data, pick_flaw(rng, flaw_rate))
+        touch(os.path.join(skin, 'preview.jpg'), b'\xff\xd8\xff\xd9')
+        touch(os.path.join(skin, 'livery.png'))
+
+
+def layout_data(rng: random.Random, name: str) -> dict:
+    m = rng.randint(800, 25000)
+    length = rng.choice(LENGTH_FORMATS).format(km=m / 1000, m=m, km_comma=f'{m / 1000:.1f}'.replace('.', ','),
+                                               m_spaced=f'{m:,}'.replace(',', ' '), m_dotted=f'{m:,}'.replace(',', '.'))
+    return {
+        'name': name,
+        'description': description(rng),
+        'tags': ['circuit', rng.choice(['original', 'laserscan', 'fictional'])],
+        'geotags': ['45.6 N', '9.2 E'],
+        'country': rng.choice(COUNTRIES),
+        'city': rng.choice(CITIES),
+        'length': length,
+        'width': f'{rng.randint(8, 16)}m',
+        'pitboxes': rng.choice([str(rng.randint(8, 60)), rng.randint(8, 60), '']),
+        'run': rng.choice(['clockwise', 'anticlockwise', 'counter-clockwise']),
+        'author': 'Generated',
+    }
+
+
+def make_track(rng: random.Random, root: str, i: int, max_layouts: int, flaw_rate: float):
+    folder = os.path.join(root, f'track_{i:04d}')
+    ui = os.path.join(folder, 'ui')
+    os.makedirs(ui, exist_ok=True)
+    for name in TRACK_FILES:
+        touch(os.path.join(folder, name))
+
+    layouts = rng.randint(2, max_layouts) if max_layouts > 1 and rng.random() < 0.3 else 1
+    if layouts == 1:
+        write_json(os.path.join(ui, 'ui_track.json'), layout_data(rng, f'Track {i}'), pick_flaw(rng, flaw_rate))
+        touch(os.path.join(ui, 'outline.png'))
+        touch(os.path.join(ui, 'preview.png'))
+        return
+    for n in range(layouts):
+        layout = os.path.join(ui, f'layout_{n}')
+        os.makedirs(layout, exist_ok=True)
+        write_json(os.path.join(layout, 'ui_track.json'), layout_data(rng, f'Track {i} Layout {n}'),
+                   pick_flaw(rng, flaw_rate))
+        touch(os.path.join(layout, 'outline.png'))
+        touch(os.path.join(layout, 'preview.png'))
+        os.makedirs(os.path.join(folder, f'layout_{n}', 'data'), exist_ok=True)
+        touch(os.path.join(folder, f'layout_{n}', 'map.png'))
+
+
+def generate(root: str, cars: int, skins: int, tracks: int = None, layouts: int = 4, seed=0,
+             flaw_rate: float = 1.0):
+    """Generates the content tree under `root`, a folder usable as an install path.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, 'content', 'cars'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'content', 'tracks'), exist_ok=True)
+    touch(os.path.join(root, 'AssettoCorsa.exe'))
+
+    for i in range(cars):
+        make_car(rng, os.path.join(root, 'content', 'cars'), i, skins, flaw_rate)
+    if tracks is None:
+        tracks = max(1, cars // 5)
+    for i in range(tracks):
+        make_track(rng, os.path.join(root, 'content', 'tracks'), i, layouts, flaw_rate)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Generate a fake Assetto Corsa content tree.')
+    parser.add_argument('root', help='folder to generate the install in')
+    parser.add_argument('--cars', type=int, default=100)
+    parser.add_argument('--skins', type=int, default=20, help='most skins a car can have')
+    parser.add_argument('--tracks', type=int, default=None, help='defaults to a fifth of the cars')
+    parser.add_argument('--layouts', type=int, default=4, help='most layouts a track can have')
+    parser.add_argument('--seed', default=0)
+    parser.add_argument('--flaw-rate', type=float, default=1.0,
+                        help='scales how many json files are broken, 0 for none')
+    args = parser.parse_args(argv)
+
+    generate(args.root, args.cars, args.skins, args.tracks, args.layouts, args.seed, args.flaw_rate)
+    print(f'Generated {args.cars} cars in {args.root}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
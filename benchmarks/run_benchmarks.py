@@ -0,0 +1,222 @@
+"""Benchmarks the content scan and pick hot paths against stored baselines.
+
+Generates a content tree for the chosen scale (see generate_content.py), or
+uses an existing install with --root, then measures:
+
+    cold_scan_ms    refresh_cache with an empty content index
+    warm_scan_ms    refresh_cache with the index from the cold scan
+    load_json_us    FileUtil.load_json per ui file
+    pick_*_us       one pick, median over many
+    grid_*          balanced grid setup and one 12 car grid within 10%, see grids.py
+    peak_memory_mb  peak python allocations during a cold scan
+
+Results are compared with benchmarks/baselines.json, and stored there with
+--save. Baselines depend on the machine, save your own before comparing.
+
+    python benchmarks/run_benchmarks.py --scale small --save
+    python benchmarks/run_benchmarks.py --scale small --check
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import AsettoCorsaManager, FileUtil  # noqa: E402
+from grids import GridGenerator  # noqa: E402
+from generate_content import generate  # noqa: E402
+
+
+SCALES = {
+    'small': {'cars': 100, 'skins': 20},
+    'medium': {'cars': 2000, 'skins': 50},
+    'large': {'cars': 20000, 'skins': 200},
+}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# Slower than the baseline by more than this counts as a regression
+TOLERANCE = 0.25
+PICKS = 2000
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def new_manager(root: str, index_path: str) -> AsettoCorsaManager:
+    manager = AsettoCorsaManager(cache_path=index_path)
+    manager.set_install_path(root)
+    if not manager.is_valid():
+        raise SystemExit(f'Not an install folder: {root}')
+    return manager
+
+
+def scan_benchmarks(root: str, work_dir: str, repeat: int) -> dict:
+    cold = []
+    warm = []
+    for n in range(repeat):
+        index_path = os.path.join(work_dir, f'index_{n}.db')
+        cold.append(timed(new_manager(root, index_path).refresh_cache))
+        warm.append(timed(new_manager(root, index_path).refresh_cache))
+    return {
+        'cold_scan_ms': min(cold) * 1000,
+        'warm_scan_ms': min(warm) * 1000,
+    }
+
+
+def load_json_benchmark(root: str) -> dict:
+    files = glob.glob(os.path.join(root, 'content', 'cars', '*', 'ui', 'ui_car.json'))
+    files += glob.glob(os.path.join(root, 'content', 'tracks', '*', 'ui', '**', 'ui_track.json'), recursive=True)
+    if len(files) == 0:
+        return {}
+    elapsed = timed(lambda: [FileUtil.load_json(file) for file in files])
+    return {'load_json_us': elapsed / len(files) * 1e6}
+
+
+def pick_benchmarks(root: str, index_path: str) -> dict:
+    manager = new_manager(root, index_path)
+    manager.refresh_cache()
+    random.seed(0)
+
+    def per_pick(pick) -> float:
+        # Warms up indexes and samplers so only the picks are measured
+        pick()
+        times = []
+        for _ in range(PICKS):
+            start = time.perf_counter()
+            pick()
+            times.append(time.perf_counter() - start)
+        return statistics.median(times) * 1e6
+
+    results = {
+        'pick_car_us': per_pick(manager.pick_random_car),
+        'pick_track_us': per_pick(manager.pick_random_track),
+        'pick_filtered_car_us': per_pick(lambda: manager.pick_random_car(catagory='GT3', bhp=(300, 600))),
+    }
+    cars = manager.get_cars()
+    if len(cars) > 0:
+        results['pick_skin_us'] = per_pick(lambda: manager.pick_random_skin(random.choice(cars)))
+
+    start = time.perf_counter()
+    # Wide enough for the small tree to have grids
+    grids = GridGenerator(manager, 12, 0.1, seed=0, skins=False)
+    results['grid_setup_ms'] = (time.perf_counter() - start) * 1000
+    if grids.leaders > 0:
+        generate = grids.generate()
+        results['grid_us'] = per_pick(lambda: next(generate))
+
+    manager.set_weighted_picks(True)
+    results['pick_weighted_car_us'] = per_pick(manager.pick_random_car)
+    manager.set_no_repeat(True)
+    results['pick_no_repeat_car_us'] = per_pick(manager.pick_random_car)
+    return results
+
+
+def memory_benchmark(root: str, work_dir: str) -> dict:
+    manager = new_manager(root, os.path.join(work_dir, 'index_memory.db'))
+    tracemalloc.start()
+    try:
+        manager.refresh_cache()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_memory_mb': peak / (1024 * 1024)}
+
+
+def run(root: str, repeat: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix='acr_bench_')
+    # Broken content files are reported on stderr while scanning, which would bury the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        return _run(root, repeat, work_dir)
+
+
+def _run(root: str, repeat: int, work_dir: str) -> dict:
+    try:
+        results = {}
+        results.update(scan_benchmarks(root, work_dir, repeat))
+        results.update(load_json_benchmark(root))
+        results.update(pick_benchmarks(root, os.path.join(work_dir, 'index_0.db')))
+        results.update(memory_benchmark(root, work_dir))
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def load_baselines() -> dict:
+    if not os.path.isfile(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def report(results: dict, baseline: dict) -> list:
+    """Prints the results next to the baseline, returning the regressed names.
+    """
+    regressions = []
+    print(f'{"benchmark":<24}{"result":>12}{"baseline":>12}{"change":>10}')
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None or base <= 0:
+            print(f'{name:<24}{value:>12.2f}{"-":>12}{"":>10}')
+            continue
+        change = value / base - 1
+        flag = ''
+        if change > TOLERANCE:
+            regressions.append(name)
+            flag = ' !'
+        print(f'{name:<24}{value:>12.2f}{base:>12.2f}{change:>+9.0%}{flag}')
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark content scans and picks.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--root', help='benchmark an existing install instead of generating one')
+    parser.add_argument('--keep', metavar='FOLDER', help='generate the tree into FOLDER and keep it, '
+                                                          'reused if it already exists')
+    parser.add_argument('--repeat', type=int, default=3, help='scans to run, the fastest counts')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit with 1 if anything regressed')
+    args = parser.parse_args(argv)
+
+    name = 'custom' if args.root else args.scale
+    root = args.root or args.keep
+    generated = None
+    if root is None:
+        generated = root = tempfile.mkdtemp(prefix='acr_content_')
+    try:
+        if not args.root and not os.path.isdir(os.path.join(root, 'content')):
+            print(f'Generating {name} content tree in {root}')
+            generate(root, seed=name, **SCALES[name])
+        results = run(root, args.repeat)
+    finally:
+        if generated is not None:
+            shutil.rmtree(generated, ignore_errors=True)
+
+    baselines = load_baselines()
+    regressions = report(results, baselines.get(name, {}))
+    if args.save:
+        baselines[name] = {key: round(value, 3) for key, value in results.items()}
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+        print(f'Saved baseline {name}')
+    if regressions:
+        print(f'! Slower than the baseline: {", ".join(regressions)}')
+        return 1 if args.check else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
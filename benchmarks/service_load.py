@@ -0,0 +1,150 @@
+"""Load tests the pick service on localhost against a generated content tree.
+
+Starts `game.py serve` on a free port, then keeps `--connections` keep-alive
+connections busy with pick requests for `--seconds`, asking for a reload
+halfway through. Reports requests per second and latency, and fails if any
+request failed or the reload did not finish.
+
+    python benchmarks/service_load.py --scale small
+    python benchmarks/service_load.py --root <assettocorsa folder> --connections 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_content import generate  # noqa: E402
+from run_benchmarks import SCALES  # noqa: E402
+
+
+GAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'game.py')
+# Requests sent in turn by every connection
+REQUESTS = [
+    'GET /pick HTTP/1.1',
+    'GET /pick?car=bhp=200:600&track=length=2000: HTTP/1.1',
+    'GET /pick?seed=1 HTTP/1.1',
+    'GET /batch?n=10&unique_window=5 HTTP/1.1',
+]
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, line: str) -> tuple:
+    writer.write(f'{line}\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(port: int, deadline: float, latencies: list, failures: list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    n = 0
+    while time.perf_counter() < deadline:
+        line = REQUESTS[n % len(REQUESTS)]
+        n += 1
+        start = time.perf_counter()
+        status, body = await request(reader, writer, line)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            failures.append(f'{line}: {status} {body[:200]!r}')
+    writer.close()
+
+
+async def load(port: int, connections: int, seconds: float) -> dict:
+    latencies = []
+    failures = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    clients = [asyncio.create_task(client(port, deadline, latencies, failures)) for _ in range(connections)]
+
+    await asyncio.sleep(seconds / 2)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    status, _ = await request(reader, writer, 'POST /reload HTTP/1.1')
+    if status != 202:
+        failures.append(f'reload: {status}')
+
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+    # Waits for the reload, in case the load ended before it
+    for _ in range(600):
+        _, body = await request(reader, writer, 'GET /status HTTP/1.1')
+        status = json.loads(body)
+        if not status['reloading']:
+            break
+        await asyncio.sleep(0.1)
+    writer.close()
+    if status['reloads'] != 1:
+        failures.append('reload did not finish')
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_p50_ms': statistics.median(latencies) * 1000,
+        'latency_p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'failures': failures,
+    }
+
+
+def run(root: str, connections: int, seconds: float) -> dict:
+    work_dir = tempfile.mkdtemp(prefix='acr_service_')
+    command = [sys.executable, GAME, '--path', root, '--cache', os.path.join(work_dir, 'index.db'),
+               'serve', '--port', '0']
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        # Broken content files are reported before the address is printed
+        for line in server.stdout:
+            if line.startswith('Serving picks on'):
+                port = int(line.rsplit(':', 1)[1])
+                break
+        else:
+            raise SystemExit('The service did not start')
+        return asyncio.run(load(port, connections, seconds))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test the pick service.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--root', help='serve an existing install instead of generating one')
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    root = args.root
+    generated = None
+    if root is None:
+        generated = root = tempfile.mkdtemp(prefix='acr_content_')
+        print(f'Generating {args.scale} content tree in {root}')
+        generate(root, seed=args.scale, **SCALES[args.scale])
+    try:
+        results = run(root, args.connections, args.seconds)
+    finally:
+        if generated is not None:
+            shutil.rmtree(generated, ignore_errors=True)
+
+    print(f'{results["requests"]} requests, {results["requests_per_second"]:.0f}/s, '
+          f'p50 {results["latency_p50_ms"]:.2f}ms, p99 {results["latency_p99_ms"]:.2f}ms')
+    for failure in results['failures'][:20]:
+        print(f'! {failure}')
+    return 1 if results['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
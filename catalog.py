@@ -0,0 +1,387 @@
+import threading
+from collections import OrderedDict, deque
+from typing import NamedTuple, Optional
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QObject, QPoint, QSize, Qt, QTimer, Signal
+from PySide6.QtGui import QAction, QImage
+from PySide6.QtWidgets import (QCheckBox, QLineEdit, QListView, QMenu, QTabWidget, QVBoxLayout, QWidget)
+
+from game import AsettoCorsaManager, Car, CarSkin, TrackLayout
+from thumbnails import ThumbnailCache
+
+
+class SkinRow(NamedTuple):
+    """A skin listed by its folder, so listing skins loads none of them.
+    """
+    car: Car
+    folder: str
+    folder_path: str
+
+
+class ThumbnailLoader(QObject):
+    """Loads catalog thumbnails on a worker thread, newest request first.
+
+    Requests are `(key, resolve)`, where `resolve` returns the image path and
+    runs on the worker, so finding a preview may load the asset it belongs
+    to. It only takes the manager lock while it touches the asset, never
+    while reading from disk. Only the last `pending` requests are kept, when
+    the list is scrolled quickly the rows that went by are dropped before
+    they are decoded. Loaded images are kept for the `kept` most recently loaded
+    keys and `loaded` is emitted with the key once one is ready.
+
+    Loading holds the GIL for much of the time, which stalls every call the
+    view makes into the model while painting. The window pauses the loader
+    while a list is scrolled so scrolling stays smooth.
+    """
+
+    PENDING = 64
+    KEPT = 512
+
+    loaded = Signal(str)
+
+    def __init__(self, thumbnails: ThumbnailCache, pending: int = PENDING, kept: int = KEPT):
+        super(ThumbnailLoader, self).__init__()
+        self.thumbnails = thumbnails
+        self.kept = kept
+        self._requests = deque(maxlen=pending)
+        self._requested = set()
+        self._images = OrderedDict()  # key -> QImage or None when there is no image
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._paused = False
+        self._thread = threading.Thread(target=self._run, name='ThumbnailLoader', daemon=True)
+        self._thread.start()
+
+    def image(self, key: str, resolve) -> Optional[QImage]:
+        """Returns the loaded image of `key`, requesting it when it is not loaded.
+        """
+        with self._condition:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            if key not in self._requested:
+                if len(self._requests) == self._requests.maxlen:
+                    self._requested.discard(self._requests[0][0])
+                self._requests.append((key, resolve))
+                self._requested.add(key)
+                self._condition.notify()
+        return None
+
+    def forget(self):
+        """Drops the pending requests, such as when the list is filtered.
+        """
+        with self._condition:
+            self._requests.clear()
+            self._requested.clear()
+
+    def pause(self):
+        with self._condition:
+            self._paused = True
+
+    def resume(self):
+        with self._condition:
+            self._paused = False
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (self._paused or len(self._requests) == 0):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                key, resolve = self._requests.pop()
+
+            path = resolve()
+            image = self.thumbnails.get(path) if path is not None else None
+
+            with self._condition:
+                self._requested.discard(key)
+                self._images[key] = image
+                while len(self._images) > self.kept:
+                    self._images.popitem(last=False)
+            self.loaded.emit(key)
+
+
+class CatalogModel(QAbstractListModel):
+    """The cars, skins or track layouts of the manager as a searchable list.
+
+    Rows reference the manager's assets, nothing is copied out of them, and
+    a row is only turned into text or a thumbnail when the view paints it.
+    With uniform item sizes the view never asks for rows it does not show,
+    so a list of thousands of skins costs no more to show than a screenful.
+    The check box of a row includes or excludes it from picks, favourites
+    are marked with a star and are picked more often with weighted picks.
+
+    The manager is only changed with `lock` held.
+    """
+
+    KINDS = ('cars', 'skins', 'tracks')
+    FAVOURITE_MARK = '★ '
+
+    changed = Signal()
+
+    def __init__(self, manager: AsettoCorsaManager, kind: str, loader: ThumbnailLoader, lock):
+        super(CatalogModel, self).__init__()
+        if kind not in CatalogModel.KINDS:
+            raise ValueError(f'Unknown catalog kind: {kind}')
+        self.manager = manager
+        self.kind = kind
+        self._loader = loader
+        self._lock = lock
+        self._assets = []
+        self._search_texts = []  # lower case text searched, in the order of _assets
+        self._rows = []  # positions in _assets matching the search
+        self._search = ''
+        self._positions = {}  # folder path -> row, for thumbnails arriving later
+        loader.loaded.connect(self._on_thumbnail_loaded)
+
+    def reload(self):
+        """Lists the assets of the manager again, after its pools changed.
+        """
+        with self._lock:
+            if self.kind == 'cars':
+                assets = list(self.manager.get_cars())
+            elif self.kind == 'skins':
+                assets = [SkinRow(car, folder, car.skin_path(folder))
+                          for car in self.manager.get_cars() for folder in car.skin_folders]
+            else:
+                assets = [layout for track in self.manager.get_tracks() for layout in track.get_layouts()]
+        assets.sort(key=self._sort_key)
+        self._assets = assets
+        self._search_texts = [self._search_text(asset).lower() for asset in assets]
+        self._filter()
+
+    def set_search(self, text: str):
+        self._search = text.strip().lower()
+        self._filter()
+
+    def _filter(self):
+        self.beginResetModel()
+        words = self._search.split()
+        self._rows = [i for i, text in enumerate(self._search_texts) if all(word in text for word in words)]
+        self._positions = {}
+        self._loader.forget()
+        self.endResetModel()
+
+    def _sort_key(self, asset) -> tuple:
+        if isinstance(asset, SkinRow):
+            return asset.car.name.lower(), asset.folder.lower()
+        return asset.name.lower(), asset.folder_path
+
+    def _search_text(self, asset) -> str:
+        if isinstance(asset, SkinRow):
+            return f'{asset.car.name} {asset.car.brand} {asset.folder}'
+        if isinstance(asset, Car):
+            return f'{asset.name} {asset.brand} {asset.catagory}'
+        return f'{asset.name} {asset.city} {asset.country}'
+
+    def _display_text(self, asset) -> str:
+        if isinstance(asset, SkinRow):
+            return f'{asset.car.name}\n{asset.folder}'
+        text = asset.name
+        if self.manager.is_favourite(asset):
+            text = CatalogModel.FAVOURITE_MARK + text
+        if isinstance(asset, Car):
+            return f'{text}\n{asset.brand}'
+        return f'{text}\n{asset.city}'
+
+    def asset(self, index: QModelIndex):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        return self._assets[self._rows[index.row()]]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        asset = self.asset(index)
+        if asset is None:
+            return None
+        if role == Qt.DisplayRole:
+            return self._display_text(asset)
+        if role == Qt.CheckStateRole:
+            return Qt.Unchecked if self.manager.is_excluded(asset) else Qt.Checked
+        if role == Qt.DecorationRole:
+            self._positions[asset.folder_path] = index.row()
+            return self._loader.image(asset.folder_path, lambda: self._image_path(asset))
+        if role == Qt.ToolTipRole:
+            return asset.folder_path
+        return None
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.EditRole) -> bool:
+        asset = self.asset(index)
+        if asset is None or role != Qt.CheckStateRole:
+            return False
+        excluded = Qt.CheckState(value) != Qt.Checked
+        with self._lock:
+            if isinstance(asset, SkinRow):
+                asset = asset.car.get_skin(asset.folder)
+                if asset is None:
+                    return False
+            self.manager.set_excluded(asset, excluded)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        self.changed.emit()
+        return True
+
+    def can_favourite(self, index: QModelIndex) -> bool:
+        # Skins are weighted by their own priority instead
+        return self.kind != 'skins' and self.asset(index) is not None
+
+    def toggle_favourite(self, index: QModelIndex):
+        if not self.can_favourite(index):
+            return
+        asset = self.asset(index)
+        with self._lock:
+            self.manager.set_favourite(asset, not self.manager.is_favourite(asset))
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+        self.changed.emit()
+
+    def _image_path(self, asset) -> Optional[str]:
+        # Runs on the loader thread
+        if isinstance(asset, SkinRow):
+            skin = self._load_skin(asset.car, asset.folder)
+            return skin.preview_image if skin is not None else None
+        if isinstance(asset, Car):
+            skin = self._load_skin(asset)
+            return skin.preview_image if skin is not None else None
+        layout: TrackLayout = asset
+        with self._lock:
+            return layout.preview_image or layout.outline_file
+
+    def _load_skin(self, car: Car, folder: str = None) -> Optional[CarSkin]:
+        """Returns the skin in `folder`, or the car's first skin, reading it without the lock held.
+        """
+        while True:
+            with self._lock:
+                folders = car.skin_folders if folder is None else [folder]
+                if len(folders) == 0:
+                    return None
+                if folders[0] not in car.unloaded_skin_folders():
+                    # Loaded, or dropped from the car as not a valid skin
+                    return car.get_skin(folders[0])
+            skin = CarSkin(car.skin_path(folders[0]))
+            with self._lock:
+                car.add_loaded_skins({folders[0]: skin})
+
+    def _on_thumbnail_loaded(self, key: str):
+        row = self._positions.pop(key, None)
+        if row is None or row >= len(self._rows):
+            return
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class CatalogWindow(QWidget):
+    """Browses the cars, skins and tracks, choosing what random picks come from.
+
+    `changed` is emitted after exclusions, favourites or the pick mode
+    changed, so queued picks can be drawn again and the choices saved.
+    """
+
+    ICON_SIZE = 96
+    SEARCH_SETTLE_MS = 200
+    # Thumbnails start loading once a list has not scrolled for this long
+    SCROLL_SETTLE_MS = 100
+
+    changed = Signal()
+
+    def __init__(self, manager: AsettoCorsaManager, thumbnails: ThumbnailCache, lock, favour_favourites: bool = False):
+        super(CatalogWindow, self).__init__()
+        self.setWindowTitle('Catalog')
+        self.resize(640, 720)
+        self.manager = manager
+        self.loader = ThumbnailLoader(thumbnails)
+        self.models = {kind: CatalogModel(manager, kind, self.loader, lock) for kind in CatalogModel.KINDS}
+        for model in self.models.values():
+            model.changed.connect(self.changed)
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText('Search')
+        self.search_box.setClearButtonEnabled(True)
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(CatalogWindow.SEARCH_SETTLE_MS)
+        self._search_timer.timeout.connect(self._apply_search)
+        self.search_box.textChanged.connect(self._search_timer.start)
+
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(CatalogWindow.SCROLL_SETTLE_MS)
+        self._scroll_timer.timeout.connect(self.loader.resume)
+
+        self.favour_box = QCheckBox('Favour favourites')
+        self.favour_box.setToolTip('Picks favourites more often, picks may repeat while this is on')
+        self.favour_box.setChecked(favour_favourites)
+        self.favour_box.toggled.connect(self.changed)
+
+        self.tabs = QTabWidget()
+        self.views = {}
+        for kind, model in self.models.items():
+            view = QListView()
+            view.setModel(model)
+            # Lets the view lay out rows without asking for every one of them
+            view.setUniformItemSizes(True)
+            view.setIconSize(QSize(CatalogWindow.ICON_SIZE, CatalogWindow.ICON_SIZE))
+            view.setContextMenuPolicy(Qt.CustomContextMenu)
+            view.customContextMenuRequested.connect(lambda pos, view=view: self._show_menu(view, pos))
+            view.doubleClicked.connect(model.toggle_favourite)
+            view.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+            self.views[kind] = view
+            self.tabs.addTab(view, kind.capitalize())
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        layout.addWidget(self.search_box)
+        layout.addWidget(self.tabs)
+        layout.addWidget(self.favour_box)
+
+    @property
+    def favour_favourites(self) -> bool:
+        return self.favour_box.isChecked()
+
+    def reload(self):
+        for model in self.models.values():
+            model.reload()
+
+    def closeEvent(self, event) -> None:
+        self.loader.forget()
+        super(CatalogWindow, self).closeEvent(event)
+
+    def stop(self):
+        self.loader.stop()
+
+    def _on_scrolled(self):
+        self.loader.pause()
+        self._scroll_timer.start()
+
+    def _apply_search(self):
+        for model in self.models.values():
+            model.set_search(self.search_box.text())
+
+    def _show_menu(self, view: QListView, pos: QPoint):
+        index = view.indexAt(pos)
+        model: CatalogModel = view.model()
+        if model.asset(index) is None:
+            return
+        menu = QMenu(view)
+        excluded = model.data(index, Qt.CheckStateRole) == Qt.Unchecked
+        exclude_action = QAction('Include in picks' if excluded else 'Exclude from picks', menu)
+        exclude_action.triggered.connect(
+            lambda: model.setData(index, Qt.Checked if excluded else Qt.Unchecked, Qt.CheckStateRole))
+        menu.addAction(exclude_action)
+        if model.can_favourite(index):
+            favourite = model.manager.is_favourite(model.asset(index))
+            favourite_action = QAction('Remove favourite' if favourite else 'Favourite', menu)
+            favourite_action.triggered.connect(lambda: model.toggle_favourite(index))
+            menu.addAction(favourite_action)
+        menu.exec(view.viewport().mapToGlobal(pos))
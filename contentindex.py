@@ -0,0 +1,115 @@
+import json
+import sys
+import threading
+
+
+class ContentIndex:
+    """Persistent index of scanned content folders.
+
+    Stores the parsed record of every car and track folder together with a
+    signature made from the folder and file modification times and sizes. On
+    the next launch a folder whose signature still matches can be rebuilt from
+    its record without reading any of its json files again.
+
+    sqlite3 is only imported once the index is used, so importing the game
+    module stays light.
+    """
+
+    VERSION = 8
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = None
+        # Scans may run on a worker thread, one connection is shared behind a lock
+        self._lock = threading.RLock()
+
+    def _connect(self) -> 'sqlite3.Connection':
+        import sqlite3
+
+        if self._db is not None:
+            return self._db
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._create_tables()
+        except sqlite3.DatabaseError:
+            # The index is only a cache, start over if it cannot be read.
+            print(f'! Content index is unreadable, rebuilding: {self.path}', file=sys.stderr)
+            self.close()
+            with open(self.path, 'wb'):
+                pass
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._create_tables()
+        return self._db
+
+    def _create_tables(self):
+        db = self._db
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version != ContentIndex.VERSION:
+            db.execute('DROP TABLE IF EXISTS assets')
+            db.execute(f'PRAGMA user_version = {ContentIndex.VERSION}')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS assets (
+                root TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (root, kind, folder)
+            )''')
+        db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def load(self, root: str, kind: str) -> dict:
+        """Loads the stored signature and raw record of every folder of a kind.
+
+        Records are returned as json text and only need to be decoded for the
+        folders whose signature still matches.
+        """
+        import sqlite3
+
+        try:
+            with self._lock:
+                rows = self._connect().execute(
+                    'SELECT folder, signature, record FROM assets WHERE root = ? AND kind = ?',
+                    (root, kind))
+                return {folder: (signature, record) for folder, signature, record in rows}
+        except sqlite3.DatabaseError as e:
+            print(f'! Failed to read content index: {e}', file=sys.stderr)
+            return {}
+
+    def update(self, root: str, kind: str, changed: dict, removed: list):
+        """Writes changed folders and drops removed ones in a single transaction.
+
+        `changed` maps a folder name to its signature and record, both already
+        encoded as json text.
+        """
+        if not changed and not removed:
+            return
+        import sqlite3
+
+        try:
+            with self._lock:
+                db = self._connect()
+                with db:
+                    db.executemany(
+                        'INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?)',
+                        [(root, kind, folder, signature, record)
+                         for folder, (signature, record) in changed.items()])
+                    db.executemany(
+                        'DELETE FROM assets WHERE root = ? AND kind = ? AND folder = ?',
+                        [(root, kind, folder) for folder in removed])
+        except sqlite3.DatabaseError as e:
+            print(f'! Failed to write content index: {e}', file=sys.stderr)
+
+    @staticmethod
+    def encode(value) -> str:
+        return json.dumps(value, separators=(',', ':'))
+
+    @staticmethod
+    def decode(text: str):
+        return json.loads(text)
@@ -1,68 +1,334 @@
 import os
 import json
 import random
-from typing import Optional
+import re
+import sys
+from fnmatch import fnmatchcase
+from functools import partial
+from time import perf_counter
+from typing import Iterator, NamedTuple, Optional
+
+import scanprofile
+from contentindex import ContentIndex
+from selection import AssetIndex, DrawHistory, ShuffleBag, WeightedSampler
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonFile(NamedTuple):
+    data: dict
+    # Encoding the file was decoded with, None if it could not be read
+    encoding: Optional[str]
+    # None for a clean parse, otherwise the repair that made the file load
+    recovery: Optional[str]
 
 
 class FileUtil:
 
+    # Matches either a complete json string, which is kept as is, or a comma
+    # that is only followed by whitespace before the closing bracket.
+    _TRAILING_COMMA = re.compile(r'("(?:\\.|[^"\\])*")|,(\s*[}\]])')
+
     @staticmethod
-    def load_json(file, _encodings: list = 
-                      ['utf8', 'utf-8', 'utf-8-sig', 
-                       'Windows-1252', 'ASCII', 'UTF-16']) -> dict:
+    def load_json(file) -> dict:
         """Attempts to load a json file from disk.
 
-        Attempts to load a json file from disc using a range of different encodings.
-        This can be useful if you don't know what encoding a json file is, recursivly
-        attemptiong different encodings to find what is the correct encoding for that
-        file.
+        See `read_json` for how the encoding is detected and which problems
+        are repaired.
         """
-        codecs = _encodings.copy()
-        if len(codecs) == 0:
-            print(f'! Failed to find encodiung or json is invalid in file: {file}')
-            return {}
+        return FileUtil.read_json(file).data
+
+    @staticmethod
+    def read_json(file, encoding: str = None) -> JsonFile:
+        """Loads a json file and reports how it was decoded.
+
+        The file is read once and its encoding sniffed from the BOM and the
+        bytes themselves, unless a known `encoding` is given. Files that do not
+        parse cleanly are retried with raw control characters allowed and then
+        with trailing commas removed, the usual problems with mod files.
+        """
+        profile = scanprofile.current
+        if profile is None:
+            return FileUtil._read_json(file, encoding)
+
+        start = perf_counter()
+        result = FileUtil._read_json(file, encoding)
+        profile.add_time('json', perf_counter() - start)
+        profile.count('json_parses')
+        if result.recovery == 'failed':
+            profile.add_failure(file, 'unreadable' if result.encoding is None else 'invalid json')
+        elif result.recovery is not None or result.encoding != 'utf-8':
+            profile.add_fallback(file, result.encoding, result.recovery)
+        return result
 
-        encoding = codecs.pop(0)
+    @staticmethod
+    def _read_json(file, encoding: str = None) -> JsonFile:
         try:
-            with open(file, encoding = encoding) as f:
-                info = json.load(f, strict=False)
-                return info
-        except:
-            return FileUtil.load_json(file, codecs)
+            with open(file, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            print(f'! Failed to read json file: {file}', file=sys.stderr)
+            return JsonFile({}, None, 'failed')
+
+        if encoding is None:
+            encoding = FileUtil.detect_encoding(raw)
+        text = raw.decode(encoding, errors='replace')
+
+        data, recovery = FileUtil._parse_json(text)
+        if not isinstance(data, dict):
+            print(f'! Failed to find encoding or json is invalid in file: {file}', file=sys.stderr)
+            return JsonFile({}, encoding, 'failed')
+        return JsonFile(data, encoding, recovery)
 
+    @staticmethod
+    def detect_encoding(raw: bytes) -> str:
+        if raw.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        if raw.startswith((b'\xff\xfe\x00\x00', b'\x00\x00\xfe\xff')):
+            return 'utf-32'
+        if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+            return 'utf-16'
+
+        # json always starts with ascii, so utf-16 without a BOM shows up as
+        # null bytes next to the first characters
+        head = raw[:4]
+        if len(head) >= 2 and b'\x00' in head:
+            return 'utf-16-be' if head[0] == 0 else 'utf-16-le'
 
-class NumberUtil:
+        try:
+            raw.decode('utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        try:
+            raw.decode('cp1252')
+            return 'cp1252'
+        except UnicodeDecodeError:
+            # Every byte is valid latin-1
+            return 'latin-1'
 
     @staticmethod
-    def extract_length_meters(text: str) -> float:
-        text = text.replace(' ', '')
+    def _parse_json(text: str) -> tuple:
         try:
-            if text.endswith('km'):
-                km = float(text[:-2])
-                return int(km * 1000)
-            if text.endswith('m'):
-                return int(float(text[:-1]))
-            
-            if '.' in text:
-                # Assume km
-                return int(float(text) * 1000)
+            if orjson is not None:
+                return orjson.loads(text), None
+            return json.loads(text), None
+        except ValueError:
+            pass
+
+        try:
+            return json.loads(text, strict=False), 'control-characters'
+        except ValueError:
+            pass
+
+        text = FileUtil._TRAILING_COMMA.sub(lambda m: m.group(1) or m.group(2), text)
+        try:
+            return json.loads(text, strict=False), 'trailing-commas'
+        except ValueError:
+            return None, 'failed'
+
+    @staticmethod
+    def stat_signature(path: str) -> Optional[list]:
+        """Returns the modification time and size of a path, or None if it is missing.
+        """
+        if scanprofile.current is not None:
+            scanprofile.current.count('stat')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    @staticmethod
+    def folder_signature(path: str, child_file: str = None) -> list:
+        """Returns a cheap change signature for a folder and its direct entries.
+
+        Entries are stat'ed from the directory listing so adding, removing or
+        rewriting anything directly inside the folder changes the signature.
+        With `child_file` that file is stat'ed in every sub folder too, as a
+        file rewritten in place does not change the time of its folder.
+        """
+        signature = [FileUtil.stat_signature(path)]
+        try:
+            with os.scandir(path) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    stat = entry.stat()
+                    item = [entry.name, stat.st_mtime_ns, stat.st_size]
+                    if child_file is not None and entry.is_dir():
+                        item.append(FileUtil.stat_signature(os.path.join(entry.path, child_file)))
+                    signature.append(item)
+        except OSError:
+            pass
+        if scanprofile.current is not None:
+            scanprofile.current.count('scandir')
+            scanprofile.current.count('stat', len(signature) - 1)
+        return signature
+
+
+class NumberUtil:
+
+    # A number with optional thousand separators and decimals, "1 250", "4,200", "4.574,5" or "5.8"
+    _NUMBER_PATTERN = r'\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d+)?(?!\d)|\d+(?:[.,]\d+)*'
+    # A number followed by an optional unit, "5.8 km", "4,2km", "4,200m" or "5 793 m"
+    _LENGTH = re.compile(rf'({_NUMBER_PATTERN})\s*(km|mi|m)?', re.IGNORECASE)
+    _NUMBER = re.compile(_NUMBER_PATTERN)
+    _SPACES = str.maketrans('', '', ' \u00a0\u202f')
+
+    @staticmethod
+    def _normalize(number: str, grouping: str) -> str:
+        """Rewrites a matched number with '.' as its only separator, for float.
+
+        Spaces always separate thousands. With both ',' and '.' the last one
+        is the decimal point, otherwise a separator used several times
+        separates thousands and so does a single one in `grouping` that is
+        followed by three digits.
+        """
+        number = number.translate(NumberUtil._SPACES)
+        if ',' in number and '.' in number:
+            decimal = ',' if number.rfind(',') > number.rfind('.') else '.'
+            return number.replace('.' if decimal == ',' else ',', '').replace(decimal, '.')
+        for separator in ',.':
+            parts = number.split(separator)
+            if len(parts) > 2 or (len(parts) == 2 and separator in grouping and len(parts[1]) == 3):
+                return ''.join(parts)
+            if len(parts) == 2:
+                return '.'.join(parts)
+        return number
+
+    @staticmethod
+    def extract_length_meters(text) -> int:
+        """Extracts a track length in metres from text such as "5.8 km", "4,200m" or "5 793 m".
+
+        Numbers without a unit are taken as km when they have decimals and as
+        metres otherwise. Returns 0 if there is no length in the text.
+        """
+        if isinstance(text, (int, float)):
             return int(text)
-        except:
+        match = NumberUtil._LENGTH.search(str(text))
+        if match is None:
+            return 0
+        unit = (match.group(2) or '').lower()
+        # "4,200m" and "4.200m" have thousand separators, "4,2 km" and "4,200 km" decimals
+        grouping = {'km': '', 'm': ',.'}.get(unit, ',')
+        number = NumberUtil._normalize(match.group(1), grouping)
+
+        try:
+            value = float(number)
+        except ValueError:
+            return 0
+        if unit == 'km' or (unit == '' and '.' in number):
+            value *= 1000
+        elif unit == 'mi':
+            value *= 1609.344
+        return int(round(value))
+
+    @staticmethod
+    def extract_number(value) -> float:
+        """Extracts the first number out of values such as "540bhp", "1,250kg", "1 250 kg" or "1,25".
+
+        Returns 0 if there is no number in the value.
+        """
+        if isinstance(value, (int, float)):
+            return value
+        match = NumberUtil._NUMBER.search(str(value))
+        if match is None:
+            return 0
+        try:
+            number = float(NumberUtil._normalize(match.group(0), ',.'))
+        except ValueError:
             return 0
+        return int(number) if number.is_integer() else number
+
+
+class FileManifest:
+    """Listing of a single folder built from one os.scandir pass.
+
+    The entry types reported by the directory listing are kept so files and
+    sub folders can be resolved later without any further syscalls.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exists = False
+        self.files: list = []
+        self.folders: list = []
+
+        profile = scanprofile.current
+        start = perf_counter() if profile is not None else 0
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        self.folders.append(entry.name)
+                    else:
+                        self.files.append(entry.name)
+            self.exists = True
+        except OSError:
+            pass
+        self.files.sort()
+        self.folders.sort()
+        if profile is not None:
+            profile.add_time('listdir', perf_counter() - start)
+            profile.count('scandir')
+
+    def join(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def has_folder(self, name: str) -> bool:
+        return name in self.folders
+
+    def find_name(self, file_name: str) -> Optional[str]:
+        """Returns the first file whose name without extension matches, ignoring case.
+        """
+        compare = file_name.lower()
+        for file in self.files:
+            name, ext = os.path.splitext(file)
+            if name.lower() == compare:
+                return file
+        return None
+
+    def find_file(self, file_name: str) -> Optional[str]:
+        file = self.find_name(file_name)
+        return self.join(file) if file is not None else None
+
+
+def intern_text(data: dict, key: str, default: str = '') -> str:
+    """Reads a text field from ui data as an interned string.
+
+    Brands, classes and countries repeat across the whole library so every
+    asset shares a single copy of them.
+    """
+    value = data.get(key, default)
+    if value is None:
+        value = default
+    return sys.intern(str(value))
 
 
 class GameAsset:
+    # Assets are kept for the whole library so they only hold the fields the
+    # randomizer uses, the rest of the ui data is read on demand.
+    __slots__ = ('name', 'folder_path', '_ui_name', '_preview_name',
+                 'json_encoding', 'json_recovery', '_valid', '_manifests')
 
     def __init__(self, folder_path: str = None):
         self.name: str = 'Undefined'
-        self.preview_image: str = None
         self.folder_path: str = folder_path
-        self.ui_file: str = None
-        self._data: dict = None
+        # Files are kept relative to the folder path
+        self._ui_name: str = None
+        self._preview_name: str = None
+        self.json_encoding: str = None
+        self.json_recovery: str = None
+        self._valid = False
+        self._manifests: dict = None
 
         # Load the Assests data
         if folder_path:
             self.load_asset(folder_path)
+            self.release_manifests()
 
     @property
     def _property_name(self) -> str:
@@ -73,44 +339,57 @@ class GameAsset:
         # Defiens the relative path where the ui file is kept
         return 'ui'
 
+    @property
+    def ui_file(self) -> Optional[str]:
+        return self._asset_path(self._ui_name)
+
+    @property
+    def preview_image(self) -> Optional[str]:
+        return self._asset_path(self._preview_name)
+
+    def _asset_path(self, name: str) -> Optional[str]:
+        if name is None:
+            return None
+        return os.path.join(self.folder_path, name)
+
     def is_valid(self) -> bool:
-        if self.folder_path is None:
-            return
-        if not os.path.exists(self.folder_path):
-            return False
-        if self.ui_file is None or not os.path.exists(self.ui_file):
-            return False
-        return True
+        # Resolved once while loading the asset from its folder manifest
+        return self._valid
+
+    def manifest(self, path: str = None) -> FileManifest:
+        """Returns the listing of the asset folder, or of `path`, scanning it only once.
+        """
+        path = self.folder_path if path is None else path
+        if self._manifests is None:
+            self._manifests = {}
+        manifest = self._manifests.get(path)
+        if manifest is None:
+            manifest = FileManifest(path)
+            self._manifests[path] = manifest
+        return manifest
+
+    def release_manifests(self):
+        # Listings are only needed while loading
+        self._manifests = None
     
     def find_file(self, image_name: str, path: str = None) -> Optional[str]:
         """Attempts to file a file with the matching name
         """
         if not self.is_valid():
             return None
-        
-        if path is not None and not os.path.exists(path):
-            return None
-
-        compare = image_name.lower()
-        files = os.listdir(self.folder_path if path is None else path)
-        for file in files:
-            name, ext = os.path.splitext(file)
-            if name.lower() == compare:
-                return os.path.join(self.folder_path if path is None else path, file)
-        return None
+        return self.manifest(path).find_file(image_name)
     
     def load_ui_file(self):
-        path = self.folder_path
-        if self._path_ui_folder is not None and len(self._path_ui_folder) > 0:
-            path = os.path.join(self.folder_path, self._path_ui_folder)
-
-        if not os.path.exists(path):
-            return
-        files = os.listdir(path)
-
-        for file in files:
+        manifest = self.manifest()
+        ui_folder = self._path_ui_folder
+        if ui_folder is not None and len(ui_folder) > 0:
+            if not manifest.has_folder(ui_folder):
+                return
+            manifest = self.manifest(manifest.join(ui_folder))
+
+        for file in manifest.files:
             if file.startswith('ui_') and file.endswith('.json'):
-                self.ui_file = os.path.join(path, file)
+                self._ui_name = os.path.join(ui_folder, file) if ui_folder else file
                 break
 
     def load_asset(self, folder_path: str = None):
@@ -118,31 +397,62 @@ class GameAsset:
             self.folder_path = folder_path
         self.load_ui_file()
 
-        if not self.is_valid():
+        self._valid = self.manifest().exists and self._ui_name is not None
+        if not self._valid:
             return
-        
-        def _file(file_name) -> str:
-            nonlocal folder_path
-            return os.path.join(folder_path, file_name)
 
-        files = os.listdir(self.folder_path)
-        for file in files:
-            full_file_path = os.path.join(self.folder_path, file)
-
-            if os.path.isdir(full_file_path):
-                continue
-
-            name, ext = os.path.splitext(file)
-            if name == 'preview':
-                self.preview_image = _file(file)
+        self._preview_name = self.manifest().find_name('preview')
 
         try:
-            data = FileUtil.load_json(self.ui_file)
-            self._data = data
-            self.name = data.get(self._property_name, 'Undefined')
-        except:
+            result = FileUtil.read_json(self.ui_file)
+            self.json_encoding = result.encoding
+            self.json_recovery = result.recovery
+            self.load_data(result.data)
+        except Exception as e:
             asset_folder_name = os.path.basename(self.folder_path)
-            print('Failed to load data for asset', asset_folder_name)
+            print('! Failed to load data for asset', asset_folder_name, file=sys.stderr)
+            if scanprofile.current is not None:
+                scanprofile.current.add_failure(self.folder_path, f'{type(e).__name__}: {e}')
+
+    def load_data(self, data: dict):
+        """Picks the fields kept in memory out of the parsed ui file.
+        """
+        self.name = data.get(self._property_name, 'Undefined')
+
+    def read_data(self) -> dict:
+        """Reads the full ui data of the asset from disk.
+        """
+        if self._ui_name is None:
+            return {}
+        return FileUtil.read_json(self.ui_file, self.json_encoding).data
+
+    def to_record(self) -> dict:
+        """Returns the loaded state of the asset as plain data for the content index.
+        """
+        return {
+            'name': self.name,
+            'folder_path': self.folder_path,
+            'ui': self._ui_name,
+            'preview': self._preview_name,
+            'json': [self.json_encoding, self.json_recovery],
+        }
+
+    def load_record(self, record: dict):
+        self.name = record['name']
+        self.folder_path = record['folder_path']
+        self._ui_name = record['ui']
+        self._preview_name = record['preview']
+        self.json_encoding, self.json_recovery = record['json']
+        # Only valid assets are written to the index
+        self._valid = True
+
+    @classmethod
+    def from_record(cls, record: dict):
+        """Rebuilds an asset from a record without touching the disk.
+        """
+        asset = cls()
+        asset.load_record(record)
+        return asset
 
     def __str__(self) -> str:
         return self.name
@@ -152,8 +462,10 @@ class GameAsset:
 
 
 class CarSkin(GameAsset):
+    __slots__ = ('priority',)
 
     def __init__(self, folder_path: str = None):
+        self.priority: int = 0
         super(CarSkin, self).__init__(folder_path)
 
     @property
@@ -163,69 +475,206 @@ class CarSkin(GameAsset):
     @property
     def _path_ui_folder(self) -> str:
         return None
-    
-    @property
-    def priority(self) -> int:
-        return self._data.get('priority', 0)
+
+    def load_data(self, data: dict):
+        super(CarSkin, self).load_data(data)
+        try:
+            self.priority = int(data.get('priority', 0))
+        except (TypeError, ValueError):
+            self.priority = 0
+
+    def to_record(self) -> dict:
+        record = super(CarSkin, self).to_record()
+        record['priority'] = self.priority
+        return record
+
+    def load_record(self, record: dict):
+        super(CarSkin, self).load_record(record)
+        self.priority = record['priority']
 
 
 class Car(GameAsset):
+    __slots__ = ('brand', 'catagory', 'country', 'bhp', 'weight', '_skin_folders', '_skins', '_skin_sampler')
 
-    def __init__(self, folder_path: str = None):
-        super(Car, self).__init__(folder_path)
-        self.skins = []
+    def __init__(self, folder_path: str = None, prefetch_skins: bool = False):
+        """Loads a car from its folder.
+
+        Skins are only listed by folder name and each one is loaded the first
+        time it is used, unless `prefetch_skins` is set to load them all now.
+        """
+        self.brand: str = 'Unknown Brand'
+        self.catagory: str = ''
+        self.country: str = ''
         self.bhp = 0
         self.weight = 0
+        self._skin_folders = []
+        self._skins = {}
+        self._skin_sampler: WeightedSampler = None
+        super(Car, self).__init__()
 
-        self.load_skins()
-        self.load_stats()
+        if folder_path:
+            self.load_asset(folder_path)
+            self.load_skins(prefetch_skins)
+            self.release_manifests()
+
+    @staticmethod
+    def index_signature(folder_path: str) -> list:
+        return [
+            FileUtil.stat_signature(folder_path),
+            FileUtil.folder_signature(os.path.join(folder_path, 'ui')),
+            FileUtil.folder_signature(os.path.join(folder_path, 'skins'), 'ui_skin.json'),
+        ]
 
-    def load_skins(self):
-        skins_folder = os.path.join(self.folder_path, 'skins')
-        if not os.path.exists(skins_folder):
+    @property
+    def _skins_path(self) -> str:
+        return os.path.join(self.folder_path, 'skins')
+
+    def load_skins(self, prefetch: bool = False):
+        profile = scanprofile.current
+        start = perf_counter() if profile is not None else 0
+        self._load_skins(prefetch)
+        if profile is not None:
+            profile.add_time('skins', perf_counter() - start)
+
+    def _load_skins(self, prefetch: bool):
+        self._skin_folders.clear()
+        self._skins.clear()
+        self._skin_sampler = None
+        if not self.manifest().has_folder('skins'):
             return
-        self.skins.clear()
 
-        skin_folders = os.listdir(skins_folder)
-        for sf in skin_folders:
-            skin = CarSkin(os.path.join(skins_folder, sf))
-            if not skin.is_valid():
+        self._skin_folders.extend(self.manifest(self._skins_path).folders)
+        if prefetch:
+            self.prefetch_skins()
+
+    def prefetch_skins(self):
+        """Loads every skin of the car that has not been loaded yet.
+        """
+        for folder in list(self._skin_folders):
+            self.get_skin(folder)
+
+    def get_skin(self, folder: str) -> Optional[CarSkin]:
+        """Returns the skin in a skin folder, loading it on first access.
+
+        Folders without a valid skin are dropped from the car.
+        """
+        skin = self._skins.get(folder)
+        if skin is not None:
+            return skin
+        if folder not in self._skin_folders:
+            return None
+
+        skin = CarSkin(os.path.join(self._skins_path, folder))
+        if not skin.is_valid():
+            self._skin_folders.remove(folder)
+            return None
+        self._skins[folder] = skin
+        return skin
+
+    def unloaded_skin_folders(self) -> list:
+        """The skin folders that have not been loaded yet, see add_loaded_skins.
+        """
+        return [folder for folder in self._skin_folders if folder not in self._skins]
+
+    def add_loaded_skins(self, skins: dict):
+        """Adds skins loaded away from the car, such as on a worker thread, by folder.
+
+        Folders without a valid skin are dropped as in get_skin, folders that
+        were loaded in the meantime keep the skin they have.
+        """
+        for folder, skin in skins.items():
+            if folder not in self._skin_folders or folder in self._skins:
                 continue
-            self.skins.append(skin)
+            if skin.is_valid():
+                self._skins[folder] = skin
+            else:
+                self._skin_folders.remove(folder)
 
-    def load_stats(self):
-        if not self.is_valid():
-            return
-        
-        specs: dict = self._data.get('specs', {})
-        self.bhp = specs.get('bhp', 0)
-        self.weight = specs.get('weight', 0)
+    @property
+    def skins(self) -> list:
+        # Loads every skin, prefer random_skin/first_skin when only one is needed
+        self.prefetch_skins()
+        return [self._skins[folder] for folder in self._skin_folders]
 
     @property
-    def brand(self):
-        return self._data.get('brand', 'Unknown Brand')
-    
+    def skin_folders(self) -> list:
+        # Skin folders found, without loading them, see get_skin
+        return list(self._skin_folders)
+
+    def skin_path(self, folder: str) -> str:
+        return os.path.join(self._skins_path, folder)
+
     @property
-    def catagory(self) -> str:
-        return self._data.get('class', '')
-    
+    def skin_count(self) -> int:
+        # Skin folders found, including ones that have not been checked yet
+        return len(self._skin_folders)
+
+    def load_data(self, data: dict):
+        super(Car, self).load_data(data)
+        self.brand = intern_text(data, 'brand', 'Unknown Brand')
+        self.catagory = intern_text(data, 'class')
+        self.country = intern_text(data, 'country')
+
+        specs = data.get('specs', {})
+        self.load_stats(specs if isinstance(specs, dict) else {})
+
+    def load_stats(self, specs: dict):
+        # Specs are free text such as "540bhp" or "1,250kg"
+        self.bhp = NumberUtil.extract_number(specs.get('bhp', 0))
+        self.weight = NumberUtil.extract_number(specs.get('weight', 0))
+
+    def to_record(self) -> dict:
+        record = super(Car, self).to_record()
+        record['brand'] = self.brand
+        record['class'] = self.catagory
+        record['country'] = self.country
+        record['bhp'] = self.bhp
+        record['weight'] = self.weight
+        record['skin_folders'] = list(self._skin_folders)
+        record['skins'] = {folder: skin.to_record() for folder, skin in self._skins.items()}
+        return record
+
+    def load_record(self, record: dict):
+        super(Car, self).load_record(record)
+        self.brand = sys.intern(record['brand'])
+        self.catagory = sys.intern(record['class'])
+        self.country = sys.intern(record['country'])
+        self.bhp = record['bhp']
+        self.weight = record['weight']
+        self._skin_folders = record['skin_folders']
+        self._skins = {folder: CarSkin.from_record(skin) for folder, skin in record['skins'].items()}
+        self._skin_sampler = None
+
     @property
     def description(self) -> str:
-        return self._data.get('description', '')
-    
-    @property
-    def country(self) -> str:
-        return self._data.get('country', '')
+        # Descriptions are large and rarely shown, so they stay on disk
+        return self.read_data().get('description', '')
     
-    def random_skin(self) -> CarSkin:
-        if len(self.skins) == 0:
-            return None
-        return self.skins[random.randint(0, len(self.skins) - 1)]
+    def random_skin(self, weighted: bool = False, rng=random) -> CarSkin:
+        """Picks a random skin, only loading the skin it returns.
+
+        With `weighted` every skin of the car is loaded once and skins are
+        picked in proportion to 1 + their priority.
+        """
+        if weighted:
+            if self._skin_sampler is None:
+                skins = self.skins
+                self._skin_sampler = WeightedSampler(skins, [1 + max(skin.priority, 0) for skin in skins])
+            return self._skin_sampler.sample(rng)
+
+        while len(self._skin_folders) > 0:
+            folder = self._skin_folders[rng.randint(0, len(self._skin_folders) - 1)]
+            skin = self.get_skin(folder)
+            if skin is not None:
+                return skin
+        return None
     
     def first_skin(self) -> CarSkin:
-        if len(self.skins) == 0:
-            return None
-        return self.skins[0]
+        while len(self._skin_folders) > 0:
+            skin = self.get_skin(self._skin_folders[0])
+            if skin is not None:
+                return skin
+        return None
 
     def __str__(self) -> str:
         return self.name
@@ -235,48 +684,87 @@ class Car(GameAsset):
 
 
 class TrackLayout(GameAsset):
+    __slots__ = ('country', 'city', 'length', 'pitboxes', 'direction', '_outline_name', '_map_name')
+
+    def __init__(self, folder_path: str = None, manifest: FileManifest = None, map_file: str = None):
+        """Loads a layout from its ui folder.
 
-    def __init__(self, folder_path):
-        super(TrackLayout, self).__init__(folder_path)
+        `manifest` is the listing of the ui folder when the track already has
+        it, and `map_file` the map image found next to the layout data.
+        """
+        self.country: str = ''
+        self.city: str = ''
+        self.length: int = 0
+        self.pitboxes: int = 0
+        self.direction: str = 'clockwise'
+        self._outline_name: str = None
+        self._map_name: str = None
+        super(TrackLayout, self).__init__()
+
+        if folder_path:
+            if manifest is not None:
+                self._manifests = {folder_path: manifest}
+            self.load_asset(folder_path)
+            if self.is_valid():
+                self._outline_name = self.manifest().find_name('outline')
+                self._map_name = os.path.relpath(map_file, folder_path) if map_file else None
+            self.release_manifests()
 
     @property
     def _path_ui_folder(self) -> str:
         return None
+
+    def load_data(self, data: dict):
+        super(TrackLayout, self).load_data(data)
+        self.country = intern_text(data, 'country')
+        self.city = intern_text(data, 'city')
+        self.length = NumberUtil.extract_length_meters(data.get('length', ''))
+        self.pitboxes = NumberUtil.extract_number(data.get('pitboxes', 0))
+        self.direction = intern_text(data, 'run', 'clockwise')
+
+    def to_record(self) -> dict:
+        record = super(TrackLayout, self).to_record()
+        record['country'] = self.country
+        record['city'] = self.city
+        record['length'] = self.length
+        record['pitboxes'] = self.pitboxes
+        record['run'] = self.direction
+        record['outline'] = self._outline_name
+        record['map'] = self._map_name
+        return record
+
+    def load_record(self, record: dict):
+        super(TrackLayout, self).load_record(record)
+        self.country = sys.intern(record['country'])
+        self.city = sys.intern(record['city'])
+        self.length = record['length']
+        self.pitboxes = record['pitboxes']
+        self.direction = sys.intern(record['run'])
+        self._outline_name = record['outline']
+        self._map_name = record['map']
     
     @property
     def description(self) -> str:
-        return self._data.get('description', '')
-    
-    @property
-    def country(self) -> str:
-        return self._data.get('country', '')
-    
-    @property
-    def city(self) -> str:
-        return self._data.get('city', '')
-    
-    @property
-    def length(self) -> int:
-        return NumberUtil.extract_length_meters(self._data.get('length', ''))
+        # Descriptions are large and rarely shown, so they stay on disk
+        return self.read_data().get('description', '')
     
     @property
     def length_km(self) -> float:
         return float(f'{self.length * 0.001:.2f}')
-    
-    @property
-    def pitboxes(self) -> str:
-        return self._data.get('pitboxes', '')
-    
-    @property
-    def direction(self) -> str:
-        return self._data.get('run', 'clockwise')
 
     @property
     def outline_file(self) -> Optional[str]:
-        return self.find_file('outline')
+        return self._asset_path(self._outline_name)
+
+    @property
+    def map_file(self) -> Optional[str]:
+        # Kept relative to the ui folder, so it points up to the layout data folder
+        path = self._asset_path(self._map_name)
+        return os.path.normpath(path) if path is not None else None
 
 
 class Track:
+    __slots__ = ('tracks', 'folder_path')
 
     def __init__(self, folder_path: str = None):
         self.tracks = []
@@ -285,176 +773,1359 @@ class Track:
     def load_layouts(self, folder_path: str = None):
         if folder_path:
             self.folder_path = folder_path
-        if not os.path.exists(self.folder_path):
+        profile = scanprofile.current
+        start = perf_counter() if profile is not None else 0
+        self._load_layouts()
+        if profile is not None:
+            profile.add_time('layouts', perf_counter() - start)
+
+    def _load_layouts(self):
+        # Every folder is listed once, the layouts reuse the listings
+        track_manifest = FileManifest(self.folder_path)
+        if not track_manifest.has_folder('ui'):
             return
-        
-        ui_folder = os.path.join(self.folder_path, 'ui')
-        ui_file_single = os.path.join(ui_folder, 'ui_track.json')
+        ui_manifest = FileManifest(track_manifest.join('ui'))
 
-        if os.path.exists(ui_file_single):
-            # This is a single layout track.
-            layout = TrackLayout(ui_folder)
+        if 'ui_track.json' in ui_manifest.files:
+            # This is a single layout track, its map is in the track folder
+            map_file = track_manifest.join('map.png') if 'map.png' in track_manifest.files else None
+            layout = TrackLayout(ui_manifest.path, ui_manifest, map_file)
             if layout.is_valid():
                 self.add_layout(layout)
         else:
-            # Multi layout track. Look for and add all layouts
-            files = os.listdir(ui_folder)
-            for f in files:
-                file_path = os.path.join(ui_folder, f)
-                if not os.path.isdir(file_path):
-                    continue
-                layout = TrackLayout(file_path)
+            # Multi layout track, every layout has a ui folder and a data folder of the same name
+            for f in ui_manifest.folders:
+                map_file = None
+                if track_manifest.has_folder(f):
+                    map_file = os.path.join(track_manifest.join(f), 'map.png')
+                    if not os.path.isfile(map_file):
+                        map_file = None
+                layout = TrackLayout(ui_manifest.join(f), map_file=map_file)
                 if layout.is_valid():
                     self.add_layout(layout)
 
+    @staticmethod
+    def index_signature(folder_path: str) -> list:
+        return [
+            FileUtil.stat_signature(folder_path),
+            # The ui files of multi layout tracks are one folder further down
+            FileUtil.folder_signature(os.path.join(folder_path, 'ui'), 'ui_track.json'),
+        ]
+
+    def to_record(self) -> dict:
+        return {
+            'folder_path': self.folder_path,
+            'layouts': [layout.to_record() for layout in self.tracks],
+        }
+
+    @classmethod
+    def from_record(cls, record: dict):
+        track = cls(record['folder_path'])
+        track.tracks = [TrackLayout.from_record(layout) for layout in record['layouts']]
+        return track
+
+    @classmethod
+    def load(cls, folder_path: str):
+        track = cls(folder_path)
+        track.load_layouts()
+        return track
+
     def get_layouts(self) -> list:
         return self.tracks
     
     def add_layout(self, layout: TrackLayout):
         self.tracks.append(layout)
 
-    def random_layout(self) -> TrackLayout:
+    def random_layout(self, rng=random) -> TrackLayout:
         if len(self.tracks) == 0:
             return None
-        return self.tracks[random.randint(0, len(self.tracks) - 1)]
+        return self.tracks[rng.randint(0, len(self.tracks) - 1)]
 
     def is_valid(self) -> bool:
         return len(self.tracks) > 0
 
 
+def _load_content(load, folder_path: str, kind: str = None):
+    profile = scanprofile.current
+    if profile is None:
+        asset = load(folder_path)
+        return asset if asset.is_valid() else None
+
+    start = perf_counter()
+    asset = load(folder_path)
+    profile.add_asset(kind, folder_path, perf_counter() - start)
+    if not asset.is_valid():
+        profile.add_failure(folder_path, 'not a valid content folder')
+        return None
+    return asset
+
+
+def _load_content_record(load, folder_path: str) -> Optional[dict]:
+    # Runs in a worker process, only the plain record is sent back
+    asset = _load_content(load, folder_path)
+    return asset.to_record() if asset is not None else None
+
+
+DEFAULT_INSTALL_PATH = r'C:\Program Files (x86)\Steam\steamapps\common\assettocorsa'
+
+
+class ContentRoot(NamedTuple):
+    """A folder content is loaded from, see AsettoCorsaManager.add_content_root.
+    """
+    path: str
+    priority: int
+    # The folder holding the cars and tracks folders
+    content: str
+
+    @staticmethod
+    def find(path: str, priority: int = 0) -> Optional['ContentRoot']:
+        """Returns the root of an install, or of a folder holding cars or tracks, None if it has neither.
+        """
+        content = os.path.join(path, 'content')
+        if os.path.isdir(content):
+            return ContentRoot(path, priority, content)
+        if os.path.isdir(os.path.join(path, 'cars')) or os.path.isdir(os.path.join(path, 'tracks')):
+            return ContentRoot(path, priority, path)
+        return None
+
+    def content_path(self, kind: str) -> str:
+        return os.path.join(self.content, kind)
+
+
 class AsettoCorsaManager:
 
-    def __init__(self):
+    def __init__(self, cache_path: str = None):
         self._install_path = None
+        self._extra_roots = []
+        self._roots = []
+        self._content_paths = {'cars': [], 'tracks': []}
+        # Folders content set with set_content was loaded from, for its keys
+        self._loaded_paths = {}
         self._cars = []
         self._tracks = []
         self._valid = False
-        self.set_install_path(r'C:\Program Files (x86)\Steam\steamapps\common\assettocorsa')
+        self._index: Optional[ContentIndex] = None
+        self._car_index: Optional[AssetIndex] = None
+        self._layout_index: Optional[AssetIndex] = None
+        self._weighted = False
+        self._layout_weighting = 'track'
+        # Keyed by folder path so weights survive refreshes
+        self._weights = {}
+        self._favourites = set()
+        self._excluded = set()
+        # Tracks with at least one layout that is not excluded, mapped to those layouts
+        self._track_layouts: Optional[dict] = None
+        self._car_sampler: Optional[WeightedSampler] = None
+        self._layout_sampler: Optional[WeightedSampler] = None
+        self._no_repeat = False
+        self._bag_window: Optional[int] = None
+        self._bags = {}
+        # Bag name -> {key: asset}, dropped when the content is refreshed
+        self._bag_assets = {}
+        self._history: Optional[DrawHistory] = None
+        # Saved draws waiting for their bag to be created
+        self._history_events = {}
+        self._prefetch_skins = False
+        self._scan_workers = 1
+        self._scan_processes = False
+        self._profiling = False
+        self._scan_profile: Optional[scanprofile.ScanProfile] = None
+        self.set_cache_path(cache_path)
+        self.set_install_path(DEFAULT_INSTALL_PATH)
 
     def set_install_path(self, path: str) -> bool:
         self._install_path = path
-        if path is None or not os.path.exists(path):
-            self._valid = False
-            return False
-        
-        files = os.listdir(self._install_path)
-        if 'AssettoCorsa.exe' not in files:
-            self._valid = False
+        valid = path is not None and os.path.exists(path) and 'AssettoCorsa.exe' in os.listdir(path)
+        if not valid:
+            self._install_path = None
+        self._update_roots()
+        return valid
+
+    def add_content_root(self, path: str, priority: int = 0) -> bool:
+        """Adds a folder to load content from along with the install path.
+
+        A root is any folder with a content folder, such as a server or a mod
+        staging folder, or a folder holding cars and tracks folders itself. No
+        game has to be installed in it. Every root is scanned and indexed on
+        its own and the content is merged into one pool, where a car or track
+        found in several roots comes from the root with the highest priority.
+        The install path has priority 0 and wins ties. Adding a root that was
+        already added changes its priority. Returns False if the folder has
+        no content.
+        """
+        root = ContentRoot.find(path, priority)
+        if root is None:
             return False
-        self._valid = True
+        self._extra_roots = [r for r in self._extra_roots if r.path != path] + [root]
+        self._update_roots()
         return True
+
+    def remove_content_root(self, path: str):
+        self._extra_roots = [root for root in self._extra_roots if root.path != path]
+        self._update_roots()
+
+    @property
+    def content_roots(self) -> list:
+        """The content roots, highest priority first.
+        """
+        return list(self._roots)
+
+    def _update_roots(self):
+        roots = list(self._extra_roots)
+        if self._install_path is not None:
+            roots.insert(0, ContentRoot(self._install_path, 0, os.path.join(self._install_path, 'content')))
+        # Stable, so the install path and then the order roots were added break ties
+        self._roots = sorted(roots, key=lambda root: -root.priority)
+        self._content_paths = {kind: [root.content_path(kind) for root in self._roots] for kind in ('cars', 'tracks')}
+        self._valid = len(self._roots) > 0
+
+    def set_cache_path(self, path: str):
+        """Sets where the persistent content index is kept.
+
+        With no cache path every refresh reads all content from disk.
+        """
+        if self._index is not None:
+            self._index.close()
+        self._index = ContentIndex(path) if path else None
     
+    def set_prefetch_skins(self, prefetch: bool):
+        """Sets whether scans load every car skin up front.
+
+        By default skins are only listed and loaded the first time they are
+        picked, tools that need the details of every skin can turn this on.
+        """
+        self._prefetch_skins = prefetch
+
+    def set_scan_workers(self, workers: int, processes: bool = False):
+        """Sets how many content folders are scanned concurrently.
+
+        Folders are scanned on a thread pool which mostly helps when the scan
+        is waiting on slow or network disks. With `processes` the loading and
+        json decoding of changed folders runs on a process pool instead.
+        Results always come back in folder name order.
+        """
+        self._scan_workers = max(1, int(workers))
+        self._scan_processes = processes
+
     def is_valid(self) -> bool:
         return self._valid
         
-    @property
-    def _cars_path(self) -> str:
-        return os.path.join(self._install_path, 'content', 'cars')
+    def content_path(self, kind: str) -> str:
+        """The content folder of 'cars' or 'tracks' in the highest priority root.
+        """
+        return self.content_paths(kind)[0]
 
-    @property
-    def _tracks_path(self) -> str:
-        return os.path.join(self._install_path, 'content', 'tracks')
+    def content_paths(self, kind: str) -> list:
+        """The content folders of 'cars' or 'tracks' in every root, highest priority first.
+        """
+        if kind not in self._content_paths:
+            raise ValueError(f'Unknown content kind: {kind}')
+        return self._content_paths[kind]
 
     def refresh_cache(self):
-        self._refresh_car_cache()
-        self._refresh_track_cache()
+        profile = self._start_profile()
+        try:
+            self._refresh_car_cache()
+            self._refresh_track_cache()
+        finally:
+            self._finish_profile(profile)
+
+    def set_profiling(self, enabled: bool):
+        """Sets whether scans are profiled, see profile_report.
+
+        Profiling counts file system calls and json parses and times every
+        scan phase and every folder loaded from disk. Scans are not slowed
+        down at all while it is off.
+        """
+        self._profiling = enabled
+
+    def profile_report(self, slowest: int = 10) -> Optional[dict]:
+        """Returns the profile of the last scan as plain data, or None if none was profiled.
+
+        Along with the phase timings and counts, it lists the `slowest` assets
+        to load, the ui files that needed an encoding fallback or a repair and
+        the files and folders that failed to load.
+        """
+        if self._scan_profile is None:
+            return None
+        return self._scan_profile.report(slowest)
+
+    def _start_profile(self) -> Optional[scanprofile.ScanProfile]:
+        if not self._profiling:
+            return None
+        self._scan_profile = scanprofile.ScanProfile()
+        scanprofile.activate(self._scan_profile)
+        return self._scan_profile
+
+    def _finish_profile(self, profile: Optional[scanprofile.ScanProfile]):
+        if profile is None:
+            return
+        profile.finish()
+        scanprofile.activate(None)
 
     def _refresh_car_cache(self):
         if not self.is_valid():
             return
-        self._cars.clear()
+        self._set_cars(self._merge(self._scan_roots('cars')))
+
+    def _refresh_track_cache(self):
+        if not self.is_valid():
+            return
+        self._set_tracks(self._merge(self._scan_roots('tracks')))
 
-        car_folders = os.listdir(self._cars_path)
+    def _scan_cars(self, root: str, folders: list = None, batch_size: int = None, cancelled=None,
+                   complete: bool = True):
+        load = partial(Car, prefetch_skins=self._prefetch_skins)
+        return self._scan_content('cars', root, Car, load, folders, batch_size, cancelled, complete)
 
-        for car_folder in car_folders:
-            car = Car(os.path.join(self._cars_path, car_folder))
+    def _scan_tracks(self, root: str, folders: list = None, batch_size: int = None, cancelled=None,
+                     complete: bool = True):
+        return self._scan_content('tracks', root, Track, Track.load, folders, batch_size, cancelled, complete)
 
-            if car.is_valid():
-                self._cars.append(car)
+    def _scan_roots(self, kind: str) -> list:
+        """Scans the content folders of a kind in every root, one shard each in priority order.
 
-            # car_path = os.path.join(self._cars_path, car_folder)
-            # ui_car_file = os.path.join(car_path, 'ui', 'ui_car.json')
+        Roots are scanned in parallel when there are several, each has its
+        own part of the content index so the scans never share any work.
+        """
+        scan = self._scan_cars if kind == 'cars' else self._scan_tracks
+        roots = [root for root in self.content_paths(kind) if os.path.isdir(root)]
 
-            # if not os.path.exists(ui_car_file):
-            #     continue
-            
-            # with open(ui_car_file, encoding='utf8') as file:
-            #     car_info = json.load(file, strict=False)
-            #     self._cars.append(Car(car_info))
+        def scan_root(root: str) -> list:
+            return [asset for assets, _ in scan(root) for asset in assets]
 
+        if len(roots) < 2:
+            return [scan_root(root) for root in roots]
+        # Imported here as it is slow to import and most runs never need it
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(roots)) as pool:
+            return list(pool.map(scan_root, roots))
 
-    def _refresh_track_cache(self):
+    @staticmethod
+    def _merge(shards: list) -> list:
+        """Merges the assets of every root, highest priority first, keeping the first of every folder name.
+        """
+        if len(shards) == 1:
+            return shards[0]
+        merged = {}
+        for assets in shards:
+            for asset in assets:
+                merged.setdefault(os.path.basename(asset.folder_path), asset)
+        profile = scanprofile.current
+        if profile is not None:
+            profile.count('duplicates', sum(len(assets) for assets in shards) - len(merged))
+        return list(merged.values())
+
+    def iter_refresh(self, batch_size: int = 64, cancelled=None):
+        """Scans the content folders in batches without touching the pools.
+
+        Yields `(kind, assets, done, total)` tuples where kind is 'cars' or
+        'tracks', alternating between the two so both pools fill up from the
+        start. `done` and `total` count content folders. The scan stops early
+        once `cancelled()` returns True. Meant for scanning on a worker thread
+        while the pools are filled on the main thread with add_cars and
+        add_tracks, or replaced with set_content.
+        """
         if not self.is_valid():
             return
-        self._tracks.clear()
-        track_folders = os.listdir(self._tracks_path)
+        listings = []
+        for root in self._roots:
+            listing = {}
+            for kind in ('cars', 'tracks'):
+                path = root.content_path(kind)
+                if os.path.isdir(path):
+                    listing[kind] = (path, sorted(os.listdir(path)))
+            listings.append(listing)
+        total = sum(len(folders) for listing in listings for _, folders in listing.values())
+        done = 0
+        # Roots are scanned highest priority first, so the first of every folder name wins
+        seen = {'cars': set(), 'tracks': set()}
+
+        profile = self._start_profile()
+        try:
+            for listing in listings:
+                scans = []
+                for kind, scan in (('cars', self._scan_cars), ('tracks', self._scan_tracks)):
+                    if kind in listing:
+                        path, folders = listing[kind]
+                        scans.append((kind, scan(path, folders, batch_size, cancelled)))
+                while len(scans) > 0:
+                    for scan in list(scans):
+                        kind, batches = scan
+                        batch = next(batches, None)
+                        if batch is None:
+                            scans.remove(scan)
+                            continue
+                        assets, folders = batch
+                        done += len(folders)
+                        if len(listings) > 1:
+                            assets = [asset for asset in assets if os.path.basename(asset.folder_path) not in seen[kind]]
+                            seen[kind].update(os.path.basename(asset.folder_path) for asset in assets)
+                        yield kind, assets, done, total
+        finally:
+            self._finish_profile(profile)
+
+    def iter_cars(self, match: str = None, skins: bool = False, **constraints) -> Iterator[Car]:
+        """Streams the cars of every content root straight from disk as they are found.
+
+        Nothing is kept once a car is yielded and the pools and content index
+        are left alone, so memory stays flat however large the library is.
+        Filters are checked as early as they can be: folder names against the
+        `match` glob, ignoring case, before anything is read, and
+        `constraints` (as in find_cars) once the ui file is parsed, so the
+        skins of cars that do not match are never listed. With `skins` every
+        skin of a matching car is loaded too. Cars come in the order their
+        folders are listed and excluded cars are included.
+        """
+        matcher = self._stream_matcher(AsettoCorsaManager.CAR_FILTERS, constraints)
+        seen = set() if len(self._roots) > 1 else None
+        for path in self._stream_folders('cars', match, seen):
+            car = Car()
+            car.load_asset(path)
+            if car.is_valid() and seen is not None:
+                seen.add(os.path.basename(path))
+            if car.is_valid() and (matcher is None or matcher.matches(car, constraints)):
+                car.load_skins(skins)
+                car.release_manifests()
+                yield car
+            else:
+                car.release_manifests()
+
+    def iter_skins(self, match: str = None, **constraints) -> Iterator[tuple]:
+        """Streams `(car, skin)` for every skin of the cars iter_cars finds, loading one skin at a time.
+
+        The cars never keep their skins, so only the skin being yielded is in memory.
+        """
+        for car in self.iter_cars(match, **constraints):
+            for folder in car.skin_folders:
+                skin = CarSkin(car.skin_path(folder))
+                if skin.is_valid():
+                    yield car, skin
+
+    def iter_layouts(self, match: str = None, **constraints) -> Iterator[TrackLayout]:
+        """Streams the track layouts of every content root straight from disk, see iter_cars.
 
-        for track_folder in track_folders:
-            track_path = os.path.join(self._tracks_path, track_folder)
-            track_ui_file = os.path.join(track_path, 'ui', 'ui_tack.json')
+        `match` is checked against the track folder names and `constraints`
+        (as in find_layouts) against every layout once it is parsed.
+        """
+        matcher = self._stream_matcher(AsettoCorsaManager.LAYOUT_FILTERS, constraints)
+        seen = set() if len(self._roots) > 1 else None
+        for path in self._stream_folders('tracks', match, seen):
+            track = Track.load(path)
+            if track.is_valid() and seen is not None:
+                seen.add(os.path.basename(path))
+            for layout in track.get_layouts():
+                if matcher is None or matcher.matches(layout, constraints):
+                    yield layout
+
+    def _stream_folders(self, kind: str, match: str = None, seen: set = None) -> Iterator[str]:
+        """Yields the content folders of a kind root by root, highest priority first, as they are listed.
+
+        Folders named as one in `seen`, a valid folder of a higher priority
+        root, are skipped like in _merge.
+        """
+        pattern = match.lower() if match else None
+        for root in self.content_paths(kind):
+            try:
+                entries = os.scandir(root)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if seen is not None and entry.name in seen:
+                        continue
+                    if pattern is not None and not fnmatchcase(entry.name.lower(), pattern):
+                        continue
+                    if entry.is_dir():
+                        yield entry.path
 
-            track = Track(track_path)
-            track.load_layouts()
+    @staticmethod
+    def _stream_matcher(filters: dict, constraints: dict) -> Optional[AssetIndex]:
+        # An empty index only checks single assets, see AssetIndex.matches
+        if len(constraints) == 0:
+            return None
+        matcher = AssetIndex((), **filters)
+        for field in constraints:
+            if field not in matcher.numeric_fields and field not in matcher.categorical_fields:
+                raise ValueError(f'Unknown filter: {field}')
+        return matcher
+
+    def set_content(self, cars: list, tracks: list, content_paths: dict = None):
+        """Replaces the car and track pools, such as with the result of iter_refresh.
+
+        `content_paths` maps 'cars' and 'tracks' to the folders the assets
+        were loaded from when they are not in the content roots, such as a
+        snapshot loaded where the game is not installed, so their keys stay
+        relative to those folders.
+        """
+        self._loaded_paths = content_paths or {}
+        self._set_cars(cars)
+        self._set_tracks(tracks)
 
-            if not os.path.exists(track_ui_file):
-                # Look for any folders that might contain variations
-                internal_files = os.listdir(os.path.join(track_path, 'ui'))
+    def add_cars(self, cars: list):
+        """Adds cars to the pool, updating the samplers and bags in place.
+        """
+        self._replace_cars([], cars)
 
-                for folder in internal_files:
-                    pass
-                    # folder_path = os.path.join(track_path, 'ui', folder)
-                    # if not os.path.isdir(folder_path):
-                    #     continue
-                    
-                    # ui_file = os.path.join(folder_path, 'ui_track.json')
+    def add_tracks(self, tracks: list):
+        self._replace_tracks([], tracks)
 
-                    # if not os.path.exists(ui_file):
-                    #     continue
+    def refresh_folders(self, kind: str, folders) -> bool:
+        """Rescans only the named car or track folders and updates them in the pools.
+
+        Folders that no longer exist are dropped from the pools and the
+        content index, new ones are added and changed ones replaced. Returns
+        whether anything in the pools changed.
+        """
+        if not self.is_valid():
+            return False
+        folders = sorted(set(folders))
+        scan = self._scan_cars if kind == 'cars' else self._scan_tracks
+        # Folder name -> asset from the highest priority root that has a valid one
+        loaded = {}
+        profile = self._start_profile()
+        try:
+            for root in self.content_paths(kind):
+                present = [folder for folder in folders if os.path.isdir(os.path.join(root, folder))]
+                missing = [folder for folder in folders if folder not in present]
+                # Lower priority roots are only read for folders still without an asset
+                present = [folder for folder in present if folder not in loaded]
+                for assets, _ in scan(root, present, complete=False):
+                    for asset in assets:
+                        loaded.setdefault(os.path.basename(asset.folder_path), asset)
+                if self._index is not None:
+                    self._index.update(root, kind, {}, missing)
+        finally:
+            self._finish_profile(profile)
+        loaded = list(loaded.values())
+
+        names = set(folders)
+        pool = self._cars if kind == 'cars' else self._tracks
+        old = [asset for asset in pool if os.path.basename(asset.folder_path) in names]
+        if len(old) == 0 and len(loaded) == 0:
+            return False
+        pool[:] = [asset for asset in pool if os.path.basename(asset.folder_path) not in names]
+        if kind == 'cars':
+            self._replace_cars(old, loaded)
+        else:
+            self._replace_tracks(old, loaded)
+        return True
+
+    def _replace_cars(self, old: list, new: list):
+        # Expects the old cars to be out of the pool already
+        self._cars.extend(new)
+        # Sorted columns are rebuilt on the next filtered pick
+        self._car_index = None
+        if self._car_sampler is not None:
+            for car in old:
+                self._car_sampler.remove(car)
+            for car in new:
+                self._car_sampler.add(car, self.weight_of(car))
+        self._update_bag('cars', old, new)
+
+    def _replace_tracks(self, old: list, new: list):
+        self._tracks.extend(new)
+        self._layout_index = None
+        self._track_layouts = None
+        old_layouts = [layout for track in old for layout in track.get_layouts()]
+        new_layouts = [layout for track in new for layout in track.get_layouts()]
+        if self._layout_sampler is not None:
+            for layout in old_layouts:
+                self._layout_sampler.remove(layout)
+            for track in new:
+                for layout in track.get_layouts():
+                    self._layout_sampler.add(layout, self._layout_weight(layout, len(track.get_layouts())))
+        self._update_bag('tracks', old, new)
+        self._update_bag('layouts', old_layouts, new_layouts)
+        for track in old:
+            # Per track layout bags are synced to the new layouts on their next draw
+            self._bag_assets.pop('track:' + self.asset_key(track), None)
+
+    def _update_bag(self, name: str, removed: list, added: list):
+        by_key = self._bag_assets.get(name)
+        if by_key is None:
+            # Not created yet, it will pick the assets up when it is
+            return
+        bag = self._bags[name]
+        added = {self.asset_key(asset): asset for asset in added}
+        for asset in removed:
+            key = self.asset_key(asset)
+            if key not in added:
+                by_key.pop(key, None)
+                bag.remove(key)
+        for key, asset in added.items():
+            # A replaced asset keeps its place in the bag
+            by_key[key] = asset
+            bag.add(key)
+
+    def _set_cars(self, cars: list):
+        # Indexes, samplers and bags are rebuilt from the new pool on first use
+        self._cars[:] = cars
+        self._car_index = None
+        self._car_sampler = None
+        self._bag_assets.pop('cars', None)
+
+    def _set_tracks(self, tracks: list):
+        self._tracks[:] = tracks
+        self._layout_index = None
+        self._track_layouts = None
+        self._layout_sampler = None
+        self._bag_assets = {name: assets for name, assets in self._bag_assets.items() if name == 'cars'}
+
+    def load_from_index(self) -> bool:
+        """Fills the car and track pools straight from the content index.
+
+        No content folder is read, or even stat'ed, so this is the fastest way
+        to get a warm pool but changes made since the last refresh_cache are
+        not seen. Returns False, leaving the pools as they are, if the index
+        has no content for the install path.
+        """
+        if self._index is None or not self.is_valid():
+            return False
+        shards = {'cars': [], 'tracks': []}
+        for kind, asset_type in (('cars', Car), ('tracks', Track)):
+            for root in self.content_paths(kind):
+                entries = self._index.load(root, kind)
+                assets = []
+                for folder in sorted(entries):
+                    record = ContentIndex.decode(entries[folder][1])
+                    if record is not None:
+                        assets.append(asset_type.from_record(record))
+                shards[kind].append(assets)
+        if not any(shards['cars']) and not any(shards['tracks']):
+            return False
+
+        self._set_cars(self._merge(shards['cars']))
+        self._set_tracks(self._merge(shards['tracks']))
+        return True
+
+    def _scan_content(self, kind: str, root: str, asset_type, load, folders: list = None,
+                      batch_size: int = None, cancelled=None, complete: bool = True):
+        """Scans the folders in a content folder, reusing indexed records where possible.
+
+        Only folders whose signature changed since the last scan are loaded
+        with `load`, everything else is rebuilt from the content index. Yields
+        `(assets, folders)` for every `batch_size` folders, or once for all of
+        them. The index is updated as every batch is done, and once the last
+        batch is done folders not scanned are dropped from it unless the scan
+        is not `complete`.
+        """
+        profile = scanprofile.current
+        clock = perf_counter() if profile is not None else 0
+        cached = self._index.load(root, kind) if self._index is not None else {}
+        if profile is not None:
+            profile.add_time('index', perf_counter() - clock)
+
+        # Sorted so the order of the pool, and with it seeded picks, is the same everywhere
+        if folders is None:
+            folders = sorted(os.listdir(root))
+        batch_size = batch_size or max(1, len(folders))
+        signature = lambda path: ContentIndex.encode(asset_type.index_signature(path))
+
+        threads, processes = self._open_pools()
+        try:
+            for start in range(0, len(folders), batch_size):
+                if cancelled is not None and cancelled():
+                    return
+                batch = folders[start:start + batch_size]
+                paths = [os.path.join(root, folder) for folder in batch]
+                clock = perf_counter() if profile is not None else 0
+                signatures = self._map(signature, paths, threads)
+                if profile is not None:
+                    profile.add_time('signatures', perf_counter() - clock)
+
+                assets = [None] * len(batch)
+                stale = []
+                for i, folder in enumerate(batch):
+                    entry = cached.get(folder)
+                    if entry is not None and entry[0] == signatures[i]:
+                        # Invalid folders are indexed as None so they are not reloaded either
+                        record = ContentIndex.decode(entry[1])
+                        if record is not None:
+                            assets[i] = asset_type.from_record(record)
+                    else:
+                        stale.append(i)
+
+                stale_paths = [paths[i] for i in stale]
+                if processes is not None:
+                    records = self._map(partial(_load_content_record, load), stale_paths, processes)
+                    loaded = [asset_type.from_record(r) if r is not None else None for r in records]
+                else:
+                    loaded = self._map(partial(_load_content, load, kind=kind), stale_paths, threads)
+
+                changed = {}
+                for i, asset in zip(stale, loaded):
+                    assets[i] = asset
+                    record = asset.to_record() if asset is not None else None
+                    changed[batch[i]] = (signatures[i], ContentIndex.encode(record))
+
+                removed = []
+                if complete and start + batch_size >= len(folders):
+                    present = set(folders)
+                    removed = [folder for folder in cached if folder not in present]
+                clock = perf_counter() if profile is not None else 0
+                if self._index is not None:
+                    self._index.update(root, kind, changed, removed)
+                if profile is not None:
+                    profile.add_time('index', perf_counter() - clock)
+                yield [asset for asset in assets if asset is not None], batch
+        finally:
+            for pool in (threads, processes):
+                if pool is not None:
+                    pool.shutdown()
+
+    def _open_pools(self) -> tuple:
+        """Returns the thread and process pools for a scan, None where not used.
+        """
+        if self._scan_workers <= 1:
+            return None, None
+        # Imported here as they are slow to import and most runs never need them
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        threads = ThreadPoolExecutor(max_workers=self._scan_workers)
+        processes = None
+        # Worker processes have profiles of their own, so they are not used while profiling
+        if self._scan_processes and scanprofile.current is None:
+            processes = ProcessPoolExecutor(max_workers=self._scan_workers)
+        return threads, processes
+
+    def _map(self, func, items: list, pool=None) -> list:
+        """Maps `func` over `items` on a worker pool, keeping the input order.
+        """
+        if pool is None or len(items) < 2:
+            return [func(item) for item in items]
+        chunksize = max(1, len(items) // (self._scan_workers * 4))
+        return list(pool.map(func, items, chunksize=chunksize))
 
-                    # layout = TrackLayout(FileUtil.load_json(ui_file))
-                    # track.add_layout(layout)
-            else:
-                layout = TrackLayout(FileUtil.load_json(track_ui_file))
-                track.add_layout(layout)
-            
-            if track.is_valid():
-                self._tracks.append(track)
-                
     def get_cars(self) -> list:
         return self._cars
+
+    # Fields that can be used to filter picks
+    CAR_FILTERS = {'numeric': ('bhp', 'weight'), 'categorical': ('brand', 'catagory', 'country')}
+    LAYOUT_FILTERS = {'numeric': ('length', 'pitboxes'), 'categorical': ('direction', 'country', 'city')}
+
+    @property
+    def car_index(self) -> AssetIndex:
+        # Built on first use after each refresh
+        if self._car_index is None:
+            cars = [car for car in self._cars if car.folder_path not in self._excluded]
+            self._car_index = AssetIndex(cars, **AsettoCorsaManager.CAR_FILTERS)
+        return self._car_index
+
+    @property
+    def layout_index(self) -> AssetIndex:
+        if self._layout_index is None:
+            layouts = [layout for layouts in self.track_layouts.values() for layout in layouts]
+            self._layout_index = AssetIndex(layouts, **AsettoCorsaManager.LAYOUT_FILTERS)
+        return self._layout_index
+
+    @property
+    def track_layouts(self) -> dict:
+        """Maps every track that can be picked to its layouts that are not excluded.
+        """
+        if self._track_layouts is None:
+            self._track_layouts = {}
+            for track in self._tracks:
+                layouts = [layout for layout in track.get_layouts() if layout.folder_path not in self._excluded]
+                if len(layouts) > 0:
+                    self._track_layouts[track] = layouts
+        return self._track_layouts
     
-    def pick_random_car(self) -> Car:
-        if len(self._cars) == 0:
+    # Weight multiplier applied to favourite cars and layouts
+    FAVOURITE_WEIGHT = 4.0
+
+    def set_weighted_picks(self, weighted: bool, layout_weighting: str = 'track'):
+        """Sets whether picks take weights, favourites and skin priorities into account.
+
+        `layout_weighting` decides how layouts share the track pool: 'track'
+        gives every track the same chance split over its layouts, like the
+        unweighted pick, while 'layout' gives every layout the same chance.
+        """
+        if layout_weighting not in ('track', 'layout'):
+            raise ValueError(f'Unknown layout weighting: {layout_weighting}')
+        self._weighted = weighted
+        if layout_weighting != self._layout_weighting:
+            self._layout_weighting = layout_weighting
+            self._layout_sampler = None
+
+    @property
+    def weighted_picks(self) -> bool:
+        return self._weighted
+
+    def weight_of(self, asset: GameAsset) -> float:
+        if asset.folder_path in self._excluded:
+            return 0.0
+        weight = self._weights.get(asset.folder_path, 1.0)
+        if asset.folder_path in self._favourites:
+            weight *= AsettoCorsaManager.FAVOURITE_WEIGHT
+        return weight
+
+    def set_weight(self, asset: GameAsset, weight: float):
+        """Sets the weight of a car or track layout for weighted picks, 1 by default.
+        """
+        self._weights[asset.folder_path] = max(0.0, float(weight))
+        self._update_weight(asset)
+
+    def set_favourite(self, asset: GameAsset, favourite: bool = True):
+        if favourite:
+            self._favourites.add(asset.folder_path)
+        else:
+            self._favourites.discard(asset.folder_path)
+        self._update_weight(asset)
+
+    def is_favourite(self, asset: GameAsset) -> bool:
+        return asset.folder_path in self._favourites
+
+    def set_excluded(self, asset: GameAsset, excluded: bool = True):
+        """Sets whether a car, skin or track layout is left out of every pick.
+        """
+        if excluded == self.is_excluded(asset):
+            return
+        if excluded:
+            self._excluded.add(asset.folder_path)
+        else:
+            self._excluded.discard(asset.folder_path)
+
+        if isinstance(asset, CarSkin):
+            return
+        if isinstance(asset, Car):
+            self._update_weight(asset)
+            self._car_index = None
+            self._update_bag('cars', [asset] if excluded else [], [] if excluded else [asset])
+            return
+
+        # Layout counts per track change too, so the sampler is rebuilt on first use
+        self._layout_index = None
+        self._layout_sampler = None
+        self._track_layouts = None
+        self._update_bag('layouts', [asset] if excluded else [], [] if excluded else [asset])
+        for track in self._tracks:
+            if asset in track.get_layouts():
+                # The layout bag of the track syncs on its next draw, the track
+                # itself is only drawn while it has a layout left
+                self._bag_assets.pop('track:' + self.asset_key(track), None)
+                pickable = track in self.track_layouts
+                self._update_bag('tracks', [] if pickable else [track], [track] if pickable else [])
+                break
+
+    def is_excluded(self, asset: GameAsset) -> bool:
+        return asset.folder_path in self._excluded
+
+    def export_preferences(self) -> dict:
+        """Returns the favourites and exclusions as content relative keys, see load_preferences.
+        """
+        def keys(paths: set) -> dict:
+            found = {'cars': set(), 'tracks': set()}
+            for path in paths:
+                for kind in found:
+                    for root in self.content_paths(kind):
+                        if path.startswith(root + os.sep):
+                            found[kind].add(path[len(root) + 1:].replace(os.sep, '/'))
+            return {kind: sorted(names) for kind, names in found.items()}
+
+        if not self._valid:
+            return {}
+        return {'favourites': keys(self._favourites), 'excluded': keys(self._excluded)}
+
+    def load_preferences(self, preferences: dict):
+        """Restores favourites and exclusions saved with export_preferences.
+
+        Keys are resolved against every content root, so a car or track is
+        matched whichever root it comes from and content that has since been
+        removed is simply never matched.
+        """
+        def paths(keys: dict) -> set:
+            found = set()
+            for kind, names in keys.items():
+                for root in self.content_paths(kind):
+                    found.update(os.path.join(root, name.replace('/', os.sep)) for name in names)
+            return found
+
+        if not self._valid:
+            return
+        self._favourites = paths(preferences.get('favourites', {}))
+        self._excluded = paths(preferences.get('excluded', {}))
+        # Everything picks are made from is rebuilt, the bags keep their draws
+        self._car_index = None
+        self._layout_index = None
+        self._track_layouts = None
+        self._car_sampler = None
+        self._layout_sampler = None
+        self._bag_assets.clear()
+
+    def _update_weight(self, asset: GameAsset):
+        # Only the block of the changed asset is rebuilt
+        if isinstance(asset, Car):
+            if self._car_sampler is not None and asset in self._car_sampler:
+                self._car_sampler.set_weight(asset, self.weight_of(asset))
+        elif self._layout_sampler is not None and asset in self._layout_sampler:
+            self._layout_sampler.set_weight(asset, self._layout_weight(asset))
+
+    def _layout_weight(self, layout: TrackLayout, layout_count: int = None) -> float:
+        weight = self.weight_of(layout)
+        if self._layout_weighting == 'track':
+            if layout_count is None:
+                layout_count = self._layout_counts().get(layout.folder_path, 1)
+            weight /= layout_count
+        return weight
+
+    def _layout_counts(self) -> dict:
+        return {layout.folder_path: len(layouts) for layouts in self.track_layouts.values() for layout in layouts}
+
+    @property
+    def car_sampler(self) -> WeightedSampler:
+        if self._car_sampler is None:
+            self._car_sampler = WeightedSampler(self._cars, [self.weight_of(car) for car in self._cars])
+        return self._car_sampler
+
+    @property
+    def layout_sampler(self) -> WeightedSampler:
+        if self._layout_sampler is None:
+            layouts = []
+            weights = []
+            for track_layouts in self.track_layouts.values():
+                for layout in track_layouts:
+                    layouts.append(layout)
+                    weights.append(self._layout_weight(layout, len(track_layouts)))
+            self._layout_sampler = WeightedSampler(layouts, weights)
+        return self._layout_sampler
+
+    def set_no_repeat(self, enabled: bool, window: int = None, history_path: str = None):
+        """Sets whether unfiltered picks avoid repeating cars and tracks.
+
+        Picks are drawn from shuffle bags so nothing repeats until the whole
+        pool has been drawn, or with a `window` until that many other picks
+        have been made. Tracks are bagged per track with their layouts rotating
+        in a bag of their own, or per layout when layouts are weighted on their
+        own (see set_weighted_picks). Draws are appended to the file at
+        `history_path` so the bags carry on where they left off after a
+        restart.
+        """
+        self._no_repeat = enabled
+        self._bag_window = window
+        self._bags = {}
+        self._bag_assets = {}
+        self._history = DrawHistory(history_path) if history_path else None
+        self._history_events = self._history.load() if self._history is not None else {}
+        if window is not None:
+            self._history_events = {bag: keys[-window:] for bag, keys in self._history_events.items()}
+        if self._history is not None:
+            self._history.compact(self._history_events)
+
+    def asset_key(self, asset: GameAsset) -> str:
+        """Returns the path of an asset folder relative to its content folder.
+        """
+        kind = 'cars' if isinstance(asset, Car) else 'tracks'
+        roots = self.content_paths(kind) + self._loaded_paths.get(kind, [])
+        path = asset.folder_path
+        for root in roots:
+            if path.startswith(root):
+                return path[len(root):].lstrip('\\/').replace(os.sep, '/')
+        if len(roots) == 0:
+            return os.path.basename(path)
+        return os.path.relpath(path, roots[0]).replace(os.sep, '/')
+
+    def _bag(self, name: str, assets: list) -> ShuffleBag:
+        """Returns the named shuffle bag, creating it or syncing it after a refresh.
+        """
+        bag = self._bags.get(name)
+        if bag is not None and name in self._bag_assets:
+            return bag
+
+        by_key = {self.asset_key(asset): asset for asset in assets}
+        self._bag_assets[name] = by_key
+        if bag is None:
+            # Layout bags are small, rotating through all of them is enough
+            window = self._bag_window if name in ('cars', 'tracks', 'layouts') else None
+            bag = ShuffleBag(list(by_key), window)
+            for key in self._history_events.pop(name, []):
+                bag.mark_drawn(key)
+            self._bags[name] = bag
+        else:
+            bag.sync(list(by_key))
+        return bag
+
+    def _draw(self, name: str, assets: list):
+        key, refilled = self._bag(name, assets).draw(random)
+        if key is None:
             return None
-        return self._cars[random.randint(0, len(self._cars) - 1)]
+        if self._history is not None:
+            self._history.append(name, key, refilled)
+        return self._bag_assets[name][key]
+
+    def _pick_weighted(self, rng, sampler: WeightedSampler, index: AssetIndex, weight, constraints: dict):
+        if len(constraints) == 0:
+            return sampler.sample(rng)
+        for _ in range(AssetIndex.REJECTION_ATTEMPTS):
+            asset = sampler.sample(rng)
+            if asset is None:
+                return None
+            if index.matches(asset, constraints):
+                return asset
+        found = index.filter(**constraints)
+        weights = [weight(asset) for asset in found]
+        if sum(weights) <= 0:
+            return None
+        return rng.choices(found, weights)[0]
     
-    def pick_random_track(self) -> TrackLayout:
-        if len(self._tracks) == 0:
+    def pick_random_car(self, **constraints) -> Car:
+        """Picks a random car, optionally only from cars matching the constraints.
+
+        Filters on bhp, weight, brand, catagory and country, for example
+        `pick_random_car(catagory='GT3', bhp=(450, 550), weight=(None, 1300))`.
+        See AssetIndex for the constraint format.
+        """
+        if self._no_repeat and len(constraints) == 0:
+            return self._draw('cars', self.car_index.assets)
+        return self.sample_car(random, constraints)
+    
+    def pick_random_track(self, **constraints) -> TrackLayout:
+        """Picks a random track layout.
+
+        Without constraints a track is picked first and then one of its
+        layouts. With constraints the pick is made evenly from every matching
+        layout, filtering on length (in meters), pitboxes, direction, country
+        and city.
+
+        No-repeat picks (see set_no_repeat) take precedence over weighted
+        picks, and filtered picks are never affected by the shuffle bags.
+        """
+        if self._no_repeat and len(constraints) == 0:
+            if self._layout_weighting == 'layout':
+                return self._draw('layouts', self.layout_index.assets)
+            track: Track = self._draw('tracks', list(self.track_layouts))
+            if track is None:
+                return None
+            return self._draw('track:' + self.asset_key(track), self.track_layouts[track])
+        return self.sample_layout(random, constraints)
+
+    def pick_random_skin(self, car: Car) -> Optional[CarSkin]:
+        # Weighted picks favour skins with a higher priority
+        return self.sample_skin(random, car)
+
+    def sample_car(self, rng, constraints: dict = None) -> Optional[Car]:
+        """Picks a car with the given random generator, ignoring the shuffle bags.
+
+        Used for reproducible picks from a seeded random.Random.
+        """
+        constraints = constraints or {}
+        if self._weighted:
+            return self._pick_weighted(rng, self.car_sampler, self.car_index, self.weight_of, constraints)
+        if len(constraints) > 0:
+            return self.car_index.sample(rng, **constraints)
+        cars = self.car_index.assets
+        if len(cars) == 0:
             return None
-        
-        track: Track = self._tracks[random.randint(0, len(self._tracks) - 1)]
-        return track.random_layout()
+        return cars[rng.randint(0, len(cars) - 1)]
+
+    def sample_layout(self, rng, constraints: dict = None) -> Optional[TrackLayout]:
+        """Picks a track layout with the given random generator, ignoring the shuffle bags.
+        """
+        constraints = constraints or {}
+        if self._weighted:
+            return self._pick_weighted(rng, self.layout_sampler, self.layout_index, self._layout_weight, constraints)
+        if len(constraints) > 0:
+            return self.layout_index.sample(rng, **constraints)
+        tracks = list(self.track_layouts.values())
+        if len(tracks) == 0:
+            return None
+
+        layouts = tracks[rng.randint(0, len(tracks) - 1)]
+        return layouts[rng.randint(0, len(layouts) - 1)]
+
+    def sample_skin(self, rng, car: Car) -> Optional[CarSkin]:
+        skin = car.random_skin(weighted=self._weighted, rng=rng)
+        if skin is None or skin.folder_path not in self._excluded:
+            return skin
+        for _ in range(AssetIndex.REJECTION_ATTEMPTS):
+            skin = car.random_skin(weighted=self._weighted, rng=rng)
+            if skin.folder_path not in self._excluded:
+                return skin
+        skins = [skin for skin in car.skins if skin.folder_path not in self._excluded]
+        if len(skins) == 0:
+            return None
+        if self._weighted:
+            return rng.choices(skins, [1 + max(skin.priority, 0) for skin in skins])[0]
+        return skins[rng.randint(0, len(skins) - 1)]
+
+    def find_cars(self, **constraints) -> list:
+        return self.car_index.filter(**constraints)
 
+    def find_layouts(self, **constraints) -> list:
+        return self.layout_index.filter(**constraints)
 
     def get_tracks(self) -> list:
         return self._tracks
 
 
-def main():
-    game = AsettoCorsaManager()
-    game.refresh_cache()
-    car = game.pick_random_car()
-    track = game.pick_random_track()
-    print(f'Car:', car, '-', car.brand, '-', car.random_skin())
+def catalog_memory_report(install_path: str, prefetch_skins: bool = True) -> dict:
+    """Scans a content folder under tracemalloc and reports the memory the catalog keeps.
+
+    Skins are prefetched by default so every asset in the library is counted.
+    """
+    import gc
+    import tracemalloc
+
+    manager = AsettoCorsaManager()
+    manager.set_install_path(install_path)
+    manager.set_prefetch_skins(prefetch_skins)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        manager.refresh_cache()
+        gc.collect()
+        used, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    cars = manager.get_cars()
+    skins = sum(car.skin_count for car in cars)
+    layouts = sum(len(track.get_layouts()) for track in manager.get_tracks())
+    assets = len(cars) + skins + layouts
+    used -= before
+    return {
+        'cars': len(cars),
+        'skins': skins,
+        'layouts': layouts,
+        'bytes': used,
+        'peak_bytes': peak - before,
+        'bytes_per_asset': used / assets if assets else 0,
+    }
+
+
+# Budget for importing this module, and modules a headless run must never
+# import because they are slow to load or only needed by the GUI.
+IMPORT_BUDGET_MS = 50
+HEAVY_MODULES = ('PySide6', 'shiboken6', 'numpy', 'multiprocessing', 'concurrent.futures',
+                 'asyncio', 'tracemalloc', 'argparse', 'sqlite3')
+
+
+def check_startup(budget_ms: float = IMPORT_BUDGET_MS) -> bool:
+    """Imports this module in a fresh interpreter and checks it stays fast to start.
+
+    Fails if the import takes longer than `budget_ms` or pulls in any of
+    HEAVY_MODULES. The best of a few runs is used to even out disk caches.
+    """
+    import subprocess
+
+    code = (
+        'import sys, time\n'
+        'start = time.perf_counter()\n'
+        'import game\n'
+        'elapsed = (time.perf_counter() - start) * 1000\n'
+        f'heavy = sorted(m for m in sys.modules if m.split(".")[0] in {HEAVY_MODULES!r} or m in {HEAVY_MODULES!r})\n'
+        'print(elapsed, ",".join(heavy))\n'
+    )
+    folder = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    heavy = ''
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-c', code], cwd=folder,
+                                capture_output=True, text=True, check=True)
+        elapsed, _, heavy = result.stdout.strip().partition(' ')
+        best = float(elapsed) if best is None else min(best, float(elapsed))
+
+    print(f'Import time: {best:.1f}ms (budget {budget_ms}ms)')
+    if heavy:
+        print(f'! Heavy modules imported: {heavy}')
+    if best > budget_ms:
+        print('! Import time is over budget')
+    return best <= budget_ms and not heavy
+
+
+def parse_constraints(values: list) -> dict:
+    """Parses `field=value` command line filters.
+
+    Values of numeric fields are numbers, or ranges written as `min:max`
+    where either side may be left empty. Other fields take a category, or
+    several as `a,b`, with `\\,` for a comma inside a category.
+    """
+    numeric = AsettoCorsaManager.CAR_FILTERS['numeric'] + AsettoCorsaManager.LAYOUT_FILTERS['numeric']
+
+    def number(field: str, text: str) -> float:
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError(f'Filter {field} needs a number or a min:max range: {text}') from None
+
+    constraints = {}
+    for value in values or []:
+        field, sep, text = value.partition('=')
+        if not sep:
+            raise ValueError(f'Filters are written as field=value: {value}')
+        if field in numeric:
+            if ':' in text:
+                low, high = text.split(':', 1)
+                constraints[field] = (number(field, low) if low else None, number(field, high) if high else None)
+            else:
+                constraints[field] = number(field, text)
+        else:
+            categories = [category.replace('\\,', ',') for category in re.split(r'(?<!\\),', text)]
+            constraints[field] = categories if len(categories) > 1 else categories[0]
+    return constraints
+
+
+def main(argv: list = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Picks random Assetto Corsa cars and tracks.')
+    parser.add_argument('--path', default=DEFAULT_INSTALL_PATH, help='Assetto Corsa install folder')
+    parser.add_argument('--root', action='append', metavar='[PRIORITY=]FOLDER',
+                        help='another folder to load content from, such as a server or mod folder. '
+                             'Cars and tracks in several folders come from the highest priority, 0 by default')
+    parser.add_argument('--cache', default=None, help='content index file to reuse between runs')
+    parser.add_argument('--weighted', action='store_true', help='use weights and skin priorities')
+    parser.add_argument('--no-scan', action='store_true',
+                        help='pick straight from the --cache index without checking the content folders')
+    parser.add_argument('--profile', action='store_true', help='print a profile of the content scan to stderr')
+    parser.add_argument('--snapshot', default=None,
+                        help='load the content from a snapshot file instead of scanning, see snapshot.py')
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('check-startup', help='check the import time and modules of this module')
+
+    pick = commands.add_parser('pick', help='pick a single car and track')
+    pick.add_argument('--car', action='append', metavar='FIELD=VALUE', help='car filter')
+    pick.add_argument('--track', action='append', metavar='FIELD=VALUE', help='track layout filter')
+
+    batch = commands.add_parser('batch', help='stream many car and track pairings')
+    batch.add_argument('-n', '--count', type=int, default=10)
+    batch.add_argument('--seed', default=None)
+    batch.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    batch.add_argument('--rounds', default=None,
+                       help='json file with a list of {"car": {...}, "track": {...}} constraints per round')
+    batch.add_argument('--unique-window', type=int, default=0,
+                       help='no car or layout repeats within this many pairings')
+    batch.add_argument('--no-skins', action='store_true', help='do not pick skins')
+
+    grid = commands.add_parser('grid', help='pick grids of cars with close power to weight ratios')
+    grid.add_argument('--size', type=int, default=12, help='cars in a grid')
+    grid.add_argument('--tolerance', type=float, default=0.05,
+                      help='how far apart power to weight ratios can be, 0.05 is 5%%')
+    grid.add_argument('-n', '--count', type=int, default=1, help='grids to generate')
+    grid.add_argument('--seed', default=None)
+    grid.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    grid.add_argument('--car', action='append', metavar='FIELD=VALUE', help='car filter')
+    grid.add_argument('--no-skins', action='store_true', help='do not pick skins')
+
+    serve = commands.add_parser('serve', help='answer picks over local HTTP, see service.py')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765, help='0 picks a free port')
+    serve.add_argument('--socket', default=None, help='listen on this Unix socket instead of a port')
+
+    listing = commands.add_parser('list', help='stream cars, skins or layouts from disk as json lines, without a scan')
+    listing.add_argument('kind', choices=('cars', 'skins', 'layouts'))
+    listing.add_argument('--match', default=None, metavar='GLOB',
+                         help='only car or track folders whose name matches, such as "ks_*"')
+    listing.add_argument('--car', action='append', metavar='FIELD=VALUE', help='car filter')
+    listing.add_argument('--track', action='append', metavar='FIELD=VALUE', help='track layout filter')
+
+    export = commands.add_parser('export-snapshot', help='write the content to a snapshot file for other machines')
+    export.add_argument('file')
+    export.add_argument('--skins', action='store_true', help='load and write the data of every skin')
+    args = parser.parse_args(argv)
+
+    if args.command == 'check-startup':
+        sys.exit(0 if check_startup() else 1)
+
+    try:
+        _run_command(args)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The output was piped into something like head that stopped reading,
+        # stdout goes to devnull so flushing it on exit does not fail again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    except (ValueError, TypeError) as e:
+        # Bad filters, values and rounds files
+        print(f'! {e}', file=sys.stderr)
+        sys.exit(1)
+
+
+def _run_command(args):
+    game = AsettoCorsaManager(cache_path=args.cache)
+    game.set_install_path(args.path)
+    for value in args.root or []:
+        priority, sep, path = value.partition('=')
+        if not sep or not priority.lstrip('-').isdigit():
+            priority, path = 0, value
+        if not game.add_content_root(path, int(priority)):
+            print(f'! No content found in {path}', file=sys.stderr)
+    if args.command == 'list':
+        if args.kind == 'layouts':
+            rows = (layout.to_record() for layout in game.iter_layouts(args.match, **parse_constraints(args.track)))
+        elif args.kind == 'skins':
+            rows = (dict(skin.to_record(), car=game.asset_key(car))
+                    for car, skin in game.iter_skins(args.match, **parse_constraints(args.car)))
+        else:
+            rows = (car.to_record() for car in game.iter_cars(args.match, **parse_constraints(args.car)))
+        for row in rows:
+            sys.stdout.write(json.dumps(row, ensure_ascii=False))
+            sys.stdout.write('\n')
+        return
+
+    game.set_weighted_picks(args.weighted)
+    game.set_profiling(args.profile)
+    if args.snapshot is not None:
+        from snapshot import load_snapshot
+
+        if not load_snapshot(game, args.snapshot):
+            return
+    elif not args.no_scan or not game.load_from_index():
+        game.refresh_cache()
+    if args.profile:
+        report = game.profile_report()
+        print(scanprofile.format_report(report) if report else 'No scan was profiled', file=sys.stderr)
+
+    if args.command == 'export-snapshot':
+        from snapshot import write_snapshot
+
+        rows = write_snapshot(game, args.file, args.skins)
+        print(f'Wrote {rows["cars"]} cars, {rows["skins"]} skins, {rows["tracks"]} tracks '
+              f'and {rows["layouts"]} layouts to {args.file}')
+        return
+
+    if args.command == 'grid':
+        from grids import GridGenerator, write_grids
+
+        generator = GridGenerator(game, args.size, args.tolerance, parse_constraints(args.car), args.seed,
+                                  not args.no_skins)
+        write_grids(game, generator.generate(args.count), sys.stdout, args.format)
+        return
+
+    if args.command == 'serve':
+        from service import serve
+
+        if not serve(game, args.host, args.port, args.socket):
+            sys.exit(1)
+        return
+
+    if args.command == 'batch':
+        from pairings import PairingGenerator, write_pairings
+
+        rounds = None
+        if args.rounds:
+            with open(args.rounds, encoding='utf-8') as f:
+                rounds = json.load(f)
+        generator = PairingGenerator(game, args.seed, rounds, args.unique_window, not args.no_skins)
+        write_pairings(game, generator.generate(args.count), sys.stdout, args.format)
+        return
+
+    car_constraints = parse_constraints(getattr(args, 'car', None))
+    track_constraints = parse_constraints(getattr(args, 'track', None))
+    car = game.pick_random_car(**car_constraints)
+    track = game.pick_random_track(**track_constraints)
+    if car is None or track is None:
+        print('! No car or track found', file=sys.stderr)
+        return
+    print(f'Car:', car, '-', car.brand, '-', game.pick_random_skin(car))
     print(f'Track:', track)
     print(f'   Length: {track.length * 0.001:.2f}km')
 
-    # print('\nTracks List')
-    # print('-' * 60)
-    # track: Track
-    # for track in game.get_tracks():
-    #     for t in track.tracks:
-    #         print(t)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Modules loaded by the commands import game, they get this module rather than a second copy
+    sys.modules.setdefault('game', sys.modules[__name__])
+    main()
@@ -0,0 +1,161 @@
+import bisect
+import csv
+import json
+import os
+import random
+from array import array
+from typing import Iterator, NamedTuple
+
+from game import AsettoCorsaManager, Car
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Grid(NamedTuple):
+    number: int
+    cars: list
+    # One skin per car, None where skins are not picked
+    skins: list
+
+    @staticmethod
+    def power_to_weight(car: Car) -> float:
+        # bhp per tonne
+        return car.bhp / car.weight * 1000
+
+    def to_rows(self, manager: AsettoCorsaManager) -> list:
+        rows = []
+        for position, (car, skin) in enumerate(zip(self.cars, self.skins), 1):
+            rows.append({
+                'grid': self.number,
+                'position': position,
+                'car': manager.asset_key(car),
+                'car_name': car.name,
+                'skin': skin.name if skin is not None else '',
+                'skin_folder': os.path.basename(skin.folder_path) if skin is not None else '',
+                'bhp': car.bhp,
+                'weight': car.weight,
+                'bhp_per_tonne': round(Grid.power_to_weight(car), 1),
+            })
+        return rows
+
+
+ROW_FIELDS = ('grid', 'position', 'car', 'car_name', 'skin', 'skin_folder', 'bhp', 'weight', 'bhp_per_tonne')
+
+
+class GridGenerator:
+    """Generates grids of different cars with power to weight ratios close to each other.
+
+    The ratios of the matching cars are computed once and sorted, and for
+    every car the end of the window of cars at most `tolerance` above it
+    (0.05 is 5%) is found with a binary search, vectorized when NumPy is
+    installed. A car whose window holds `size` cars can lead a grid, so
+    every grid is drawn in constant time: a leading car, then the rest of
+    the grid from its window, without any rejected picks however tight the
+    tolerance. Every leading car is equally likely, so slow and fast grids
+    come up as often as each other.
+
+    Cars without a bhp or weight in their ui file are left out. `constraints`
+    filter the cars as in find_cars. The same seed gives the same grids for
+    the same content, with or without NumPy.
+    """
+
+    def __init__(self, manager: AsettoCorsaManager, size: int, tolerance: float = 0.05,
+                 constraints: dict = None, seed=None, skins: bool = True):
+        if size < 1:
+            raise ValueError('Grids need at least one car')
+        if tolerance < 0:
+            raise ValueError('The tolerance cannot be negative')
+        self.manager = manager
+        self.size = size
+        self.tolerance = tolerance
+        self.seed = seed
+        self.skins = skins
+
+        cars = manager.find_cars(**constraints) if constraints else manager.car_index.assets
+        cars = [car for car in cars if car.bhp > 0 and car.weight > 0]
+        if numpy is not None:
+            self._cars, self._ends, self._leaders = self._windows_numpy(cars, size, tolerance)
+        else:
+            self._cars, self._ends, self._leaders = self._windows(cars, size, tolerance)
+
+    @staticmethod
+    def _windows(cars: list, size: int, tolerance: float) -> tuple:
+        """Sorts the cars by ratio, returning them with the end of every car's window and the cars that can lead.
+        """
+        ratios = array('d', map(Grid.power_to_weight, cars))
+        order = sorted(range(len(cars)), key=ratios.__getitem__)
+        ratios = array('d', (ratios[i] for i in order))
+        scale = 1 + tolerance
+        # Both ends only move forward, so the windows slide along the sorted ratios
+        ends = array('I', bytes(4 * len(order)))
+        end = 0
+        for i, ratio in enumerate(ratios):
+            end = bisect.bisect_right(ratios, ratio * scale, end)
+            ends[i] = end
+        leaders = array('I', (i for i in range(len(order)) if ends[i] - i >= size))
+        return [cars[i] for i in order], ends, leaders
+
+    @staticmethod
+    def _windows_numpy(cars: list, size: int, tolerance: float) -> tuple:
+        bhp = numpy.fromiter((car.bhp for car in cars), dtype=numpy.float64, count=len(cars))
+        weight = numpy.fromiter((car.weight for car in cars), dtype=numpy.float64, count=len(cars))
+        ratios = bhp / weight * 1000
+        order = numpy.argsort(ratios, kind='stable')
+        ratios = ratios[order]
+        ends = numpy.searchsorted(ratios, ratios * (1 + tolerance), side='right')
+        leaders = numpy.flatnonzero(ends - numpy.arange(len(ratios)) >= size)
+        return [cars[i] for i in order.tolist()], ends.tolist(), leaders.tolist()
+
+    @property
+    def leaders(self) -> int:
+        """How many cars can lead a grid, 0 if no grid fits the tolerance.
+        """
+        return len(self._leaders)
+
+    def __iter__(self) -> Iterator[Grid]:
+        return self.generate()
+
+    def generate(self, count: int = None) -> Iterator[Grid]:
+        """Yields `count` grids, or grids forever if no count is given.
+        """
+        if len(self._leaders) == 0:
+            raise ValueError(f'No {self.size} cars have power to weight ratios within {self.tolerance:.1%}')
+        rng = random.Random(self.seed)
+        n = 0
+        while count is None or n < count:
+            n += 1
+            yield self._grid(rng, n)
+
+    def batch(self, count: int) -> list:
+        """Generates `count` grids at once, sharing the sorted windows.
+        """
+        return list(self.generate(count))
+
+    def _grid(self, rng, number: int) -> Grid:
+        leader = self._leaders[rng.randrange(len(self._leaders))]
+        positions = rng.sample(range(leader + 1, self._ends[leader]), self.size - 1)
+        positions.append(leader)
+        rng.shuffle(positions)
+        cars = [self._cars[i] for i in positions]
+        skins = [self.manager.sample_skin(rng, car) if self.skins else None for car in cars]
+        return Grid(number, cars, skins)
+
+
+def write_grids(manager: AsettoCorsaManager, grids: Iterator[Grid], file, format: str = 'jsonl'):
+    """Streams grids to a text file as json lines or csv, one row per car.
+    """
+    if format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=ROW_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for grid in grids:
+            writer.writerows(grid.to_rows(manager))
+    elif format == 'jsonl':
+        for grid in grids:
+            for row in grid.to_rows(manager):
+                file.write(json.dumps(row, ensure_ascii=False))
+                file.write('\n')
+    else:
+        raise ValueError(f'Unknown output format: {format}')
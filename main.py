@@ -1,6 +1,12 @@
 import sys
 import os
 import ctypes
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
 from PySide6.QtGui import QResizeEvent
 
 from PySide6.QtWidgets import *
@@ -8,9 +14,17 @@ from PySide6.QtCore import *
 from PySide6.QtGui import *
 from systemtheme import Window
 from game import *
+from catalog import CatalogWindow
+from thumbnails import ThumbnailCache
+from watcher import changed_folders, list_roots, watch_paths
 
 
 APP_ID = 'masstrix.assettocorasrandomizer.0_1_0' # arbitrary string
+CONTENT_INDEX_FILE = 'content_index.db'
+DRAW_HISTORY_FILE = 'draw_history.txt'
+THUMBNAIL_DIR = 'thumbnails'
+CATALOG_THUMBNAIL_DIR = os.path.join(THUMBNAIL_DIR, 'catalog')
+PREFERENCES_FILE = 'preferences.json'
 
 
 def resource_path(relative_path):
@@ -25,35 +39,88 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def app_path(relative_path):
+    """ Get absolute path to a file kept next to the application """
+    base_path = os.path.dirname(os.path.abspath(sys.argv[0]))
+    return os.path.join(base_path, relative_path)
+
+
 class ImageWidget(QLabel):
+    """Shows an image scaled to fit the widget.
+
+    While the widget is being resized the image is scaled with the fast
+    transformation from a pyramid of pre-scaled copies, each half the size of
+    the one before. A smooth rescale is done once no resize has happened for
+    RESIZE_SETTLE_MS.
+    """
+
+    RESIZE_SETTLE_MS = 150
+    # Smallest copy kept in the pyramid
+    MIN_LEVEL_SIZE = 64
 
     def __init__(self):
         super(ImageWidget, self).__init__()
         self._pix = None
+        self._levels = None
+
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(ImageWidget.RESIZE_SETTLE_MS)
+        self._settle_timer.timeout.connect(self.update_pix)
 
     def set_image(self, image: QImage):
         self._pix = QPixmap.fromImage(image)
+        # Only built once the widget is resized with this image shown
+        self._levels = None
         self.update_pix()
 
     def resizeEvent(self, event: QResizeEvent) -> None:
-        self.update_pix()
+        if self._pix is None:
+            return
+        m = self.fit_size()
+        self.setPixmap(self._level(m).scaled(m, m, Qt.KeepAspectRatio, Qt.FastTransformation))
+        self._settle_timer.start()
+
+    def _level(self, size: int) -> QPixmap:
+        """The smallest pre-scaled copy that is still at least `size` big.
+        """
+        if self._levels is None:
+            self._levels = [self._pix]
+            pix = self._pix
+            while max(pix.width(), pix.height()) // 2 >= ImageWidget.MIN_LEVEL_SIZE:
+                pix = pix.scaled(pix.width() // 2, pix.height() // 2, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                self._levels.append(pix)
+        for level in reversed(self._levels):
+            if max(level.width(), level.height()) >= size:
+                return level
+        return self._levels[0]
 
     def update_pix(self):
         if self._pix is None:
             return
-        w = self.width()
-        h = self.height()
-        m = max(w, h)
-        self.setPixmap(self._pix.scaled(m, m, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        m = self.fit_size()
+        if max(self._pix.width(), self._pix.height()) == m:
+            # Already scaled to fit, such as a prefetched pick
+            self.setPixmap(self._pix)
+            return
+        # A level at most twice the size gives the same result for less work
+        source = self._level(m) if self._levels is not None else self._pix
+        self.setPixmap(source.scaled(m, m, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+
+    def fit_size(self) -> int:
+        """The size images are scaled to fit in both directions.
+        """
+        return max(self.width(), self.height())
 
 
 class PreviewCard(QWidget):
 
-    def __init__(self):
+    def __init__(self, thumbnails: ThumbnailCache):
         super(PreviewCard, self).__init__()
         self.setAttribute(Qt.WA_StyledBackground, True)
 
         self._stats = {}
+        self._thumbnails = thumbnails
 
 
         layout = QVBoxLayout()
@@ -102,32 +169,279 @@ class PreviewCard(QWidget):
         self.title_widget.setText(text)
 
     def set_image(self, image_path: str):
-        if image_path is None:
+        self.show_image(self._thumbnails.get(image_path))
+
+    def show_image(self, image: Optional[QImage]):
+        if image is None:
             return
-        image = QImage(image_path)
-        image.scaledToHeight(300)
         self.image_widget.set_image(image)
 
 
+class PreparedCar(NamedTuple):
+    car: Optional[Car]
+    skin: Optional[CarSkin]
+    image: Optional[QImage]
+
+
+class PreparedTrack(NamedTuple):
+    layout: Optional[TrackLayout]
+    image: Optional[QImage]
+
+
+class PickQueue:
+    """A few picks drawn and prepared ahead of time on a worker thread.
+
+    `prepare` is called on the executor with the image size and returns a
+    ready to paint pick. pop hands out the oldest pick and queues another
+    one in its place. It never waits on the executor, when the oldest pick
+    is still being prepared a pick is prepared right away instead.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, prepare, size: int = 3):
+        self.size = size
+        self._executor = executor
+        self._prepare = prepare
+        self._queue = deque()
+
+    def fill(self, image_size: int):
+        while len(self._queue) < self.size:
+            self._queue.append(self._executor.submit(self._prepare, image_size))
+
+    def pop(self, image_size: int):
+        self.fill(image_size)
+        if not self._queue[0].done():
+            # The queued pick stays for the next pop
+            return self._prepare(image_size)
+        future = self._queue.popleft()
+        self.fill(image_size)
+        return future.result()
+
+    def clear(self):
+        """Drops the queued picks, such as when the pools have been replaced.
+        """
+        for future in self._queue:
+            future.cancel()
+        self._queue.clear()
+
+
+class ContentScanner(QThread):
+    """Scans the game content on a worker thread.
+
+    Batches are handed to the window as they are loaded so the pools can be
+    filled, and picked from, before the whole install has been scanned. The
+    manager's pools are never touched from this thread.
+    """
+
+    batch_loaded = Signal(str, object)
+    progress = Signal(int, int)
+
+    def __init__(self, manager: AsettoCorsaManager, batch_size: int = 32):
+        super(ContentScanner, self).__init__()
+        self.manager = manager
+        self.batch_size = batch_size
+
+    def run(self):
+        batches = self.manager.iter_refresh(self.batch_size, self.isInterruptionRequested)
+        for kind, assets, done, total in batches:
+            self.batch_loaded.emit(kind, assets)
+            self.progress.emit(done, total)
+
+
 class AppWindow(Window):
 
+    # Cars and tracks loaded before the first pick is made on a cold start
+    FIRST_PICK_POOL = 20
+    # Content changes are applied once nothing has changed for this long
+    CONTENT_SETTLE_MS = 500
+
     def __init__(self):
         super(AppWindow, self).__init__()
         self.setAttribute(Qt.WA_StyledBackground, True)
 
-        self.manager = AsettoCorsaManager()
-        self.manager.refresh_cache()
+        self.manager = AsettoCorsaManager(cache_path=app_path(CONTENT_INDEX_FILE))
+        self._favour_favourites = self._load_preferences()
+        self._apply_pick_mode()
+
+        # Pick from the last scan straight away, the scan below catches up on changes
+        self._prefilled = self.manager.load_from_index()
+        self._picked = False
+        self._scanned = {'cars': [], 'tracks': []}
 
-        self.track_preview_card = PreviewCard()
-        self.car_preview_card = PreviewCard()
+        self.thumbnails = ThumbnailCache(app_path(THUMBNAIL_DIR))
+        self.track_preview_card = PreviewCard(self.thumbnails)
+        self.car_preview_card = PreviewCard(self.thumbnails)
+        self.status_label = QLabel('')
+        self.status_label.setObjectName('status')
+        self.catalog: Optional[CatalogWindow] = None
 
         self._load_stylesheet()
 
         self.setMinimumSize(700, 500)
         self._construct_ui()
 
+        # Picks are drawn on the prefetch thread, pools are only changed with the lock held
+        self._manager_lock = threading.Lock()
+        self._prefetch = ThreadPoolExecutor(max_workers=1)
+        self.car_picks = PickQueue(self._prefetch, self._prepare_car)
+        self.track_picks = PickQueue(self._prefetch, self._prepare_track)
+        self.pick_latency_ms = 0.0
+
         # Auto pick random on open
-        self.pick_random()
+        if self._prefilled:
+            self.pick_random()
+
+        # Started once the scan is done so changes apply to complete pools
+        self.content_watcher = QFileSystemWatcher(self)
+        self.content_watcher.directoryChanged.connect(self._on_content_changed)
+        self._changed_paths = set()
+        # Folders in every watched folder, changes are found by listing them again
+        self._listings = {}
+        self._content_timer = QTimer(self)
+        self._content_timer.setSingleShot(True)
+        self._content_timer.setInterval(AppWindow.CONTENT_SETTLE_MS)
+        self._content_timer.timeout.connect(self._apply_content_changes)
+
+        self.scanner = ContentScanner(self.manager)
+        self.scanner.batch_loaded.connect(self._on_batch_loaded)
+        self.scanner.progress.connect(self._on_scan_progress)
+        self.scanner.finished.connect(self._on_scan_finished)
+        self.scanner.start()
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.scanner.requestInterruption()
+        self.scanner.wait()
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog.stop()
+            self.catalog.loader.thumbnails.close()
+        self._prefetch.shutdown(cancel_futures=True)
+        self.thumbnails.close()
+        super(AppWindow, self).closeEvent(event)
+
+    def _on_batch_loaded(self, kind: str, assets: list):
+        if self._prefilled:
+            # Keep picking from the indexed pools until the scan is complete
+            self._scanned[kind].extend(assets)
+            return
+        with self._manager_lock:
+            if kind == 'cars':
+                self.manager.add_cars(assets)
+            else:
+                self.manager.add_tracks(assets)
+        if not self._picked and len(self.manager.get_cars()) >= AppWindow.FIRST_PICK_POOL \
+                and len(self.manager.get_tracks()) >= AppWindow.FIRST_PICK_POOL:
+            self.pick_random()
+
+    def _on_scan_progress(self, done: int, total: int):
+        self.status_label.setText(f'Scanning content {done}/{total}')
+
+    def _on_scan_finished(self):
+        self.status_label.hide()
+        if self.scanner.isInterruptionRequested():
+            return
+        if self._prefilled:
+            with self._manager_lock:
+                self.manager.set_content(self._scanned['cars'], self._scanned['tracks'])
+            self._scanned = {'cars': [], 'tracks': []}
+        # Queued picks came from the pools as they were while scanning
+        self._refill_picks()
+        self._reload_catalog()
+        self._watch_content()
+        if not self._picked:
+            self.pick_random()
+
+    def _refill_picks(self):
+        self.car_picks.clear()
+        self.track_picks.clear()
+        self.car_picks.fill(self.car_preview_card.image_widget.fit_size())
+        self.track_picks.fill(self.track_preview_card.image_widget.fit_size())
+
+    def _watch_content(self):
+        # Roots already listed keep the listing changes are compared against
+        listings = list_roots(self.manager, self._listings)
+        self._listings = listings
+        watched = set(self.content_watcher.directories())
+        paths = set(listings)
+        if watched - paths:
+            self.content_watcher.removePaths(list(watched - paths))
+        if paths - watched:
+            self.content_watcher.addPaths(list(paths - watched))
+
+    def _on_content_changed(self, path: str):
+        # Unpacking a mod changes a content folder many times, wait for it to finish
+        self._changed_paths.add(path)
+        self._content_timer.start()
+
+    def _apply_content_changes(self):
+        paths = self._changed_paths
+        self._changed_paths = set()
+        with self._manager_lock:
+            changes = changed_folders(self.manager, paths, self._listings)
+            changed = False
+            for kind, folders in changes.items():
+                changed |= self.manager.refresh_folders(kind, folders)
+        if changed:
+            self._refill_picks()
+            self._reload_catalog()
+        self._watch_content()
+
+    def _load_preferences(self) -> bool:
+        """Restores the favourites and exclusions, returning whether favourites are favoured.
+        """
+        path = app_path(PREFERENCES_FILE)
+        if not os.path.isfile(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                preferences = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'! Failed to read preferences {path}: {e}')
+            return False
+        self.manager.load_preferences(preferences.get('picks', {}))
+        return bool(preferences.get('favour_favourites', False))
+
+    def _save_preferences(self):
+        path = app_path(PREFERENCES_FILE)
+        with self._manager_lock:
+            picks = self.manager.export_preferences()
+        preferences = {'favour_favourites': self._favour_favourites, 'picks': picks}
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(preferences, f, indent=2)
+        except OSError as e:
+            print(f'! Failed to save preferences {path}: {e}')
+
+    def _apply_pick_mode(self):
+        # Favourites only count with weighted picks, which shuffle bags would override
+        self.manager.set_weighted_picks(self._favour_favourites)
+        if self._favour_favourites:
+            self.manager.set_no_repeat(False)
+        else:
+            self.manager.set_no_repeat(True, history_path=app_path(DRAW_HISTORY_FILE))
+
+    def open_catalog(self):
+        if self.catalog is None:
+            thumbnails = ThumbnailCache(app_path(CATALOG_THUMBNAIL_DIR), size=CatalogWindow.ICON_SIZE,
+                                        memory_bytes=8 * 1024 * 1024, disk_bytes=64 * 1024 * 1024)
+            self.catalog = CatalogWindow(self.manager, thumbnails, self._manager_lock, self._favour_favourites)
+            self.catalog.changed.connect(self._on_catalog_changed)
+            self.catalog.reload()
+        self.catalog.show()
+        self.catalog.raise_()
+        self.catalog.activateWindow()
+
+    def _reload_catalog(self):
+        if self.catalog is not None:
+            self.catalog.reload()
+
+    def _on_catalog_changed(self):
+        if self.catalog.favour_favourites != self._favour_favourites:
+            self._favour_favourites = self.catalog.favour_favourites
+            with self._manager_lock:
+                self._apply_pick_mode()
+        # Queued picks may be of assets that were just excluded
+        self._refill_picks()
+        self._save_preferences()
 
     def _load_stylesheet(self):
         # Load stylesheet
@@ -160,48 +474,100 @@ class AppWindow(Window):
         randomize_buttons_layout.addWidget(randomize_track_btn)
         randomize_buttons_layout.addWidget(randomize_car_btn)
 
+        catalog_btn = QPushButton('Catalog')
+        catalog_btn.setCursor(Qt.CursorShape.PointingHandCursor)
+        randomize_buttons_layout.addWidget(catalog_btn)
+
         layout.addLayout(previews)
         layout.addLayout(randomize_buttons_layout)
         layout.addWidget(randomize_btn)
+        layout.addWidget(self.status_label)
         # layout.addWidget(style_reload_btn)
 
         randomize_btn.clicked.connect(self.pick_random)
         randomize_track_btn.clicked.connect(self.random_track)
         randomize_car_btn.clicked.connect(self.random_car)
+        catalog_btn.clicked.connect(self.open_catalog)
         style_reload_btn.clicked.connect(self._load_stylesheet)
 
+    def _prepare_car(self, image_size: int) -> PreparedCar:
+        with self._manager_lock:
+            car = self.manager.pick_random_car()
+            folders = car.unloaded_skin_folders() if car is not None else []
+        if car is None:
+            return PreparedCar(None, None, None)
+        # Skin files are read without the lock, the window takes it too
+        skins = {folder: CarSkin(car.skin_path(folder)) for folder in folders}
+        with self._manager_lock:
+            car.add_loaded_skins(skins)
+            skin = self.manager.pick_random_skin(car)
+        image = self.thumbnails.get(skin.preview_image) if skin is not None else None
+        return PreparedCar(car, skin, _fit_image(image, image_size))
+
+    def _prepare_track(self, image_size: int) -> PreparedTrack:
+        with self._manager_lock:
+            track = self.manager.pick_random_track()
+        image = self.thumbnails.get(track.outline_file) if track is not None else None
+        return PreparedTrack(track, _fit_image(image, image_size))
+
+    def _paint_timed(self, *shows):
+        """Paints the next picks, recording how long it took from the click.
+        """
+        start = time.perf_counter()
+        for show in shows:
+            show()
+        self.repaint()
+        self.pick_latency_ms = (time.perf_counter() - start) * 1000
+
     def random_car(self):
+        self._paint_timed(self._show_car)
+
+    def random_track(self):
+        self._paint_timed(self._show_track)
+
+    def pick_random(self):
+        self._picked = True
+        self._paint_timed(self._show_car, self._show_track)
+
+    def _show_car(self):
         # Load car info
-        car = self.manager.pick_random_car()
+        pick: PreparedCar = self.car_picks.pop(self.car_preview_card.image_widget.fit_size())
+        car = pick.car
+        if car is None:
+            self.car_preview_card.set_title('No cars found')
+            return
         self.car_preview_card.set_title(car.name)
-
-        car_skin: CarSkin = car.random_skin()
-        if car_skin:
-            self.car_preview_card.set_image(car_skin.preview_image)
-        else:
-            self.car_preview_card.set_image(None)
+        self.car_preview_card.show_image(pick.image)
         self.car_preview_card.set_stat('Brand', car.brand)
         self.car_preview_card.set_stat('Class', car.catagory)
-        self.car_preview_card.set_stat('Power', 'Undefined' if car.bhp == 0 else car.bhp)
-        self.car_preview_card.set_stat('Weight', 'Undefined' if car.weight == 0 else car.weight)
+        self.car_preview_card.set_stat('Power', 'Undefined' if car.bhp == 0 else f'{car.bhp}bhp')
+        self.car_preview_card.set_stat('Weight', 'Undefined' if car.weight == 0 else f'{car.weight}kg')
 
-    def random_track(self):
+    def _show_track(self):
         # Load track info
-        track = self.manager.pick_random_track()
+        pick: PreparedTrack = self.track_picks.pop(self.track_preview_card.image_widget.fit_size())
+        track = pick.layout
+        if track is None:
+            self.track_preview_card.set_title('No tracks found')
+            return
         self.track_preview_card.set_title(track.name)
-        self.track_preview_card.set_image(track.outline_file)
+        self.track_preview_card.show_image(pick.image)
         self.track_preview_card.set_stat('Length', f'{track.length_km}km')
         self.track_preview_card.set_stat('Country', track.country)
         self.track_preview_card.set_stat('City', track.city)
         self.track_preview_card.set_stat('Direction', track.direction)
 
-    def pick_random(self):
-        self.random_car()
-        self.random_track()
+
+def _fit_image(image: Optional[QImage], size: int) -> Optional[QImage]:
+    if image is None or size <= 0:
+        return image
+    return image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
 
 def main():
     print('Starting app')
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(APP_ID)
+    if sys.platform == 'win32':
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(APP_ID)
 
     app = QApplication(sys.argv)
     app.setApplicationDisplayName('Assetto Corsa Randomizer')
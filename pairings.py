@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import random
+from collections import deque
+from typing import Iterator, NamedTuple, Optional
+
+from game import AsettoCorsaManager, Car, CarSkin, TrackLayout
+
+
+class Pairing(NamedTuple):
+    round: int
+    car: Car
+    skin: Optional[CarSkin]
+    layout: TrackLayout
+
+    def to_row(self, manager: AsettoCorsaManager) -> dict:
+        return {
+            'round': self.round,
+            'car': manager.asset_key(self.car),
+            'car_name': self.car.name,
+            'skin': self.skin.name if self.skin is not None else '',
+            'skin_folder': os.path.basename(self.skin.folder_path) if self.skin is not None else '',
+            'track': manager.asset_key(self.layout),
+            'track_name': self.layout.name,
+            'length': self.layout.length,
+        }
+
+
+ROW_FIELDS = ('round', 'car', 'car_name', 'skin', 'skin_folder', 'track', 'track_name', 'length')
+
+
+class PairingGenerator:
+    """Lazily generates car and track pairings from the manager's warm pools.
+
+    Picks come from the manager's indexes and weights (see sample_car and
+    sample_layout) using a random generator of their own, so the same seed
+    gives the same pairings for the same content. Nothing is kept between
+    pairings apart from the recent picks used for `unique_window`.
+
+    `rounds` is a list of per round constraints, each a dict with optional
+    'car' and 'track' constraint dicts, used in turn for every pairing. With
+    a `unique_window` no car and no layout is used again within that many
+    consecutive pairings.
+    """
+
+    # Picks tried before the pool is filtered for something not used recently
+    ATTEMPTS = 64
+
+    def __init__(self, manager: AsettoCorsaManager, seed=None, rounds: list = None,
+                 unique_window: int = 0, skins: bool = True):
+        self.manager = manager
+        self.seed = seed
+        self.rounds = rounds or [{}]
+        self.unique_window = unique_window
+        self.skins = skins
+
+    def __iter__(self) -> Iterator[Pairing]:
+        return self.generate()
+
+    def generate(self, count: int = None) -> Iterator[Pairing]:
+        """Yields `count` pairings, or pairings forever if no count is given.
+        """
+        rng = random.Random(self.seed)
+        recent_cars = _RecentSet(self.unique_window)
+        recent_layouts = _RecentSet(self.unique_window)
+
+        n = 0
+        while count is None or n < count:
+            constraints = self.rounds[n % len(self.rounds)]
+            car = self._pick(rng, self.manager.sample_car, self.manager.find_cars,
+                             constraints.get('car', {}), recent_cars)
+            layout = self._pick(rng, self.manager.sample_layout, self.manager.find_layouts,
+                                constraints.get('track', {}), recent_layouts)
+            if car is None or layout is None:
+                raise ValueError(f'Round {n + 1} has no matching car or track left to pick')
+
+            recent_cars.add(car)
+            recent_layouts.add(layout)
+            skin = self.manager.sample_skin(rng, car) if self.skins else None
+            yield Pairing(n + 1, car, skin, layout)
+            n += 1
+
+    def _pick(self, rng, sample, find, constraints: dict, recent: '_RecentSet'):
+        for _ in range(self.ATTEMPTS):
+            asset = sample(rng, constraints)
+            if asset is None or asset not in recent:
+                return asset
+        candidates = [asset for asset in find(**constraints) if asset not in recent]
+        if len(candidates) == 0:
+            return None
+        return candidates[rng.randrange(len(candidates))]
+
+
+class _RecentSet:
+    """The last `size` items added, with O(1) membership checks.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._order = deque()
+        self._items = set()
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def add(self, item):
+        if self.size <= 0:
+            return
+        self._order.append(item)
+        self._items.add(item)
+        if len(self._order) > self.size:
+            self._items.discard(self._order.popleft())
+
+
+def write_pairings(manager: AsettoCorsaManager, pairings: Iterator[Pairing], file, format: str = 'jsonl'):
+    """Streams pairings to a text file as json lines or csv, one row at a time.
+    """
+    if format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=ROW_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for pairing in pairings:
+            writer.writerow(pairing.to_row(manager))
+    elif format == 'jsonl':
+        for pairing in pairings:
+            file.write(json.dumps(pairing.to_row(manager), ensure_ascii=False))
+            file.write('\n')
+    else:
+        raise ValueError(f'Unknown output format: {format}')
@@ -0,0 +1,99 @@
+import threading
+import time
+from typing import Optional
+
+
+class ScanProfile:
+    """Timings and counts collected while content is scanned.
+
+    Only filled in while it is the `current` profile, see activate. Phase
+    times are wall time added up over every call, so nested phases such as
+    json inside skins count towards both, and with several scan workers the
+    phases can add up to more than the scan took.
+    """
+
+    def __init__(self):
+        self.phases = {}  # name -> [seconds, calls]
+        self.counts = {}  # name -> count
+        self.assets = []  # (seconds, kind, path)
+        self.fallbacks = []  # (path, encoding, recovery)
+        self.failures = []  # (path, reason)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            entry = self.phases.get(phase)
+            if entry is None:
+                self.phases[phase] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_asset(self, kind: str, path: str, seconds: float):
+        self.assets.append((seconds, kind, path))
+
+    def add_fallback(self, path: str, encoding: str, recovery: Optional[str]):
+        self.fallbacks.append((path, encoding, recovery))
+
+    def add_failure(self, path: str, reason: str):
+        self.failures.append((path, reason))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self, slowest: int = 10) -> dict:
+        """Returns the profile as plain data, with the `slowest` slowest assets.
+        """
+        assets = sorted(self.assets, reverse=True)[:slowest]
+        return {
+            'elapsed_ms': self.elapsed * 1000,
+            'phases': {name: {'ms': seconds * 1000, 'calls': calls}
+                       for name, (seconds, calls) in sorted(self.phases.items())},
+            'counts': dict(sorted(self.counts.items())),
+            'assets_loaded': len(self.assets),
+            'slowest': [{'kind': kind, 'path': path, 'ms': seconds * 1000} for seconds, kind, path in assets],
+            'fallbacks': [{'path': path, 'encoding': encoding, 'recovery': recovery}
+                          for path, encoding, recovery in self.fallbacks],
+            'failures': [{'path': path, 'reason': reason} for path, reason in self.failures],
+        }
+
+
+def format_report(report: dict) -> str:
+    """Formats a ScanProfile report as readable text.
+    """
+    lines = [f'Scan took {report["elapsed_ms"]:.1f}ms, {report["assets_loaded"]} folders loaded from disk']
+    lines.append('Phases:')
+    for name, phase in report['phases'].items():
+        lines.append(f'   {name:<12}{phase["ms"]:>10.1f}ms {phase["calls"]:>8} calls')
+    lines.append('Counts:')
+    for name, count in report['counts'].items():
+        lines.append(f'   {name:<12}{count:>10}')
+    if report['slowest']:
+        lines.append('Slowest:')
+        for asset in report['slowest']:
+            lines.append(f'   {asset["ms"]:>8.2f}ms {asset["kind"]:<7}{asset["path"]}')
+    if report['fallbacks']:
+        lines.append(f'Encoding fallbacks and repairs ({len(report["fallbacks"])}):')
+        for fallback in report['fallbacks']:
+            lines.append(f'   {fallback["encoding"]}, {fallback["recovery"] or "clean"}: {fallback["path"]}')
+    if report['failures']:
+        lines.append(f'Failed ({len(report["failures"])}):')
+        for failure in report['failures']:
+            lines.append(f'   {failure["reason"]}: {failure["path"]}')
+    return '\n'.join(lines)
+
+
+# The profile scans report to, None when profiling is off. Instrumented code
+# checks this first so nothing else is done while it is off.
+current: Optional[ScanProfile] = None
+
+
+def activate(profile: Optional[ScanProfile]):
+    global current
+    current = profile
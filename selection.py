@@ -0,0 +1,462 @@
+import sys
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+
+def normalize_category(value) -> str:
+    return str(value).strip().lower()
+
+
+class AssetIndex:
+    """Sorted and hash indexes over a list of assets for filtered random draws.
+
+    Numeric fields are kept as sorted columns so a range constraint resolves to
+    a slice with two binary searches. Categorical fields are hashed by their
+    lower case value, and every category holds its own sorted numeric columns
+    so a category and a range together still resolve to a single slice.
+
+    Constraints are passed as keyword arguments named after the asset
+    attributes. Numeric constraints are a `(min, max)` tuple where either end
+    can be None, or a single value to match exactly. Categorical constraints
+    are a value or a list of accepted values, matched ignoring case.
+    """
+
+    # Draws tried from the narrowest slice before the rest of it is filtered
+    REJECTION_ATTEMPTS = 32
+
+    def __init__(self, assets: list, numeric: tuple = (), categorical: tuple = (), _partition: bool = True):
+        self.assets = list(assets)
+        self.numeric_fields = tuple(numeric)
+        self.categorical_fields = tuple(categorical)
+
+        # field -> (sorted values, asset positions in the same order)
+        self._columns = {}
+        for field in self.numeric_fields:
+            pairs = sorted((getattr(asset, field), i) for i, asset in enumerate(self.assets))
+            self._columns[field] = ([value for value, i in pairs], [i for value, i in pairs])
+
+        # field -> {category: AssetIndex of the assets in that category}
+        self._categories = {}
+        if _partition:
+            for field in self.categorical_fields:
+                groups = {}
+                for asset in self.assets:
+                    groups.setdefault(normalize_category(getattr(asset, field)), []).append(asset)
+                self._categories[field] = {
+                    category: AssetIndex(group, self.numeric_fields, self.categorical_fields, _partition=False)
+                    for category, group in groups.items()
+                }
+
+    def __len__(self) -> int:
+        return len(self.assets)
+
+    def _check_fields(self, constraints: dict):
+        for field in constraints:
+            if field not in self.numeric_fields and field not in self.categorical_fields:
+                raise ValueError(f'Unknown filter: {field}')
+
+    @staticmethod
+    def _bounds(constraint) -> tuple:
+        if isinstance(constraint, (tuple, list)):
+            low, high = constraint
+            return low, high
+        return constraint, constraint
+
+    @staticmethod
+    def _category_set(constraint) -> set:
+        if isinstance(constraint, (tuple, list, set, frozenset)):
+            return {normalize_category(value) for value in constraint}
+        return {normalize_category(constraint)}
+
+    def matches(self, asset, constraints: dict) -> bool:
+        for field, constraint in constraints.items():
+            value = getattr(asset, field)
+            if field in self._columns:
+                low, high = self._bounds(constraint)
+                if low is not None and value < low:
+                    return False
+                if high is not None and value > high:
+                    return False
+            elif normalize_category(value) not in self._category_set(constraint):
+                return False
+        return True
+
+    def _slice(self, constraints: dict) -> tuple:
+        """Returns the narrowest slice of one sorted column covering every match.
+        """
+        best = (self.assets, None, 0, len(self.assets))
+        for field, constraint in constraints.items():
+            column = self._columns.get(field)
+            if column is None:
+                continue
+            values, positions = column
+            low, high = self._bounds(constraint)
+            start = 0 if low is None else bisect_left(values, low)
+            end = len(values) if high is None else bisect_right(values, high)
+            if end - start < best[3] - best[2]:
+                best = (self.assets, positions, start, max(start, end))
+        return best
+
+    def _segments(self, constraints: dict) -> list:
+        # Narrow down by the most selective category first, then by range
+        partitions = [self]
+        narrowest = None
+        for field, constraint in constraints.items():
+            if field not in self._categories:
+                continue
+            groups = self._categories[field]
+            indexes = [groups[c] for c in self._category_set(constraint) if c in groups]
+            size = sum(len(index) for index in indexes)
+            if narrowest is None or size < narrowest:
+                narrowest = size
+                partitions = indexes
+        return [index._slice(constraints) for index in partitions]
+
+    def filter(self, **constraints) -> list:
+        """Returns every asset matching the constraints.
+        """
+        self._check_fields(constraints)
+        found = []
+        for assets, positions, start, end in self._segments(constraints):
+            for n in range(start, end):
+                asset = assets[positions[n] if positions is not None else n]
+                if self.matches(asset, constraints):
+                    found.append(asset)
+        return found
+
+    def sample(self, rng, **constraints):
+        """Draws a random asset matching the constraints, or None if nothing matches.
+
+        `rng` is anything with a `randrange`, such as the random module or a
+        seeded random.Random.
+        """
+        self._check_fields(constraints)
+        segments = [segment for segment in self._segments(constraints) if segment[3] > segment[2]]
+        total = sum(end - start for assets, positions, start, end in segments)
+        if total == 0:
+            return None
+
+        # Rejection sampling is uniform over the matches and usually succeeds
+        # straight away as the slice already satisfies the tightest constraint
+        for _ in range(self.REJECTION_ATTEMPTS):
+            asset = self._pick(segments, rng.randrange(total))
+            if self.matches(asset, constraints):
+                return asset
+
+        found = self.filter(**constraints)
+        if len(found) == 0:
+            return None
+        return found[rng.randrange(len(found))]
+
+    @staticmethod
+    def _pick(segments: list, n: int):
+        for assets, positions, start, end in segments:
+            size = end - start
+            if n < size:
+                return assets[positions[start + n] if positions is not None else start + n]
+            n -= size
+        return None
+
+    def categories(self, field: str) -> list:
+        """Returns the distinct values of a categorical field, in lower case.
+        """
+        return sorted(self._categories.get(field, {}).keys())
+
+
+class AliasTable:
+    """Walker's alias method, draws an index in proportion to its weight in O(1).
+    """
+
+    def __init__(self, weights: list):
+        count = len(weights)
+        total = float(sum(weights))
+        self.total = total
+        self._probability = [1.0] * count
+        self._alias = list(range(count))
+        if count == 0 or total <= 0:
+            return
+
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large[-1]
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(large.pop())
+        # Whatever is left is 1 up to rounding errors
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self._alias)
+
+    def sample(self, rng) -> int:
+        i = rng.randrange(len(self._alias))
+        if rng.random() < self._probability[i]:
+            return i
+        return self._alias[i]
+
+
+class WeightedSampler:
+    """Weighted random choice over a changing set of items.
+
+    Items are split into blocks of at most BLOCK_SIZE, each with its own alias
+    table, and a small alias table over the block totals picks the block. A
+    draw is two O(1) alias lookups. Adding, removing or re-weighting a single
+    item only rebuilds the table of its block and the table over the blocks,
+    never the whole set. Items with a weight of 0 are never drawn.
+    """
+
+    BLOCK_SIZE = 256
+
+    def __init__(self, items: list = (), weights: list = ()):
+        self._blocks = []
+        # item -> [block, position]
+        self._positions = {}
+        self._tables = []
+        self._top = AliasTable([])
+
+        items = list(items)
+        weights = list(weights)
+        for start in range(0, len(items), self.BLOCK_SIZE):
+            block = [list(items[start:start + self.BLOCK_SIZE]), list(weights[start:start + self.BLOCK_SIZE])]
+            for position, item in enumerate(block[0]):
+                self._positions[item] = [len(self._blocks), position]
+            self._blocks.append(block)
+            self._tables.append(AliasTable(block[1]))
+        self._rebuild_top()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, item) -> bool:
+        return item in self._positions
+
+    @property
+    def total(self) -> float:
+        return self._top.total
+
+    def _rebuild_top(self):
+        self._top = AliasTable([table.total for table in self._tables])
+
+    def _rebuild_block(self, b: int):
+        self._tables[b] = AliasTable(self._blocks[b][1])
+        self._rebuild_top()
+
+    def add(self, item, weight: float):
+        if item in self._positions:
+            self.set_weight(item, weight)
+            return
+        if len(self._blocks) == 0 or len(self._blocks[-1][0]) >= self.BLOCK_SIZE:
+            self._blocks.append([[], []])
+            self._tables.append(AliasTable([]))
+        b = len(self._blocks) - 1
+        items, weights = self._blocks[b]
+        self._positions[item] = [b, len(items)]
+        items.append(item)
+        weights.append(weight)
+        self._rebuild_block(b)
+
+    def remove(self, item):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        b, i = position
+        items, weights = self._blocks[b]
+        # Swap the last item of the block into the free slot
+        last = len(items) - 1
+        if i != last:
+            items[i] = items[last]
+            weights[i] = weights[last]
+            self._positions[items[i]][1] = i
+        items.pop()
+        weights.pop()
+        self._rebuild_block(b)
+
+    def set_weight(self, item, weight: float):
+        position = self._positions.get(item)
+        if position is None:
+            self.add(item, weight)
+            return
+        b, i = position
+        self._blocks[b][1][i] = weight
+        self._rebuild_block(b)
+
+    def weight(self, item) -> float:
+        position = self._positions.get(item)
+        if position is None:
+            return 0
+        b, i = position
+        return self._blocks[b][1][i]
+
+    def sample(self, rng):
+        """Draws an item in proportion to its weight, or None if every weight is 0.
+        """
+        if self._top.total <= 0:
+            return None
+        b = self._top.sample(rng)
+        items = self._blocks[b][0]
+        return items[self._tables[b].sample(rng)]
+
+
+class ShuffleBag:
+    """Draws keys without repeats until the pool, or a window of recent draws, is used up.
+
+    Every draw swaps a random key out of the available list and onto the
+    recent draws, so a draw is O(1). Without a window the bag refills once
+    every key has been drawn. With a window a key returns to the bag once
+    `window` other keys have been drawn after it.
+    """
+
+    def __init__(self, keys: list = (), window: int = None):
+        self.window = window
+        self._available = []
+        # key -> position in _available
+        self._positions = {}
+        self._recent = deque()
+        # Last key of a finished round, kept out of the first draw of the next one
+        self._held = None
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return len(self._available) + len(self._recent) + (self._held is not None)
+
+    def __contains__(self, key) -> bool:
+        return key in self._positions or key in self._recent or key == self._held
+
+    def add(self, key):
+        if key in self:
+            return
+        self._positions[key] = len(self._available)
+        self._available.append(key)
+
+    def remove(self, key):
+        if key in self._positions:
+            self._take(self._positions[key])
+        elif key in self._recent:
+            self._recent.remove(key)
+        elif key == self._held:
+            self._held = None
+
+    def sync(self, keys: list):
+        """Adds new keys and drops the ones no longer in the pool, keeping the draw state.
+        """
+        keys = set(keys)
+        for key in [k for k in self._available + self.drawn() if k not in keys]:
+            self.remove(key)
+        for key in keys:
+            self.add(key)
+
+    def _take(self, i: int):
+        # Swap remove from the available keys
+        key = self._available[i]
+        last = self._available.pop()
+        del self._positions[key]
+        if i < len(self._available):
+            self._available[i] = last
+            self._positions[last] = i
+        return key
+
+    def _release(self) -> bool:
+        if self.window is not None:
+            while len(self._recent) > self.window:
+                self.add(self._recent.popleft())
+        if len(self._available) == 0:
+            last = self._recent.pop()
+            self.reset()
+            self._held = last
+            return True
+        return False
+
+    def reset(self):
+        """Puts every drawn key back into the bag.
+        """
+        held = self._held
+        self._held = None
+        while len(self._recent) > 0:
+            self.add(self._recent.popleft())
+        if held is not None:
+            self.add(held)
+
+    def mark_drawn(self, key) -> bool:
+        """Records a draw made elsewhere, used to replay a saved history.
+
+        Returns True if the bag had to be refilled.
+        """
+        if key not in self._positions:
+            return False
+        self._recent.append(self._take(self._positions[key]))
+        if self._held is not None:
+            held = self._held
+            self._held = None
+            self.add(held)
+        return self._release()
+
+    def draw(self, rng) -> tuple:
+        """Draws a key, returning it and whether the bag was refilled afterwards.
+        """
+        if len(self._available) == 0:
+            self.reset()
+        if len(self._available) == 0:
+            return None, False
+        key = self._available[rng.randrange(len(self._available))]
+        return key, self.mark_drawn(key)
+
+    def drawn(self) -> list:
+        drawn = list(self._recent)
+        if self._held is not None:
+            drawn.append(self._held)
+        return drawn
+
+
+class DrawHistory:
+    """Append only log of shuffle bag draws, so no-repeat picks survive restarts.
+
+    Every line is a bag name and a drawn key separated by a tab, or a bag name
+    and an empty key when that bag was refilled. Appending keeps each draw
+    O(1), the log is compacted when it is loaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> dict:
+        """Returns the keys drawn from every bag since it was last refilled.
+        """
+        events = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    bag, sep, key = line.rstrip('\n').partition('\t')
+                    if not sep:
+                        continue
+                    if key == '':
+                        events[bag] = []
+                    else:
+                        events.setdefault(bag, []).append(key)
+        except OSError:
+            return {}
+        return events
+
+    def compact(self, events: dict):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for bag, keys in events.items():
+                    for key in keys:
+                        f.write(f'{bag}\t{key}\n')
+        except OSError as e:
+            print(f'! Failed to write draw history: {e}', file=sys.stderr)
+
+    def append(self, bag: str, key: str, refilled: bool = False):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(f'{bag}\t{key}\n')
+                if refilled:
+                    f.write(f'{bag}\t\n')
+        except OSError as e:
+            print(f'! Failed to write draw history: {e}', file=sys.stderr)
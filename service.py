@@ -0,0 +1,272 @@
+import asyncio
+import json
+import sys
+import time
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from game import AsettoCorsaManager, Car, CarSkin, parse_constraints
+from pairings import Pairing, PairingGenerator
+
+
+class HttpError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class PickService:
+    """Answers pick requests over local HTTP from a manager that stays warm.
+
+    Every request is answered on the event loop straight from the manager's
+    pools, a pick takes microseconds. Only the skins of a picked car that
+    were never loaded are read on a worker thread, as that reads from disk.
+    Scans only happen on reload, which runs iter_refresh on a worker thread and
+    swaps the new pools in on the loop once it is done, so requests keep
+    being answered from the old pools meanwhile. With a content index the
+    reload only reads folders that changed.
+
+        GET  /pick?car=catagory=GT3&car=bhp=450:550&track=country=Italy
+        GET  /batch?n=100&seed=season1&unique_window=10
+        POST /batch   {"count": 100, "seed": "season1", "rounds": [...]}
+        POST /reload
+        GET  /status
+
+    Filters are written as on the command line, see parse_constraints. A
+    seed makes /pick and /batch repeatable for the same content, picks
+    without one use the manager's own pick settings such as no-repeat.
+    """
+
+    MAX_BATCH = 10000
+    # Batch rows made between turns of the event loop, so other requests are answered meanwhile
+    BATCH_CHUNK = 100
+    MAX_BODY_BYTES = 1024 * 1024
+
+    def __init__(self, manager: AsettoCorsaManager):
+        self.manager = manager
+        self.requests = 0
+        self.reloads = 0
+        self.reloaded_at: Optional[float] = None
+        self._reload: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Held by batches while they are made, so a reload never swaps the content halfway through one
+        self._content_lock = asyncio.Lock()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None) -> list:
+        """Starts listening on a TCP port, or a Unix socket, returning the bound addresses.
+        """
+        if socket_path is not None:
+            self._server = await asyncio.start_unix_server(self._serve_connection, socket_path)
+        else:
+            self._server = await asyncio.start_server(self._serve_connection, host, port)
+        return [sock.getsockname() for sock in self._server.sockets]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._reload is not None:
+            await self._reload
+
+    def reload(self) -> asyncio.Task:
+        """Rescans the content without blocking picks, joining a reload already running.
+        """
+        if self._reload is None or self._reload.done():
+            self._reload = asyncio.get_running_loop().create_task(self._reload_content())
+        return self._reload
+
+    async def _reload_content(self):
+        def scan() -> tuple:
+            content = {'cars': [], 'tracks': []}
+            for kind, assets, _, _ in self.manager.iter_refresh():
+                content[kind].extend(assets)
+            return content['cars'], content['tracks']
+
+        try:
+            cars, tracks = await asyncio.to_thread(scan)
+        except Exception as e:
+            # The old pools keep being picked from
+            print(f'! Failed to reload content: {e!r}', file=sys.stderr)
+            return
+        async with self._content_lock:
+            self.manager.set_content(cars, tracks)
+        self.reloads += 1
+        self.reloaded_at = time.time()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > PickService.MAX_BODY_BYTES:
+                    self._write(writer, 413, {'error': 'Request body is too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length > 0 else b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version.strip() == 'HTTP/1.1'
+                status, payload = await self.handle(method, target, body)
+                self._write(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            # Malformed requests and dropped clients just end the connection
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+
+    async def handle(self, method: str, target: str, body: bytes = b'') -> tuple:
+        """Answers one request, returning `(status, json payload)`.
+        """
+        self.requests += 1
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        try:
+            if url.path == '/pick':
+                return 200, await self._pick(query)
+            if url.path == '/batch':
+                options = json.loads(body) if method == 'POST' and body else {}
+                if not isinstance(options, dict):
+                    raise ValueError('The batch options must be a json object')
+                return 200, await self._batch(query, options)
+            if url.path == '/reload':
+                if method != 'POST':
+                    raise HttpError(405, 'Reload with POST')
+                self.reload()
+                return 202, {'reloading': True}
+            if url.path == '/status':
+                return 200, self._status()
+            raise HttpError(404, f'Unknown path: {url.path}')
+        except HttpError as e:
+            return e.status, {'error': str(e)}
+        except (ValueError, TypeError) as e:
+            # Bad filters, numbers and json, a text value for a numeric filter or a round nothing matches
+            return 400, {'error': str(e)}
+        except Exception as e:
+            print(f'! Failed to answer {method} {target}: {e!r}', file=sys.stderr)
+            return 500, {'error': 'Internal error'}
+
+    async def _pick(self, query: dict) -> dict:
+        car_constraints = parse_constraints(query.get('car'))
+        track_constraints = parse_constraints(query.get('track'))
+        seed = query.get('seed', [None])[0]
+        if seed is not None:
+            rounds = [{'car': car_constraints, 'track': track_constraints}]
+            async with self._content_lock:
+                # The same seed picks the same car without skins, so its skins are read first
+                pairing = next(PairingGenerator(self.manager, seed, rounds, skins=False).generate(1))
+                await self._load_skins(pairing.car)
+                return self._row(next(PairingGenerator(self.manager, seed, rounds).generate(1)))
+
+        car = self.manager.pick_random_car(**car_constraints)
+        layout = self.manager.pick_random_track(**track_constraints)
+        if car is None or layout is None:
+            raise HttpError(503 if len(car_constraints) + len(track_constraints) == 0 else 400,
+                            'No matching car or track')
+        await self._load_skins(car)
+        return self._row(Pairing(1, car, self.manager.pick_random_skin(car), layout))
+
+    @staticmethod
+    async def _load_skins(car: Car):
+        """Reads the skins of a car that were never loaded on a worker thread.
+        """
+        folders = car.unloaded_skin_folders()
+        if len(folders) == 0:
+            return
+        skins = await asyncio.to_thread(lambda: {folder: CarSkin(car.skin_path(folder)) for folder in folders})
+        car.add_loaded_skins(skins)
+
+    async def _batch(self, query: dict, options: dict) -> list:
+        count = int(options.get('count', query.get('n', [10])[0]))
+        if not 0 < count <= PickService.MAX_BATCH:
+            raise ValueError(f'Batches are 1 to {PickService.MAX_BATCH} pairings')
+        rounds = options.get('rounds')
+        if rounds is None:
+            rounds = [{'car': parse_constraints(query.get('car')), 'track': parse_constraints(query.get('track'))}]
+        elif not isinstance(rounds, list) or not all(
+                isinstance(round, dict) and all(isinstance(round.get(kind, {}), dict) for kind in ('car', 'track'))
+                for round in rounds):
+            raise ValueError('Rounds must be a list of {"car": {...}, "track": {...}} objects')
+        generator = PairingGenerator(self.manager,
+                                     options.get('seed', query.get('seed', [None])[0]),
+                                     rounds,
+                                     int(options.get('unique_window', query.get('unique_window', [0])[0])),
+                                     bool(options.get('skins', query.get('skins', ['1'])[0] != '0')))
+        rows = []
+        async with self._content_lock:
+            for pairing in generator.generate(count):
+                rows.append(self._row(pairing))
+                if len(rows) % PickService.BATCH_CHUNK == 0:
+                    await asyncio.sleep(0)
+        return rows
+
+    def _row(self, pairing: Pairing) -> dict:
+        row = pairing.to_row(self.manager)
+        del row['round']
+        return row
+
+    def _status(self) -> dict:
+        return {
+            'cars': len(self.manager.get_cars()),
+            'tracks': len(self.manager.get_tracks()),
+            'requests': self.requests,
+            'reloads': self.reloads,
+            'reloading': self._reload is not None and not self._reload.done(),
+            'reloaded_at': self.reloaded_at,
+        }
+
+
+def serve(manager: AsettoCorsaManager, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None) -> bool:
+    """Runs a PickService until interrupted, returning False if it could not listen.
+    """
+    async def run() -> bool:
+        service = PickService(manager)
+        try:
+            addresses = await service.start(host, port, socket_path)
+        except OSError as e:
+            print(f'! Failed to listen on {socket_path or f"{host}:{port}"}: {e.strerror or e}', file=sys.stderr)
+            return False
+        for address in addresses:
+            if isinstance(address, tuple):
+                print(f'Serving picks on http://{address[0]}:{address[1]}', flush=True)
+            else:
+                print(f'Serving picks on {address}', flush=True)
+        try:
+            await service.serve_forever()
+        finally:
+            await service.close()
+        return True
+
+    try:
+        return asyncio.run(run())
+    except KeyboardInterrupt:
+        return True
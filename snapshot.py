@@ -0,0 +1,479 @@
+"""Compact binary snapshots of the scanned content, for shipping a catalog to other machines.
+
+A snapshot holds every car, skin, track and layout with their parsed stats
+and the names of their ui and image files, as fixed width columns that are
+read straight from a memory mapped file. Opening one only reads the header
+and a small directory, so a snapshot of any size opens instantly, and a
+single field of a single asset is read without decoding anything else.
+
+Layout, all numbers little endian:
+
+    header      magic b'ACRSNAP\\0', uint32 version, uint32 reserved,
+                uint64 directory offset, uint64 directory length
+    columns     one after the other, each 8 byte aligned
+    directory   json with the content roots and, for every column, its
+                offset, byte size, array typecode and row count
+
+Tables are 'cars', 'skins', 'tracks' and 'layouts'. Text is stored once in
+the 'strings' table, text columns hold string ids with NO_STRING for None.
+Cars point to their skins and tracks to their layouts with a start and a
+count. Paths are kept relative to their content root so a snapshot can be
+loaded on a machine where the game is installed somewhere else.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Optional
+
+from game import AsettoCorsaManager, Car, CarSkin, Track, TrackLayout
+
+
+MAGIC = b'ACRSNAP\0'
+VERSION = 3
+HEADER = struct.Struct('<8sIIQQ')
+NO_STRING = 0xFFFFFFFF
+NO_ROOT = 0xFFFF
+ALIGNMENT = 8
+
+# table -> ((column, typecode), ...), 'S' columns are string ids stored as 'I'
+COLUMNS = {
+    'cars': (('root', 'H'), ('folder', 'S'), ('name', 'S'), ('ui', 'S'), ('preview', 'S'), ('encoding', 'S'),
+             ('recovery', 'S'), ('brand', 'S'), ('class', 'S'), ('country', 'S'), ('bhp', 'd'), ('weight', 'd'),
+             ('skin_start', 'I'), ('skin_count', 'I')),
+    # Skins that were never loaded only have their folder, see Car.get_skin
+    'skins': (('folder', 'S'), ('loaded', 'B'), ('name', 'S'), ('ui', 'S'), ('preview', 'S'), ('encoding', 'S'),
+              ('recovery', 'S'), ('priority', 'i')),
+    'tracks': (('root', 'H'), ('folder', 'S'), ('layout_start', 'I'), ('layout_count', 'I')),
+    # Layout folders are relative to their track folder
+    'layouts': (('folder', 'S'), ('name', 'S'), ('ui', 'S'), ('preview', 'S'), ('encoding', 'S'),
+                ('recovery', 'S'), ('country', 'S'), ('city', 'S'), ('run', 'S'), ('length', 'd'),
+                ('pitboxes', 'd'), ('outline', 'S'), ('map', 'S')),
+}
+STRING_COLUMNS = {(table, column) for table, spec in COLUMNS.items() for column, code in spec if code == 'S'}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _StringTable:
+
+    def __init__(self):
+        self.ids = {}
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+
+    def add(self, text) -> int:
+        if text is None:
+            return NO_STRING
+        text = str(text)
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.offsets) - 1
+            self.data += text.encode('utf-8')
+            self.offsets.append(len(self.data))
+        return string_id
+
+
+def _portable(path: str) -> str:
+    return path.replace(os.sep, '/')
+
+
+def _local(path: str) -> str:
+    return path.replace('/', os.sep)
+
+
+def _number(value: float):
+    # Stats are whole numbers unless the ui file said otherwise
+    return int(value) if value.is_integer() else value
+
+
+def write_snapshot(manager: AsettoCorsaManager, path: str, load_skins: bool = False) -> dict:
+    """Writes the manager's cars and tracks to a snapshot file, returning the rows of every table.
+
+    Skins are loaded lazily, so only the skins picked so far are written
+    with their data unless `load_skins` loads every skin first.
+    """
+    roots = [root.content for root in manager.content_roots]
+    strings = _StringTable()
+    columns = {table: {column: array('I' if code == 'S' else code) for column, code in spec}
+               for table, spec in COLUMNS.items()}
+
+    def place(folder_path: str, kind: str) -> tuple:
+        for i, root in enumerate(roots):
+            content = os.path.join(root, kind)
+            if folder_path.startswith(content + os.sep):
+                return i, _portable(folder_path[len(content) + 1:])
+        return NO_ROOT, _portable(folder_path)
+
+    def add_asset(table: dict, record: dict):
+        table['name'].append(strings.add(record['name']))
+        table['ui'].append(strings.add(record['ui']))
+        table['preview'].append(strings.add(record['preview']))
+        encoding, recovery = record['json']
+        table['encoding'].append(strings.add(encoding))
+        table['recovery'].append(strings.add(recovery))
+
+    cars, skins = columns['cars'], columns['skins']
+    for car in manager.get_cars():
+        if load_skins:
+            car.prefetch_skins()
+        record = car.to_record()
+        root, folder = place(car.folder_path, 'cars')
+        cars['root'].append(root)
+        cars['folder'].append(strings.add(folder))
+        add_asset(cars, record)
+        cars['brand'].append(strings.add(record['brand']))
+        cars['class'].append(strings.add(record['class']))
+        cars['country'].append(strings.add(record['country']))
+        cars['bhp'].append(record['bhp'])
+        cars['weight'].append(record['weight'])
+        cars['skin_start'].append(len(skins['folder']))
+        cars['skin_count'].append(len(record['skin_folders']))
+        for skin_folder in record['skin_folders']:
+            skin = record['skins'].get(skin_folder)
+            skins['folder'].append(strings.add(skin_folder))
+            skins['loaded'].append(skin is not None)
+            if skin is None:
+                skin = {'name': None, 'ui': None, 'preview': None, 'json': [None, None], 'priority': 0}
+            add_asset(skins, skin)
+            skins['priority'].append(skin['priority'])
+
+    tracks, layouts = columns['tracks'], columns['layouts']
+    for track in manager.get_tracks():
+        root, folder = place(track.folder_path, 'tracks')
+        tracks['root'].append(root)
+        tracks['folder'].append(strings.add(folder))
+        tracks['layout_start'].append(len(layouts['folder']))
+        tracks['layout_count'].append(len(track.get_layouts()))
+        for layout in track.get_layouts():
+            record = layout.to_record()
+            layouts['folder'].append(strings.add(_portable(os.path.relpath(layout.folder_path, track.folder_path))))
+            add_asset(layouts, record)
+            for column in ('country', 'city', 'run', 'outline', 'map'):
+                layouts[column].append(strings.add(record[column]))
+            layouts['length'].append(record['length'])
+            layouts['pitboxes'].append(record['pitboxes'])
+
+    blobs = {'strings.offsets': strings.offsets, 'strings.data': array('B', strings.data)}
+    for table, table_columns in columns.items():
+        for column, values in table_columns.items():
+            blobs[f'{table}.{column}'] = values
+
+    directory = {'roots': roots, 'columns': {}}
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        for name, values in blobs.items():
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            directory['columns'][name] = [f.tell(), len(values) * values.itemsize, values.typecode, len(values)]
+            if sys.byteorder != 'little':
+                values = array(values.typecode, values)
+                values.byteswap()
+            f.write(values.tobytes())
+        text = json.dumps(directory, separators=(',', ':')).encode('utf-8')
+        directory_offset = f.tell()
+        f.write(text)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, directory_offset, len(text)))
+    os.replace(temp_path, path)
+    return {table: len(table_columns['folder']) for table, table_columns in columns.items()}
+
+
+class Snapshot:
+    """A snapshot file opened with mmap, see write_snapshot.
+
+    Columns are memoryviews over the mapped file, nothing is copied or
+    decoded until it is read. Use `column` to scan numbers, `value` to read
+    single fields and `load_content` to build the assets for a manager.
+    Close the snapshot, or use it in a with block, to unmap the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # The map keeps a handle of its own, so the file is not held open
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f'Snapshot is empty: {path}') from None
+        self._views = {}
+        self._strings = {}
+        try:
+            magic, version, _, offset, length = HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotError(f'Not a snapshot: {path}')
+        if version != VERSION:
+            self.close()
+            raise SnapshotError(f'Snapshot version {version} is not supported: {path}')
+        try:
+            directory = json.loads(self._map[offset:offset + length])
+            self.roots, self._columns = self._check_directory(directory)
+        except (KeyError, TypeError, ValueError):
+            self.close()
+            raise SnapshotError(f'Snapshot is damaged: {path}') from None
+
+    def _check_directory(self, directory: dict) -> tuple:
+        """Returns the roots and columns of the directory, raising ValueError if they do not fit the file.
+        """
+        roots = [str(root) for root in directory['roots']]
+        columns = directory['columns']
+        expected = {'strings.offsets': 'I', 'strings.data': 'B'}
+        for table, spec in COLUMNS.items():
+            expected.update((f'{table}.{column}', 'I' if code == 'S' else code) for column, code in spec)
+        for name, typecode in expected.items():
+            offset, size, column_typecode, count = columns[name]
+            if column_typecode != typecode or offset % ALIGNMENT != 0 or offset + size > len(self._map) \
+                    or size != count * array(typecode).itemsize:
+                raise ValueError(f'Bad snapshot column: {name}')
+        for table, spec in COLUMNS.items():
+            if len({columns[f'{table}.{column}'][3] for column, _ in spec}) != 1:
+                raise ValueError(f'Snapshot table {table} has columns of different lengths')
+        return roots, columns
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def rows(self, table: str) -> int:
+        return self._columns[f'{table}.folder'][3]
+
+    def column(self, table: str, column: str) -> memoryview:
+        """Returns a column as a typed memoryview over the file, string columns as string ids.
+        """
+        name = f'{table}.{column}'
+        view = self._views.get(name)
+        if view is None:
+            if name not in self._columns:
+                raise ValueError(f'Unknown snapshot column: {name}')
+            offset, size, typecode, _ = self._columns[name]
+            raw = memoryview(self._map)[offset:offset + size]
+            if sys.byteorder != 'little' and typecode != 'B':
+                values = array(typecode, raw)
+                values.byteswap()
+                raw.release()
+                raw = memoryview(values)
+            view = self._views[name] = raw.cast(typecode)
+        return view
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id == NO_STRING:
+            return None
+        text = self._strings.get(string_id)
+        if text is None:
+            offsets = self.column('strings', 'offsets')
+            data = self.column('strings', 'data')
+            text = self._strings[string_id] = str(data[offsets[string_id]:offsets[string_id + 1]], 'utf-8')
+        return text
+
+    def value(self, table: str, column: str, row: int):
+        """Reads one field of one row, decoding only that field.
+        """
+        value = self.column(table, column)[row]
+        return self.string(value) if (table, column) in STRING_COLUMNS else value
+
+    def folder_path(self, table: str, row: int, roots: list = None) -> str:
+        """The folder of a car or track, under `roots` in place of the roots it was scanned from.
+        """
+        roots = roots or self.roots
+        root = self.column(table, 'root')[row]
+        folder = _local(self.value(table, 'folder', row))
+        if root == NO_ROOT:
+            return folder
+        return os.path.join(roots[root], table, folder)
+
+    def load_content(self, roots: list = None) -> tuple:
+        """Builds the cars and tracks of the snapshot, returning `(cars, tracks)`.
+
+        Only the fields picks and filters use are decoded here, the ui and
+        image files and the skins that were loaded are read from the
+        snapshot the first time an asset needs them, so the snapshot has to
+        stay open while the assets are in use. `roots` replaces the content
+        folders the snapshot was made from, in the same order, such as the
+        install folders on this machine.
+        """
+        roots = roots or self.roots
+        if len(roots) != len(self.roots):
+            raise ValueError(f'The snapshot has {len(self.roots)} content roots, got {len(roots)}')
+
+        cars = []
+        names, brands, classes, countries = (self.column('cars', column)
+                                             for column in ('name', 'brand', 'class', 'country'))
+        bhp, weight = self.column('cars', 'bhp'), self.column('cars', 'weight')
+        skin_start, skin_count = self.column('cars', 'skin_start'), self.column('cars', 'skin_count')
+        skin_folders = self.column('skins', 'folder')
+        for row in range(self.rows('cars')):
+            car = SnapshotCar(self, row)
+            car.name = self.string(names[row])
+            car.folder_path = self.folder_path('cars', row, roots)
+            car.brand = self.string(brands[row])
+            car.catagory = self.string(classes[row])
+            car.country = self.string(countries[row])
+            car.bhp = _number(bhp[row])
+            car.weight = _number(weight[row])
+            car._skin_folders = [self.string(skin_folders[skin])
+                                 for skin in range(skin_start[row], skin_start[row] + skin_count[row])]
+            cars.append(car)
+
+        tracks = []
+        folders, names, countries, cities, runs = (self.column('layouts', column)
+                                                   for column in ('folder', 'name', 'country', 'city', 'run'))
+        length, pitboxes = self.column('layouts', 'length'), self.column('layouts', 'pitboxes')
+        layout_start, layout_count = self.column('tracks', 'layout_start'), self.column('tracks', 'layout_count')
+        for row in range(self.rows('tracks')):
+            track = Track(self.folder_path('tracks', row, roots))
+            for layout_row in range(layout_start[row], layout_start[row] + layout_count[row]):
+                layout = SnapshotLayout(self, layout_row)
+                layout.name = self.string(names[layout_row])
+                layout.folder_path = os.path.join(track.folder_path, _local(self.string(folders[layout_row])))
+                layout.country = self.string(countries[layout_row])
+                layout.city = self.string(cities[layout_row])
+                layout.direction = self.string(runs[layout_row])
+                layout.length = _number(length[layout_row])
+                layout.pitboxes = _number(pitboxes[layout_row])
+                track.add_layout(layout)
+            tracks.append(track)
+        return cars, tracks
+
+    def read_files(self, asset, table: str, row: int):
+        """Sets the ui file, preview image and json encoding of an asset from its row.
+        """
+        asset._ui_name = self.value(table, 'ui', row)
+        asset._preview_name = self.value(table, 'preview', row)
+        asset.json_encoding = self.value(table, 'encoding', row)
+        asset.json_recovery = self.value(table, 'recovery', row)
+
+
+class _SnapshotAsset:
+    """Reads the fields of an asset that picks and filters do not use from its snapshot row on first access.
+
+    Subclasses read their own fields in `_read(snapshot, row)`.
+    """
+    __slots__ = ()
+
+    def _resolve(self):
+        if self._snapshot is not None:
+            snapshot, self._snapshot = self._snapshot, None
+            self._read(snapshot, self._row)
+
+    @property
+    def ui_file(self) -> Optional[str]:
+        self._resolve()
+        return super(_SnapshotAsset, self).ui_file
+
+    @property
+    def preview_image(self) -> Optional[str]:
+        self._resolve()
+        return super(_SnapshotAsset, self).preview_image
+
+    def read_data(self) -> dict:
+        self._resolve()
+        return super(_SnapshotAsset, self).read_data()
+
+    def to_record(self) -> dict:
+        self._resolve()
+        return super(_SnapshotAsset, self).to_record()
+
+
+class SnapshotCar(_SnapshotAsset, Car):
+    __slots__ = ('_snapshot', '_row')
+
+    def __init__(self, snapshot: Snapshot, row: int):
+        super(SnapshotCar, self).__init__()
+        self._snapshot = snapshot
+        self._row = row
+        # Only valid assets are written to a snapshot
+        self._valid = True
+
+    def _read(self, snapshot: Snapshot, row: int):
+        snapshot.read_files(self, 'cars', row)
+        start = snapshot.column('cars', 'skin_start')[row]
+        loaded = snapshot.column('skins', 'loaded')
+        for skin_row in range(start, start + snapshot.column('cars', 'skin_count')[row]):
+            if not loaded[skin_row]:
+                continue
+            folder = snapshot.value('skins', 'folder', skin_row)
+            skin = CarSkin()
+            skin.name = snapshot.value('skins', 'name', skin_row)
+            skin.folder_path = self.skin_path(folder)
+            snapshot.read_files(skin, 'skins', skin_row)
+            skin.priority = snapshot.column('skins', 'priority')[skin_row]
+            skin._valid = True
+            self._skins[folder] = skin
+
+    def get_skin(self, folder: str) -> Optional[CarSkin]:
+        # Skins that were loaded when the snapshot was made come from it
+        self._resolve()
+        return super(SnapshotCar, self).get_skin(folder)
+
+    def unloaded_skin_folders(self) -> list:
+        self._resolve()
+        return super(SnapshotCar, self).unloaded_skin_folders()
+
+
+class SnapshotLayout(_SnapshotAsset, TrackLayout):
+    __slots__ = ('_snapshot', '_row')
+
+    def __init__(self, snapshot: Snapshot, row: int):
+        super(SnapshotLayout, self).__init__()
+        self._snapshot = snapshot
+        self._row = row
+        self._valid = True
+
+    def _read(self, snapshot: Snapshot, row: int):
+        snapshot.read_files(self, 'layouts', row)
+        self._outline_name = snapshot.value('layouts', 'outline', row)
+        self._map_name = snapshot.value('layouts', 'map', row)
+
+    @property
+    def outline_file(self) -> Optional[str]:
+        self._resolve()
+        return super(SnapshotLayout, self).outline_file
+
+    @property
+    def map_file(self) -> Optional[str]:
+        self._resolve()
+        return super(SnapshotLayout, self).map_file
+
+
+def load_snapshot(manager: AsettoCorsaManager, path: str, roots: list = None) -> bool:
+    """Fills the manager's pools from a snapshot, like load_from_index.
+
+    Paths are moved to the manager's own content roots when it has as many
+    as the snapshot, otherwise they are kept as they were when the snapshot
+    was made unless `roots` is given. The file stays mapped for as long as
+    the assets read from it are in use. Returns False if the file cannot be
+    read as a snapshot.
+    """
+    snapshot = None
+    try:
+        snapshot = Snapshot(path)
+        if roots is None and len(manager.content_roots) == len(snapshot.roots):
+            roots = [root.content for root in manager.content_roots]
+        roots = roots or snapshot.roots
+        cars, tracks = snapshot.load_content(roots)
+    except (OSError, SnapshotError) as e:
+        if snapshot is not None:
+            snapshot.close()
+        print(f'! Failed to load snapshot {path}: {e}', file=sys.stderr)
+        return False
+    # Keys stay relative to the roots when the game is not installed here
+    manager.set_content(cars, tracks, {kind: [os.path.join(root, kind) for root in roots]
+                                       for kind in ('cars', 'tracks')})
+    return True
@@ -0,0 +1,75 @@
+"""Checks that the content index notices edited content.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import AsettoCorsaManager  # noqa: E402
+
+
+def write_json(path: str, data: dict, mtime_ns: int = None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Rewritten in place, as editors that do not replace the file do
+    with open(path, 'r+' if os.path.isfile(path) else 'w', encoding='utf-8') as f:
+        f.truncate()
+        json.dump(data, f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='acr_test_')
+        self.index_path = os.path.join(self.root, 'index.db')
+        content = os.path.join(self.root, 'content')
+        open(os.path.join(self.root, 'AssettoCorsa.exe'), 'w').close()
+        self.car_ui = os.path.join(content, 'cars', 'car', 'ui', 'ui_car.json')
+        self.skin_ui = os.path.join(content, 'cars', 'car', 'skins', 'red', 'ui_skin.json')
+        self.layout_ui = os.path.join(content, 'tracks', 'track', 'ui', 'short', 'ui_track.json')
+        write_json(self.car_ui, {'name': 'Car', 'specs': {'bhp': '300bhp', 'weight': '1200kg'}})
+        write_json(self.skin_ui, {'skinname': 'Red'})
+        write_json(self.layout_ui, {'name': 'Short', 'length': '2 km'})
+        write_json(os.path.join(content, 'tracks', 'track', 'ui', 'long', 'ui_track.json'),
+                   {'name': 'Long', 'length': '5 km'})
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def scan(self) -> AsettoCorsaManager:
+        manager = AsettoCorsaManager(cache_path=self.index_path)
+        manager.set_install_path(self.root)
+        manager.set_prefetch_skins(True)
+        manager.refresh_cache()
+        return manager
+
+    def test_unchanged_content_comes_from_the_index(self):
+        self.scan()
+        manager = self.scan()
+        self.assertEqual(manager.get_cars()[0].skins[0].name, 'Red')
+
+    def test_skin_edited_in_place(self):
+        self.scan()
+        mtime = os.stat(self.skin_ui).st_mtime_ns
+        write_json(self.skin_ui, {'skinname': 'Blue'}, mtime + 10 ** 9)
+        manager = self.scan()
+        self.assertEqual(manager.get_cars()[0].skins[0].name, 'Blue')
+
+    def test_layout_edited_in_place(self):
+        self.scan()
+        mtime = os.stat(self.layout_ui).st_mtime_ns
+        write_json(self.layout_ui, {'name': 'Shorter', 'length': '1 km'}, mtime + 10 ** 9)
+        manager = self.scan()
+        layouts = {layout.name: layout.length for layout in manager.get_tracks()[0].get_layouts()}
+        self.assertEqual(layouts, {'Long': 5000, 'Shorter': 1000})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Checks the free text numbers found in ui files.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import NumberUtil  # noqa: E402
+
+
+class LengthTest(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(NumberUtil.extract_length_meters('5.8 km'), 5800)
+        self.assertEqual(NumberUtil.extract_length_meters('4200m'), 4200)
+        self.assertEqual(NumberUtil.extract_length_meters('1.2 mi'), 1931)
+        self.assertEqual(NumberUtil.extract_length_meters(''), 0)
+
+    def test_without_unit(self):
+        # Decimals are km, whole numbers metres
+        self.assertEqual(NumberUtil.extract_length_meters('5.8'), 5800)
+        self.assertEqual(NumberUtil.extract_length_meters('3000'), 3000)
+
+    def test_decimal_comma(self):
+        self.assertEqual(NumberUtil.extract_length_meters('4,2km'), 4200)
+        self.assertEqual(NumberUtil.extract_length_meters('5,832 km'), 5832)
+
+    def test_thousand_separators(self):
+        self.assertEqual(NumberUtil.extract_length_meters('4,200m'), 4200)
+        self.assertEqual(NumberUtil.extract_length_meters('5 793 m'), 5793)
+        self.assertEqual(NumberUtil.extract_length_meters('20 832m'), 20832)
+        self.assertEqual(NumberUtil.extract_length_meters('4.574,5 m'), 4574)
+        self.assertEqual(NumberUtil.extract_length_meters('4,574.5m'), 4574)
+
+
+
+class NumberTest(unittest.TestCase):
+
+    def test_units_and_flags(self):
+        self.assertEqual(NumberUtil.extract_number('540bhp'), 540)
+        self.assertEqual(NumberUtil.extract_number('1250kg*'), 1250)
+        self.assertEqual(NumberUtil.extract_number('450.5 hp'), 450.5)
+        self.assertEqual(NumberUtil.extract_number('--'), 0)
+
+    def test_thousand_separators(self):
+        self.assertEqual(NumberUtil.extract_number('1,250kg'), 1250)
+        self.assertEqual(NumberUtil.extract_number('1.250kg'), 1250)
+        self.assertEqual(NumberUtil.extract_number('1 250 kg'), 1250)
+
+    def test_decimal_comma(self):
+        self.assertEqual(NumberUtil.extract_number('1,25'), 1.25)
+        self.assertEqual(NumberUtil.extract_number('12,5 kg'), 12.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Checks that content loaded from a snapshot matches a scan.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import AsettoCorsaManager  # noqa: E402
+from pairings import PairingGenerator  # noqa: E402
+from snapshot import HEADER, load_snapshot, write_snapshot  # noqa: E402
+
+
+def write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='acr_test_')
+        self.path = os.path.join(self.root, 'content.snap')
+        content = os.path.join(self.root, 'content')
+        open(os.path.join(self.root, 'AssettoCorsa.exe'), 'w').close()
+        car = os.path.join(content, 'cars', 'car')
+        write_json(os.path.join(car, 'ui', 'ui_car.json'),
+                   {'name': 'Car', 'brand': 'Brand', 'specs': {'bhp': '300bhp', 'weight': '1200kg'}})
+        write_json(os.path.join(car, 'skins', 'red', 'ui_skin.json'), {'skinname': 'Red', 'priority': 2})
+        write_json(os.path.join(car, 'skins', 'blue', 'ui_skin.json'), {'skinname': 'Blue'})
+        open(os.path.join(car, 'skins', 'red', 'preview.jpg'), 'w').close()
+        track = os.path.join(content, 'tracks', 'track', 'ui')
+        write_json(os.path.join(track, 'short', 'ui_track.json'), {'name': 'Short', 'length': '2 km'})
+        write_json(os.path.join(track, 'long', 'ui_track.json'), {'name': 'Long', 'length': '5,5 km'})
+        open(os.path.join(track, 'long', 'outline.png'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def manager(self) -> AsettoCorsaManager:
+        manager = AsettoCorsaManager()
+        manager.set_install_path(self.root)
+        return manager
+
+    def test_snapshot_matches_the_scan(self):
+        scanned = self.manager()
+        scanned.refresh_cache()
+        scanned.get_cars()[0].get_skin('red')
+        write_snapshot(scanned, self.path)
+
+        loaded = self.manager()
+        self.assertTrue(load_snapshot(loaded, self.path))
+        car = loaded.get_cars()[0]
+        self.assertEqual((car.name, car.brand, car.bhp, car.weight), ('Car', 'Brand', 300, 1200))
+        self.assertEqual(car.skin_folders, ['blue', 'red'])
+        self.assertEqual(car.get_skin('red').priority, 2)
+        self.assertTrue(car.get_skin('red').preview_image.endswith('preview.jpg'))
+        # Skins that were not loaded in the snapshot come from disk
+        self.assertEqual(car.get_skin('blue').name, 'Blue')
+        scanned.get_cars()[0].get_skin('blue')
+        self.assertEqual(car.to_record(), scanned.get_cars()[0].to_record())
+        self.assertEqual([track.to_record() for track in loaded.get_tracks()],
+                         [track.to_record() for track in scanned.get_tracks()])
+        layout = next(layout for layout in loaded.get_tracks()[0].get_layouts() if layout.name == 'Long')
+        self.assertEqual(layout.length, 5500)
+        self.assertTrue(layout.outline_file.endswith('outline.png'))
+
+    def test_snapshot_without_an_install(self):
+        scanned = self.manager()
+        scanned.refresh_cache()
+        write_snapshot(scanned, self.path, load_skins=True)
+        # The install is gone, as on a host that only has the snapshot
+        shutil.rmtree(os.path.join(self.root, 'content'))
+        os.remove(os.path.join(self.root, 'AssettoCorsa.exe'))
+
+        loaded = self.manager()
+        self.assertFalse(loaded.is_valid())
+        self.assertTrue(load_snapshot(loaded, self.path))
+        self.assertEqual([loaded.asset_key(car) for car in loaded.get_cars()], ['car'])
+        self.assertEqual(sorted(loaded.asset_key(layout) for track in loaded.get_tracks()
+                                for layout in track.get_layouts()), ['track/ui/long', 'track/ui/short'])
+        self.assertEqual(loaded.get_cars()[0].get_skin('red').name, 'Red')
+
+        rows = [pairing.to_row(loaded) for pairing in PairingGenerator(loaded, 'a').generate(2)]
+        self.assertEqual([row['car'] for row in rows], ['car', 'car'])
+
+    def test_damaged_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertFalse(load_snapshot(self.manager(), self.path))
+
+    def test_truncated_snapshot(self):
+        scanned = self.manager()
+        scanned.refresh_cache()
+        write_snapshot(scanned, self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for size in (HEADER.size - 1, HEADER.size, len(data) // 2, len(data) - 1):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            self.assertFalse(load_snapshot(self.manager(), self.path), size)
+
+    def test_malformed_directory(self):
+        scanned = self.manager()
+        scanned.refresh_cache()
+        write_snapshot(scanned, self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        magic, version, reserved, offset, length = HEADER.unpack_from(data)
+        directory = json.loads(data[offset:offset + length])
+        broken = [
+            [],
+            {'roots': directory['roots']},
+            dict(directory, columns=dict(directory['columns'], **{'cars.bhp': [0, 8]})),
+            dict(directory, columns=dict(directory['columns'], **{'cars.bhp': [1 << 20, 8, 'd', 1]})),
+            dict(directory, columns=dict(directory['columns'], **{'cars.bhp': [8, 8 * 1000, 'd', 1000]})),
+        ]
+        for value in broken:
+            text = json.dumps(value).encode('utf-8')
+            with open(self.path, 'wb') as f:
+                f.write(HEADER.pack(magic, version, reserved, offset, len(text)))
+                f.write(data[HEADER.size:offset])
+                f.write(text)
+            self.assertFalse(load_snapshot(self.manager(), self.path), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
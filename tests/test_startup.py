@@ -0,0 +1,46 @@
+"""Checks that the game module stays light to import for the command line.
+
+    python -m unittest discover tests
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from game import HEAVY_MODULES, IMPORT_BUDGET_MS  # noqa: E402
+
+
+def import_game() -> tuple:
+    """Imports game in a fresh interpreter, returning the import time in ms and the modules it loaded.
+    """
+    code = (
+        'import sys, time\n'
+        'start = time.perf_counter()\n'
+        'import game\n'
+        'print((time.perf_counter() - start) * 1000)\n'
+        'print("\\n".join(sys.modules))\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed, *modules = result.stdout.splitlines()
+    return float(elapsed), set(modules)
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_no_heavy_modules(self):
+        _, modules = import_game()
+        for name in ('PySide6', 'numpy', 'sqlite3') + HEAVY_MODULES:
+            loaded = sorted(module for module in modules if module == name or module.startswith(name + '.'))
+            self.assertEqual(loaded, [], f'importing game loads {name}')
+
+    def test_import_time(self):
+        # Twice the budget, shared test machines are slower than check-startup runs
+        best = min(import_game()[0] for _ in range(3))
+        self.assertLess(best, IMPORT_BUDGET_MS * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Checks the files found for track layouts.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import Track  # noqa: E402
+
+
+def write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def touch(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+class MapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='acr_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_single_layout_map(self):
+        folder = os.path.join(self.root, 'track')
+        write_json(os.path.join(folder, 'ui', 'ui_track.json'), {'name': 'Track'})
+        # map.ini sorts first and is not an image
+        touch(os.path.join(folder, 'map.ini'))
+        touch(os.path.join(folder, 'map.png'))
+        layout = Track.load(folder).get_layouts()[0]
+        self.assertEqual(layout.map_file, os.path.join(folder, 'map.png'))
+
+    def test_single_layout_without_map(self):
+        folder = os.path.join(self.root, 'track')
+        write_json(os.path.join(folder, 'ui', 'ui_track.json'), {'name': 'Track'})
+        touch(os.path.join(folder, 'map.ini'))
+        self.assertIsNone(Track.load(folder).get_layouts()[0].map_file)
+
+    def test_multi_layout_maps(self):
+        folder = os.path.join(self.root, 'track')
+        for name in ('short', 'long'):
+            write_json(os.path.join(folder, 'ui', name, 'ui_track.json'), {'name': name})
+        touch(os.path.join(folder, 'long', 'map.ini'))
+        touch(os.path.join(folder, 'long', 'map.png'))
+        touch(os.path.join(folder, 'short', 'map.ini'))
+        maps = {layout.name: layout.map_file for layout in Track.load(folder).get_layouts()}
+        self.assertEqual(maps, {'long': os.path.join(folder, 'long', 'map.png'), 'short': None})
+
+        record = Track.load(folder).to_record()
+        self.assertEqual(Track.from_record(record).to_record(), record)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PySide6.QtCore import QBuffer, QByteArray, QIODevice, QSize, Qt
+from PySide6.QtGui import QImage, QImageReader
+
+
+class ThumbnailCache:
+    """Downscaled preview images, cached in memory and on disk.
+
+    Thumbnails are at most `size` pixels on their longest side. Decoded
+    thumbnails are kept in memory up to `memory_bytes`, dropping the least
+    recently used first, so showing the same preview again decodes nothing.
+    They are also written to `cache_dir` keyed by the image path and its
+    modification time, so the next launch only has to decode the small copy.
+    Images with the same content, such as a preview shared by several skins,
+    are stored and kept in memory once.
+
+    Images are loaded as QImage so thumbnails can be made off the GUI thread.
+    """
+
+    SIZE = 512
+    MEMORY_BYTES = 64 * 1024 * 1024
+    DISK_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, cache_dir: str = None, size: int = SIZE, memory_bytes: int = MEMORY_BYTES,
+                 disk_bytes: int = DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._images = OrderedDict()  # digest -> QImage, least recently used first
+        self._digests = {}  # (path, signature) -> digest
+        self._memory_used = 0
+        self._lock = threading.RLock()
+        self._db = None
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.prune()
+
+    @property
+    def memory_used(self) -> int:
+        return self._memory_used
+
+    def get(self, path: str) -> Optional[QImage]:
+        """Returns the thumbnail of an image file, or None if it cannot be read.
+        """
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = f'{stat.st_mtime_ns}:{stat.st_size}'
+
+        with self._lock:
+            digest = self._digests.get((path, signature))
+            if digest is not None and digest in self._images:
+                self._images.move_to_end(digest)
+                return self._images[digest]
+
+        if digest is None:
+            digest = self._load_digest(path, signature)
+        image = self._read_thumbnail(digest) if digest is not None else None
+
+        if image is None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                print(f'! Failed to read image {path}: {e}')
+                return None
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            # Another file with the same content may have made it already
+            image = self._read_thumbnail(digest)
+            if image is None:
+                image = self._decode(data)
+                if image is None:
+                    print(f'! Failed to decode image {path}')
+                    return None
+                self._write_thumbnail(digest, image)
+            self._store_digest(path, signature, digest)
+
+        with self._lock:
+            self._digests[(path, signature)] = digest
+            self._remember(digest, image)
+        return image
+
+    def clear(self):
+        """Drops every thumbnail held in memory, the disk cache is kept.
+        """
+        with self._lock:
+            self._images.clear()
+            self._digests.clear()
+            self._memory_used = 0
+
+    def _remember(self, digest: str, image: QImage):
+        if digest in self._images:
+            self._images.move_to_end(digest)
+            return
+        self._images[digest] = image
+        self._memory_used += image.sizeInBytes()
+        while self._memory_used > self.memory_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._memory_used -= evicted.sizeInBytes()
+
+    def _decode(self, data: bytes) -> Optional[QImage]:
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        full = reader.size()
+        if full.isValid() and max(full.width(), full.height()) > self.size:
+            # Lets jpeg decode straight at the smaller size
+            scaled = full.scaled(QSize(self.size, self.size), Qt.KeepAspectRatio)
+            reader.setScaledSize(scaled)
+        image = reader.read()
+        if image.isNull():
+            return None
+        return image
+
+    def _thumbnail_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f'{digest}.png')
+
+    def _read_thumbnail(self, digest: str) -> Optional[QImage]:
+        with self._lock:
+            image = self._images.get(digest)
+        if image is not None:
+            return image
+        if self.cache_dir is None:
+            return None
+        path = self._thumbnail_path(digest)
+        image = QImage(path)
+        if image.isNull():
+            return None
+        try:
+            # Keeps recently used thumbnails from being pruned
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def _write_thumbnail(self, digest: str, image: QImage):
+        if self.cache_dir is None:
+            return
+        path = self._thumbnail_path(digest)
+        # Written under another name first so a half written file is never read
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        if not image.save(temp_path, 'PNG'):
+            print(f'! Failed to write thumbnail {path}')
+            return
+        os.replace(temp_path, path)
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self.cache_dir is None or self._db is not None:
+            return self._db
+        path = os.path.join(self.cache_dir, 'thumbnails.db')
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._create_table()
+        except sqlite3.DatabaseError:
+            # Only a cache, start over if it cannot be read.
+            print(f'! Thumbnail index is unreadable, rebuilding: {path}')
+            self.close()
+            with open(path, 'wb'):
+                pass
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._create_table()
+        return self._db
+
+    def _create_table(self):
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                digest TEXT NOT NULL
+            )''')
+        self._db.commit()
+
+    def _load_digest(self, path: str, signature: str) -> Optional[str]:
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute('SELECT signature, digest FROM thumbnails WHERE path = ?', (path,)).fetchone()
+            except sqlite3.DatabaseError as e:
+                print(f'! Failed to read thumbnail index: {e}')
+                return None
+        if row is None or row[0] != signature:
+            return None
+        return row[1]
+
+    def _store_digest(self, path: str, signature: str, digest: str):
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?)', (path, signature, digest))
+            except sqlite3.DatabaseError as e:
+                print(f'! Failed to write thumbnail index: {e}')
+
+    def prune(self):
+        """Deletes the least recently used thumbnails on disk over `disk_bytes`.
+
+        Index rows of deleted thumbnails are left behind, the thumbnail is
+        simply made again when one of them is looked up.
+        """
+        if self.cache_dir is None:
+            return
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except OSError as e:
+                print(f'! Failed to remove thumbnail {path}: {e}')
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
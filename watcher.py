@@ -0,0 +1,71 @@
+"""Finds the content folders that were added or removed while the app runs.
+
+Only the cars and tracks folders of every content root are watched, which
+report content folders being added, removed or renamed, as installing or
+removing content does. Files edited in place inside a content folder, such
+as a skin's ui file, do not change the root and are only picked up by the
+next scan, where the content index signatures notice them.
+"""
+import os
+from typing import Optional
+
+from game import AsettoCorsaManager
+
+
+KINDS = ('cars', 'tracks')
+
+
+def watch_paths(manager: AsettoCorsaManager) -> list:
+    """Returns the cars and tracks folders of every content root that exist.
+    """
+    if not manager.is_valid():
+        return []
+    return [root for kind in KINDS for root in manager.content_paths(kind) if os.path.isdir(root)]
+
+
+def locate_root(manager: AsettoCorsaManager, path: str) -> Optional[str]:
+    """Returns the kind of the cars or tracks folder at a changed path, or None.
+    """
+    for kind in KINDS:
+        if path in manager.content_paths(kind):
+            return kind
+    return None
+
+
+def list_folders(root: str) -> set:
+    try:
+        with os.scandir(root) as entries:
+            return {entry.name for entry in entries if entry.is_dir()}
+    except OSError:
+        return set()
+
+
+def list_roots(manager: AsettoCorsaManager, listings: dict = None) -> dict:
+    """The folders in every watched folder, to compare changes against with changed_folders.
+
+    Folders that are in `listings` keep the listing they have there.
+    """
+    listings = listings or {}
+    return {root: listings[root] if root in listings else list_folders(root) for root in watch_paths(manager)}
+
+
+def changed_folders(manager: AsettoCorsaManager, paths, listings: dict) -> dict:
+    """Turns changed cars and tracks folders into the content folders to refresh, by kind.
+
+    The listing of every changed folder is compared with its last listing
+    in `listings`, which is updated. A folder that is only in one of them
+    was added or removed there and may also uncover or hide one in another
+    root. Folders that were already there, such as ones shadowed by a higher
+    priority root or without valid content, are left alone.
+    """
+    changes = {}
+    for root in paths:
+        kind = locate_root(manager, root)
+        if kind is None:
+            continue
+        listed = list_folders(root)
+        changed = listed.symmetric_difference(listings.get(root, set()))
+        listings[root] = listed
+        if len(changed) > 0:
+            changes.setdefault(kind, set()).update(changed)
+    return changes